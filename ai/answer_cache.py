@@ -0,0 +1,104 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+import numpy as np
+import numpy.typing as npt
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 60 * 60))
+
+
+@dataclass
+class CachedAnswer:
+    vector: npt.NDArray[np.float32]
+    answer: str
+    created_at: float
+
+
+class AnswerCache:
+    """
+    Per-chat cache of answers, keyed by the embedding of the question.
+
+    A question is answered from the cache when its cosine similarity to a
+    previously answered question of the same chat is at least `threshold`.
+    Entries expire after `ttl` seconds, each chat keeps at most
+    `max_entries_per_chat` answers and at most `max_chats` chats are kept.
+    """
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries_per_chat: int = 128,
+        max_chats: int = 1000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries_per_chat = max_entries_per_chat
+        self.max_chats = max_chats
+        self._clock = clock
+        self._chats: OrderedDict[int, list[CachedAnswer]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: int, embedding: list[float]) -> str | None:
+        """
+        Returns the cached answer of the most similar question of the chat,
+        or None if no cached question is similar enough.
+        """
+        entries = self._live_entries(chat_id)
+        if not entries:
+            self.misses += 1
+            return None
+
+        query = _normalize(embedding)
+        similarities = np.stack([entry.vector for entry in entries]) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._chats.move_to_end(chat_id)
+        return entries[best].answer
+
+    def put(self, chat_id: int, embedding: list[float], answer: str) -> None:
+        """
+        Caches the answer to a question of the chat.
+        """
+        entries = self._live_entries(chat_id)
+        entries.append(CachedAnswer(_normalize(embedding), answer, self._clock()))
+        del entries[: -self.max_entries_per_chat]
+        self._chats[chat_id] = entries
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def invalidate(self, chat_id: int | None) -> None:
+        """
+        Drops every cached answer of the chat, e.g. because new messages
+        may change the answers.
+        """
+        if chat_id is not None:
+            self._chats.pop(chat_id, None)
+
+    def _live_entries(self, chat_id: int) -> list[CachedAnswer]:
+        oldest = self._clock() - self.ttl
+        entries = [
+            entry for entry in self._chats.get(chat_id, []) if entry.created_at > oldest
+        ]
+        if chat_id in self._chats:
+            self._chats[chat_id] = entries
+        return entries
+
+
+def _normalize(embedding: list[float]) -> npt.NDArray[np.float32]:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+answer_cache = AnswerCache()
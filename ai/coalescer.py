@@ -0,0 +1,172 @@
+import asyncio
+import os
+from typing import Callable
+
+from openai.error import InvalidRequestError
+
+from ai import EMBEDDING_MODEL, logger
+from ai.embedder import embed, embed_cached
+from ai.embedding_cache import EmbeddingCache, embedding_cache
+from ai.embedding_engine import MAX_INPUT_TOKENS, MAX_REQUEST_TOKENS, mean_embedding
+from ai.tokens import chunk_texts, num_tokens
+from utils.executors import CPU_EXECUTOR, run_blocking
+
+# Limits of a single coalesced request to the embeddings endpoint, whose
+# tokens are capped by MAX_REQUEST_TOKENS like the requests of imports.
+MAX_BATCH_SIZE = 2000  # embed() accepts at most 2000 inputs
+WINDOW_SECONDS = float(os.getenv("EMBED_COALESCE_WINDOW_MS", 50)) / 1000
+
+_Result = list[float] | BaseException
+
+
+def count_embedding_tokens(text: str) -> int:
+    """
+    Return the number of tokens the embedding model sees for a text.
+    """
+    return num_tokens(text, model=EMBEDDING_MODEL)
+
+
+def chunk_embedding_input(text: str) -> list[tuple[str, int]]:
+    """
+    Split a text into chunks the embedding model takes, with their tokens.
+    """
+    return chunk_texts([text], MAX_INPUT_TOKENS, model=EMBEDDING_MODEL)[0]
+
+
+class EmbeddingCoalescer:
+    """
+    Collects texts to be embedded from concurrent callers and sends them
+    to the OpenAI API as a single request.
+
+    A batch is flushed when the oldest pending text has waited `window`
+    seconds, or as soon as it reaches `max_batch_size` texts or
+    `max_batch_tokens` tokens, whichever comes first. Every caller awaits
+    its own vector, or its own error: when the API rejects a batch, its
+    texts are retried one per request so only the callers of the rejected
+    text fail. Texts longer than `max_input_tokens` are not batched, they
+    are split into chunks embedded in a request of their own. Texts found
+    in `cache` are not sent at all.
+    """
+
+    def __init__(
+        self,
+        window: float = WINDOW_SECONDS,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_batch_tokens: int = MAX_REQUEST_TOKENS,
+        embed_fn: Callable[[list[str]], list[list[float]]] = embed,
+        count_tokens: Callable[[str], int] = count_embedding_tokens,
+        max_input_tokens: int = MAX_INPUT_TOKENS,
+        chunk: Callable[[str], list[tuple[str, int]]] = chunk_embedding_input,
+        cache: EmbeddingCache | None = embedding_cache,
+    ) -> None:
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_input_tokens = max_input_tokens
+        self._embed_fn = embed_fn
+        self._count_tokens = count_tokens
+        self._chunk = chunk
+        self.cache = cache
+        self._pending: list[tuple[str, asyncio.Future[list[float]]]] = []
+        self._pending_tokens = 0
+        self._flush_handle: asyncio.TimerHandle | None = None
+        # keep references to in-flight requests so they are not garbage collected
+        self._in_flight: set[asyncio.Task[None]] = set()
+
+    async def embed(self, text: str) -> list[float]:
+        """
+        Embeds a single text as part of the next coalesced batch.
+        ---
+        Parameters
+            text: str
+                    The text to be embedded. Must not be empty.
+        Returns
+            embedding: list[float]
+                    The embedding of the text.
+        """
+        if text == "":
+            raise ValueError("Cannot embed an empty text")
+        tokens = await run_blocking(CPU_EXECUTOR, self._count_tokens, text)
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[list[float]] = loop.create_future()
+        if tokens > self.max_input_tokens:
+            return await self._embed_long(text)
+
+        # a text that does not fit goes into the next batch
+        if self._pending and self._pending_tokens + tokens > self.max_batch_tokens:
+            self.flush()
+
+        self._pending.append((text, future))
+        self._pending_tokens += tokens
+
+        if (
+            len(self._pending) >= self.max_batch_size
+            or self._pending_tokens >= self.max_batch_tokens
+        ):
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        """
+        Sends all pending texts now.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        self._pending_tokens = 0
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _embed_long(self, text: str) -> list[float]:
+        chunks = await run_blocking(CPU_EXECUTOR, self._chunk, text)
+        embeddings = await embed_cached(
+            [chunk for chunk, _ in chunks], self._embed_fn, self.cache
+        )
+        return mean_embedding(embeddings, [tokens for _, tokens in chunks])
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future[list[float]]]]) -> None:
+        # identical texts from different chats are only embedded once
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        by_text: dict[str, _Result]
+        try:
+            embeddings = await embed_cached(unique_texts, self._embed_fn, self.cache)
+            by_text = dict(zip(unique_texts, embeddings))
+        except InvalidRequestError as e:
+            if len(unique_texts) == 1:
+                by_text = {unique_texts[0]: e}
+            else:
+                logger.warning(
+                    f"Coalesced embedding rejected, retrying one by one: {e}"
+                )
+                by_text = await self._send_one_by_one(unique_texts)
+        except Exception as e:
+            logger.error(f"Coalesced embedding of {len(batch)} texts failed: {e}")
+            by_text = {text: e for text in unique_texts}
+
+        for text, future in batch:
+            if future.done():
+                continue
+            result = by_text[text]
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _send_one_by_one(self, texts: list[str]) -> dict[str, _Result]:
+        results = await asyncio.gather(
+            *(embed_cached([text], self._embed_fn, self.cache) for text in texts),
+            return_exceptions=True,
+        )
+        return {
+            text: result if isinstance(result, BaseException) else result[0]
+            for text, result in zip(texts, results)
+        }
+
+
+embedding_coalescer = EmbeddingCoalescer()
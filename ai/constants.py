@@ -8,9 +8,12 @@ GPT_INFO: list[dict[InfoKeys, str]] = [
 of a Telegram group chat and can answer questions you have seen answered previously. \
 Your answers are meant to be concise, but contain all relevant information.",
     },
-    {"role": "user"},
 ]
 
+# What GPT is told to answer when the messages do not hold the answer, and
+# the fallback answer when the completion times out
+NO_ANSWER = "I could not find an answer."
+
 INTRODUCTION = 'The below messages are from individual members of a \
 Telegram group chat. Use them to answer the subsequent question. Keep the answer fairly short \
 and straightforward.\
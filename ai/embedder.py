@@ -5,9 +5,10 @@ from openai.error import RateLimitError
 
 from ai.aitypes import EmbedResponseData
 from ai import EMBEDDING_MODEL, logger
+from ai.embedding_cache import EmbeddingCache, embedding_cache
 from dotenv import load_dotenv
-from typing import Generator
-from utils.batch import split_into_batches
+from typing import Callable
+from utils.executors import CPU_EXECUTOR, OPENAI_EXECUTOR, run_blocking
 
 load_dotenv()
 
@@ -15,25 +16,75 @@ if os.getenv("ENVIRONMENT") != "TEST":
     openai.api_key = os.environ["OPENAI_API_KEY"]
 
 
-def embed(messages: list[str]) -> list[list[float]]:
+def embed(
+    messages: list[str], request_timeout: float | None = None
+) -> list[list[float]]:
     """
     This function embeds the messages using the openai api.
     ---
     Parameters
         messages: list[TMessage]
                 The list of messages to be embedded.
+        request_timeout: float | None
+                Seconds after which a request to the api is aborted.
     Returns
         embeddings: list[list[float]]
                 The list of embeddings of the messages.
     """
     messages = list(filter(lambda msg: msg != "", messages))
     assert 0 < len(messages) < 2001, "The number of messages must be between 1 and 2000"
+    return _request_embeddings(messages, request_timeout)
+
+
+async def embed_cached(
+    messages: list[str],
+    request: Callable[[list[str]], list[list[float]]] = embed,
+    cache: EmbeddingCache | None = embedding_cache,
+) -> list[list[float]]:
+    """
+    Embeds the messages that are not in the embedding cache with `request`,
+    a blocking call to the api run in OPENAI_EXECUTOR. The cache is read and
+    written in CPU_EXECUTOR, so lookups never wait behind api requests.
+    ---
+    Parameters
+        messages: list[str]
+                The messages to be embedded.
+        request: Callable[[list[str]], list[list[float]]]
+                Embeds the messages the cache misses, like embed.
+        cache: EmbeddingCache | None
+                The cache to look embeddings up in and store them to.
+    Returns
+        embeddings: list[list[float]]
+                The embedding of every message, in order.
+    """
+    if cache is None:
+        return await run_blocking(OPENAI_EXECUTOR, request, messages)
+
+    cached = await run_blocking(CPU_EXECUTOR, cache.get_many, messages)
+    missing = list(
+        dict.fromkeys(msg for msg, hit in zip(messages, cached) if hit is None)
+    )
+    fresh: dict[str, list[float]] = {}
+    if missing:
+        embeddings = await run_blocking(OPENAI_EXECUTOR, request, missing)
+        fresh = dict(zip(missing, embeddings))
+        await run_blocking(CPU_EXECUTOR, cache.put_many, missing, embeddings)
+    return [
+        hit if hit is not None else fresh[msg] for msg, hit in zip(messages, cached)
+    ]
+
+
+def _request_embeddings(
+    messages: list[str], request_timeout: float | None = None
+) -> list[list[float]]:
+    # only passed when set, the client applies its own default otherwise
+    options = {} if request_timeout is None else {"request_timeout": request_timeout}
     embedded = False
     seconds_to_wait: float = 1
     while not embedded:
         try:
             response: EmbedResponseData = openai.Embedding.create(
-                model=EMBEDDING_MODEL, input=messages
+                model=EMBEDDING_MODEL, input=messages, **options
             )  # type: ignore
             for i, data in enumerate(response["data"]):
                 assert (
@@ -45,25 +96,3 @@ def embed(messages: list[str]) -> list[list[float]]:
             logger.info(f"Rate limit error, waiting {seconds_to_wait} seconds...")
             time.sleep(seconds_to_wait)
     return [data["embedding"] for data in response["data"]]  # type: ignore
-
-
-def batch_embed_messages(
-    messages: list[str], max_to_embed: int = 20000
-) -> Generator[list[list[float]], None, None]:
-    # this should probably run in a separate thread
-    # and be a generator
-    """
-    This generator embeds the last max_to_embed messages using the openai api.
-    Each batch has a maximum size of 2000 messages/embeddings.
-    ---
-    Parameters
-        messages: list[TMessage]
-                The list of messages to be embedded.
-        max_to_embed: int
-                The maximum number of messages to embed.
-    """
-    messages = messages[-max_to_embed:]
-    BATCH_SIZE = 2000
-    batches = split_into_batches(messages, BATCH_SIZE)
-    for batch in batches:
-        yield embed(batch)
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from array import array
+from collections import OrderedDict
+from typing import Sequence
+
+from ai import EMBEDDING_MODEL
+from utils import config, metrics
+from utils.sqlite_store import SQLiteStore
+
+# Share of the persistent tier evicted at once when it is full, so it is
+# not trimmed on every write
+EVICTION_SLACK = 0.1
+# Access times of hits are written to disk once this many are pending, or
+# with the next write of new entries, instead of on every lookup
+ACCESS_FLUSH_SIZE = 1000
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a text before it is hashed, so that texts which only differ
+    in surrounding or repeated whitespace share a cache entry.
+    """
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings, keyed by a hash of the embedding
+    model and the normalized text.
+
+    Lookups go through a bounded in-memory LRU tier first, then through a
+    persistent SQLite tier that survives restarts. Vectors are kept as
+    float32 in both tiers. The persistent tier records when every entry was
+    last used, and evicts the least recently used ones once it holds more
+    than `max_disk_entries`. Access times are recorded in batches, an entry
+    used since the last batch may be evicted as if it had not been.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        max_memory_entries: int = 5000,
+        max_disk_entries: int = 200_000,
+        model: str = EMBEDDING_MODEL,
+    ) -> None:
+        self.model = model
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: OrderedDict[str, array[float]] = OrderedDict()
+        self._store = SQLiteStore(
+            path,
+            "CREATE TABLE IF NOT EXISTS cached_embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL); "
+            "CREATE INDEX IF NOT EXISTS cached_embeddings_accessed "
+            "ON cached_embeddings (accessed)",
+        )
+        self._disk_entries = self._count_disk()
+        # access times of hits not yet written to disk, by key
+        self._accessed: dict[str, float] = {}
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        content = f"{self.model}\0{normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(content).hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> list[list[float] | None]:
+        """
+        Looks up the embeddings of the given texts.
+        ---
+        Parameters
+            texts: Sequence[str]
+                    The texts to look up.
+        Returns
+            embeddings: list[list[float] | None]
+                    The cached embedding of each text, or None on a miss.
+        """
+        keys = [self.key(text) for text in texts]
+        found: dict[str, array[float]] = {}
+        with self._store.lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+
+            memory_hits = sum(1 for key in keys if key in found)
+            in_memory = len(found)
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            for key, vector in self._read_disk(missing).items():
+                found[key] = vector
+                self._remember(key, vector)
+            disk_hits = len(found) - in_memory
+            misses = sum(1 for key in keys if key not in found)
+            now = time.time()
+            self._accessed.update((key, now) for key in found)
+            if len(self._accessed) >= ACCESS_FLUSH_SIZE:
+                self._flush_accessed()
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += misses
+
+        metrics.increment("embedding_cache.memory_hits", memory_hits)
+        metrics.increment("embedding_cache.disk_hits", disk_hits)
+        metrics.increment("embedding_cache.misses", misses)
+        return [found[key].tolist() if key in found else None for key in keys]
+
+    def put_many(self, texts: Sequence[str], embeddings: Sequence[list[float]]) -> None:
+        """
+        Stores the embeddings of the given texts in both tiers.
+        """
+        rows = [
+            (self.key(text), array("f", embedding))
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._store.lock:
+            for key, vector in rows:
+                self._remember(key, vector)
+            unique = dict(rows)
+            existing = self._store.select_in(
+                "SELECT key FROM cached_embeddings WHERE key IN ({})", (), list(unique)
+            )
+            self._flush_accessed()
+            now = time.time()
+            self._store.write(
+                "INSERT OR REPLACE INTO cached_embeddings (key, vector, accessed) "
+                "VALUES (?, ?, ?)",
+                [(key, vector.tobytes(), now) for key, vector in unique.items()],
+            )
+            if self._store.persistent:
+                # overwritten entries take no more room
+                self._disk_entries += len(unique) - len(existing)
+            if self._disk_entries > self.max_disk_entries:
+                self._evict()
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns the hit and miss counters of the cache.
+        """
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        with self._store.lock:
+            self._memory.clear()
+            self._accessed.clear()
+            self._store.write("DELETE FROM cached_embeddings", [()])
+            self._disk_entries = 0
+
+    def _remember(self, key: str, vector: array[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_accessed(self) -> None:
+        if not self._accessed:
+            return
+        self._store.write(
+            "UPDATE cached_embeddings SET accessed = ? WHERE key = ?",
+            [(accessed, key) for key, accessed in self._accessed.items()],
+        )
+        self._accessed.clear()
+
+    def _count_disk(self) -> int:
+        rows = self._store.select("SELECT COUNT(*) FROM cached_embeddings")
+        return int(rows[0][0]) if rows else 0
+
+    def _evict(self) -> None:
+        keep = int(self.max_disk_entries * (1 - EVICTION_SLACK))
+        self._store.write(
+            "DELETE FROM cached_embeddings WHERE key IN (SELECT key FROM "
+            "cached_embeddings ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            [(keep,)],
+        )
+        self._disk_entries = self._count_disk()
+        metrics.increment("embedding_cache.evictions")
+
+    def _read_disk(self, keys: list[str]) -> dict[str, array[float]]:
+        found: dict[str, array[float]] = {}
+        rows = self._store.select_in(
+            "SELECT key, vector FROM cached_embeddings WHERE key IN ({})", (), keys
+        )
+        for key, blob in rows:
+            vector = array("f")
+            vector.frombytes(blob)
+            found[key] = vector
+        return found
+
+
+embedding_cache: EmbeddingCache | None = None
+# Without a path, as in the test environment, embeddings are not cached
+if config.EMBEDDING_CACHE_PATH is not None:
+    embedding_cache = EmbeddingCache(
+        path=config.EMBEDDING_CACHE_PATH,
+        max_memory_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", 5000)),
+        max_disk_entries=int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", 200_000)),
+    )
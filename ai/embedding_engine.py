@@ -0,0 +1,313 @@
+"""
+Embeds large numbers of texts concurrently, within the OpenAI rate limits.
+
+Requests are sent concurrently as long as the requests per minute and
+tokens per minute budgets, refilled continuously, allow it, failed requests
+are retried, and every request pauses for a while after a rate limit error.
+Embeddings are yielded with the index of their text as their requests
+complete, not in order.
+
+Texts are packed into requests by their number of tokens rather than their
+number, up to a ceiling per request. Texts longer than the model's input
+are split into chunks embedded separately, and the embedding of the text is
+the mean of its chunks' embeddings weighted by their number of tokens.
+"""
+import asyncio
+import os
+import time
+from itertools import islice
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+)
+
+import numpy as np
+import openai
+from openai.error import (
+    APIConnectionError,
+    APIError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+    TryAgain,
+)
+
+from ai import EMBEDDING_MODEL, logger
+from ai.embedding_cache import EmbeddingCache, embedding_cache
+from ai.tokens import chunk_texts
+from utils.batch import pack_into_batches
+from utils.executors import CPU_EXECUTOR, run_blocking
+
+# Leave headroom below the limits of the account, they are shared with the
+# embeddings and completions of live messages and questions
+MAX_REQUESTS_PER_MINUTE = float(os.getenv("EMBED_MAX_REQUESTS_PER_MINUTE", 1500))
+MAX_TOKENS_PER_MINUTE = float(os.getenv("EMBED_MAX_TOKENS_PER_MINUTE", 500_000))
+# Most texts per request, the API takes up to 2048
+REQUEST_SIZE = int(os.getenv("EMBED_REQUEST_SIZE", 2048))
+# Most tokens per request to the embeddings endpoint, for imports and the
+# coalesced requests of live messages alike, texts are packed up to it
+MAX_REQUEST_TOKENS = int(os.getenv("EMBED_MAX_REQUEST_TOKENS", 20_000))
+# Longest input of the embedding model, longer texts are embedded in chunks
+MAX_INPUT_TOKENS = 8191
+# Requests of one call to embed in flight at once
+MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", 8))
+MAX_ATTEMPTS = 5
+# Seconds every request waits after a rate limit error
+RATE_LIMIT_PAUSE = 15
+
+_RETRYABLE = (APIConnectionError, APIError, ServiceUnavailableError, Timeout, TryAgain)
+
+
+class RateLimiter:
+    """
+    Budgets of requests and tokens per minute. Both refill continuously, up
+    to a minute's worth, and requests wait their turn, first come first
+    served, until there is enough of both.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = MAX_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = MAX_TOKENS_PER_MINUTE,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._clock = clock
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._turn = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        """Waits until a request of the given number of tokens can be sent."""
+        # a request larger than a minute's budget waits for a full one
+        tokens = min(tokens, int(self.tokens_per_minute))
+        async with self._turn:
+            while True:
+                self._refill()
+                wait = self._paused_until - self._clock()
+                if wait <= 0:
+                    if self._requests >= 1 and self._tokens >= tokens:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return
+                    wait = max(
+                        (1 - self._requests) * 60 / self.requests_per_minute,
+                        (tokens - self._tokens) * 60 / self.tokens_per_minute,
+                    )
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Holds every request back for the given number of seconds."""
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        minutes = (now - self._updated) / 60
+        self._updated = now
+        self._requests = min(
+            self._requests + minutes * self.requests_per_minute,
+            self.requests_per_minute,
+        )
+        self._tokens = min(
+            self._tokens + minutes * self.tokens_per_minute, self.tokens_per_minute
+        )
+
+
+async def _request_embeddings(texts: list[str]) -> list[list[float]]:
+    response = await openai.Embedding.acreate(
+        model=EMBEDDING_MODEL, input=texts
+    )  # type: ignore
+    data = sorted(response["data"], key=lambda d: d["index"])
+    return [d["embedding"] for d in data]
+
+
+def _chunk_texts(texts: list[str]) -> list[list[tuple[str, int]]]:
+    return chunk_texts(texts, MAX_INPUT_TOKENS, model=EMBEDDING_MODEL)
+
+
+class _Chunk(NamedTuple):
+    # index of the text the chunk is part of
+    text_index: int
+    text: str
+    tokens: int
+
+
+class EmbeddingEngine:
+    """
+    Embeds texts with concurrent requests of at most `request_size` texts
+    and `max_request_tokens` tokens, at most `max_in_flight` per call to
+    embed, and all within the budgets of one shared `limiter`. Texts found
+    in `cache` are not requested. `chunk` splits texts into chunks the model
+    takes, with their number of tokens.
+    """
+
+    def __init__(
+        self,
+        limiter: RateLimiter | None = None,
+        request_size: int = REQUEST_SIZE,
+        max_request_tokens: int = MAX_REQUEST_TOKENS,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        max_attempts: int = MAX_ATTEMPTS,
+        rate_limit_pause: float = RATE_LIMIT_PAUSE,
+        cache: EmbeddingCache | None = embedding_cache,
+        request: Callable[[list[str]], Awaitable[list[list[float]]]] | None = None,
+        chunk: Callable[[list[str]], list[list[tuple[str, int]]]] | None = None,
+    ) -> None:
+        self.limiter = limiter or RateLimiter()
+        self.request_size = request_size
+        self.max_request_tokens = max_request_tokens
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.rate_limit_pause = rate_limit_pause
+        self.cache = cache
+        self._request = request or _request_embeddings
+        self._chunk = chunk or _chunk_texts
+
+    async def embed(
+        self, texts: Iterable[str]
+    ) -> AsyncIterator[tuple[int, list[float]]]:
+        """
+        Embeds the texts, yielding every embedding with the index of its
+        text as soon as its request completes. Texts are read from the
+        iterable as requests are sent. Empty texts are not embedded.
+        ---
+        Parameters
+            texts: Iterable[str]
+                    The texts to embed.
+        Yields
+            embedding: tuple[int, list[float]]
+                    The index of a text and its embedding.
+        Raises
+            openai.error.OpenAIError
+                    If a request fails for good, after the pending ones are
+                    cancelled.
+        """
+        pending: set[asyncio.Task[list[tuple[_Chunk, list[float]]]]] = set()
+        # texts split into several chunks, with their number of chunks left
+        # to embed and the embeddings and tokens of the others
+        split: dict[int, int] = {}
+        parts: dict[int, list[tuple[list[float], int]]] = {}
+        try:
+            async for batch in self._batches(texts, split):
+                while len(pending) >= self.max_in_flight:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        for result in _pool(task.result(), split, parts):
+                            yield result
+                pending.add(asyncio.create_task(self._embed_batch(batch)))
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    for result in _pool(task.result(), split, parts):
+                        yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _batches(
+        self, texts: Iterable[str], split: dict[int, int]
+    ) -> AsyncIterator[list[_Chunk]]:
+        numbered = ((i, text) for i, text in enumerate(texts) if text)
+        # texts are tokenized a request's worth at a time, as they are read
+        while window := list(islice(numbered, self.request_size)):
+            chunked = await run_blocking(
+                CPU_EXECUTOR, self._chunk, [text for _, text in window]
+            )
+            chunks: list[_Chunk] = []
+            for (i, _), text_chunks in zip(window, chunked):
+                if len(text_chunks) > 1:
+                    split[i] = len(text_chunks)
+                chunks += [_Chunk(i, text, tokens) for text, tokens in text_chunks]
+            for batch in pack_into_batches(
+                chunks,
+                [chunk.tokens for chunk in chunks],
+                self.max_request_tokens,
+                self.request_size,
+            ):
+                yield batch
+
+    async def _embed_batch(
+        self, chunks: list[_Chunk]
+    ) -> list[tuple[_Chunk, list[float]]]:
+        if self.cache is None:
+            return list(zip(chunks, await self._embed_with_retries(chunks)))
+        cached = await run_blocking(
+            CPU_EXECUTOR, self.cache.get_many, [chunk.text for chunk in chunks]
+        )
+        results = [
+            (chunk, hit) for chunk, hit in zip(chunks, cached) if hit is not None
+        ]
+        missing = [chunk for chunk, hit in zip(chunks, cached) if hit is None]
+        if missing:
+            embeddings = await self._embed_with_retries(missing)
+            await run_blocking(
+                CPU_EXECUTOR,
+                self.cache.put_many,
+                [chunk.text for chunk in missing],
+                embeddings,
+            )
+            results += list(zip(missing, embeddings))
+        return results
+
+    async def _embed_with_retries(self, chunks: list[_Chunk]) -> list[list[float]]:
+        texts = [chunk.text for chunk in chunks]
+        tokens = sum(chunk.tokens for chunk in chunks)
+        for attempt in range(1, self.max_attempts + 1):
+            await self.limiter.acquire(tokens)
+            try:
+                return await self._request(texts)
+            except RateLimitError as e:
+                logger.info(f"Rate limit error, pausing {self.rate_limit_pause}s: {e}")
+                self.limiter.pause(self.rate_limit_pause)
+                error: Exception = e
+            except _RETRYABLE as e:
+                logger.warning(f"Embedding request failed, attempt {attempt}: {e}")
+                error = e
+        raise error
+
+
+def mean_embedding(embeddings: list[list[float]], weights: list[int]) -> list[float]:
+    """
+    Returns the embedding of a text split into chunks: the mean of the
+    embeddings of its chunks, weighted by their number of tokens.
+    """
+    pooled = np.average(np.array(embeddings, dtype=np.float64), axis=0, weights=weights)
+    # embeddings are unit vectors, and so is the pooled one
+    return (pooled / np.linalg.norm(pooled)).tolist()  # type: ignore
+
+
+def _pool(
+    results: list[tuple[_Chunk, list[float]]],
+    split: dict[int, int],
+    parts: dict[int, list[tuple[list[float], int]]],
+) -> Iterator[tuple[int, list[float]]]:
+    """
+    Yields the embeddings of the texts completed by the results, pooling
+    the embeddings of the chunks of split texts once all of them arrived.
+    """
+    for chunk, embedding in results:
+        i = chunk.text_index
+        if i not in split:
+            yield i, embedding
+            continue
+        parts.setdefault(i, []).append((embedding, chunk.tokens))
+        split[i] -= 1
+        if split[i]:
+            continue
+        del split[i]
+        embeddings, weights = zip(*parts.pop(i))
+        yield i, mean_embedding(list(embeddings), list(weights))
+
+
+embedding_engine = EmbeddingEngine()
@@ -1,29 +1,90 @@
 import os
-from typing import Any, cast
-from ai.constants import GPT_INFO, INTRODUCTION
+from typing import Any, AsyncIterator, Sequence, cast
+from ai.constants import GPT_INFO, INTRODUCTION, NO_ANSWER, InfoKeys
 from ai.aitypes import (
     ChatCompletion,
 )  # for converting embeddings saved as strings back to arrays
 import openai  # for calling the OpenAI API
-import tiktoken  # for counting tokens
 
-from utils.timeout import timeout, TimeoutError
+from openai.error import Timeout
+from ai import logger
+from ai.tokens import get_encoding, num_tokens
 from . import GPT_MODEL
 
 
-def num_tokens(text: str, model: str = GPT_MODEL) -> int:
+# Candidate messages are tokenized in chunks of this size with tiktoken's threaded encode_batch
+BATCH_ENCODE_SIZE = 16
+
+
+def format_snippet(message: str) -> str:
+    return f'\n\nTelegram Message:\n"""\n{message}\n"""'
+
+
+def snippet_tokens(
+    messages: list[str], model: str = GPT_MODEL, num_threads: int = 8
+) -> list[int]:
     """
-    Return the number of tokens in a string.
+    Return the number of tokens each message takes up in a prompt,
+    tokenizing all messages in parallel.
 
     Parameters:
-    text (str): The input text.
+    messages (list[str]): The candidate messages.
     model (str): The model to use for tokenization. Defaults to GPT_MODEL.
+    num_threads (int): The number of threads tiktoken may use.
 
     Returns:
-    int: The number of tokens in the input text.
+    list[int]: The number of tokens of each formatted message.
+    """
+    encoded = get_encoding(model).encode_batch(
+        [format_snippet(message) for message in messages], num_threads=num_threads
+    )
+    return [len(tokens) for tokens in encoded]
+
+
+class PromptBuilder:
+    """
+    Builds a prompt for GPT by adding messages until the token budget is spent.
+
+    The introduction and question are tokenized once, and every message is
+    tokenized on its own when it is added, so filling the budget takes
+    linear time in the size of the prompt.
     """
-    encoding = tiktoken.encoding_for_model(model)
-    return len(encoding.encode(text))
+
+    def __init__(
+        self, query: str, model: str = GPT_MODEL, token_budget: int = 4096 - 500
+    ) -> None:
+        self.model = model
+        self.token_budget = token_budget
+        self._encoding = get_encoding(model)
+        self._question = f"\n\nQuestion: {query}"
+        self._parts = [INTRODUCTION]
+        self.tokens = len(self._encoding.encode(INTRODUCTION)) + len(
+            self._encoding.encode(self._question)
+        )
+
+    def add(self, message: str, tokens: int | None = None) -> bool:
+        """
+        Adds a message to the prompt if it fits in the remaining budget.
+
+        Args:
+            message (str): The message to add.
+            tokens (int, optional): The number of tokens of the formatted message,
+                if already known.
+
+        Returns:
+            bool: Whether the message was added.
+        """
+        snippet = format_snippet(message)
+        if tokens is None:
+            tokens = len(self._encoding.encode(snippet))
+        if self.tokens + tokens > self.token_budget:
+            return False
+        self._parts.append(snippet)
+        self.tokens += tokens
+        return True
+
+    def build(self) -> str:
+        return "".join(self._parts) + self._question
 
 
 def query_message(
@@ -31,6 +92,7 @@ def query_message(
     messages: list[str],
     model: str = GPT_MODEL,
     token_budget: int = 4096 - 500,
+    tokens: Sequence[int] | None = None,
 ) -> str:
     """
     Return a message for GPT.
@@ -40,25 +102,40 @@ def query_message(
         messages (list[str]): List of messages to be included in the message.
         model (str, optional): The GPT model to use. Defaults to GPT_MODEL.
         token_budget (int, optional): The maximum token budget for the message. Defaults to 4096 - 500.
+        tokens (Sequence[int], optional): The snippet_tokens of the messages, if already known.
 
     Returns:
         str: The generated message for GPT.
     """
-    introduction = INTRODUCTION
-    question = f"\n\nQuestion: {query}"
-    message = introduction
-    for string in messages:
-        next_doc = f'\n\nTelegram Message:\n"""\n{string}\n"""'
-        if num_tokens(message + next_doc + question, model=model) > token_budget:
-            break
-        else:
-            message += next_doc
-    return message + question
-
-
-@timeout(5)
+    builder = PromptBuilder(query, model=model, token_budget=token_budget)
+    if tokens is not None:
+        for string, known in zip(messages, tokens):
+            if not builder.add(string, known):
+                break
+        return builder.build()
+    # long candidate lists are tokenized a chunk at a time with encode_batch,
+    # so no more than one chunk is tokenized past the end of the budget
+    for start in range(0, len(messages), BATCH_ENCODE_SIZE):
+        chunk = messages[start : start + BATCH_ENCODE_SIZE]
+        counts: list[int | None] = [None] * len(chunk)
+        if len(chunk) == BATCH_ENCODE_SIZE:
+            counts = list(snippet_tokens(chunk, model=model))
+        for string, count in zip(chunk, counts):
+            if not builder.add(string, count):
+                return builder.build()
+    return builder.build()
+
+
+# Seconds a completion request may take when the caller sets no deadline
+COMPLETION_TIMEOUT = 20
+
+
 def create_chat_completion(
-    model: str, messages: list[dict[str, str]], temperature: int, **kwargs: Any
+    model: str,
+    messages: list[dict[InfoKeys, str]],
+    temperature: int,
+    request_timeout: float = COMPLETION_TIMEOUT,
+    **kwargs: Any,
 ) -> ChatCompletion:
     """
     Create a chat completion request.
@@ -67,29 +144,40 @@ def create_chat_completion(
         model (str): The name or ID of the model to use for chat completion.
         messages (list[dict[str, str]]): The list of messages in the conversation.
         temperature (int): Controls the randomness of the output. Higher values make the output more random.
+        request_timeout (float, optional): Seconds after which the request is aborted. Defaults to COMPLETION_TIMEOUT.
         **kwargs (Any): Additional keyword arguments to pass to the ChatCompletion.create method.
 
     Returns:
         ChatCompletion: The chat completion response.
 
     Raises:
-        TimeoutError: If the chat completion request times out.
+        openai.error.Timeout: If the chat completion request times out.
     """
     chat_comp = openai.ChatCompletion.create(  # type: ignore
         model=model,
         messages=messages,
         temperature=temperature,
+        request_timeout=request_timeout,
         **kwargs,
     )
     return cast(ChatCompletion, chat_comp)
 
 
+def chat_messages(message: str) -> list[dict[InfoKeys, str]]:
+    """
+    Return the conversation sent to GPT for a prompt.
+    A new list is built for every request, so concurrent requests never share it.
+    """
+    return [*GPT_INFO, {"role": "user", "content": message}]
+
+
 def ask(
     query: str,
     messages: list[str],
     model: str = GPT_MODEL,
     token_budget: int = 4096 - 500,
-    print_message: bool = False,
+    request_timeout: float = COMPLETION_TIMEOUT,
+    tokens: Sequence[int] | None = None,
 ) -> str | None:
     """
     Answers a query using GPT and a
@@ -100,25 +188,64 @@ def ask(
         messages (list[str]): A list of relevant texts and embeddings.
         model (str, optional): The GPT model to use. Defaults to GPT_MODEL.
         token_budget (int, optional): The maximum number of tokens to use for the response. Defaults to 4096 - 500.
-        print_message (bool, optional): Whether to print the generated message. Defaults to False.
+        request_timeout (float, optional): Seconds after which the completion request is aborted. Defaults to COMPLETION_TIMEOUT.
+        tokens (Sequence[int], optional): The snippet_tokens of the messages, if already known.
 
     Returns:
         str | None: The generated response message, or None if an error occurred.
     """
-    message = query_message(query, messages, model=model, token_budget=token_budget)
-    gpt_info = GPT_INFO
-    gpt_info[1]["content"] = message
-    if print_message:
-        print(message)
+    message = query_message(
+        query, messages, model=model, token_budget=token_budget, tokens=tokens
+    )
+    logger.debug(f"Prompt: {message}")
     try:
-        resp = openai.ChatCompletion.create(  # type: ignore
+        response = create_chat_completion(
             model=model,
-            messages=gpt_info,
+            messages=chat_messages(message),
             temperature=0,
+            request_timeout=request_timeout,
         )
-        response = cast(ChatCompletion, resp)  # for type checking
         response_message = response["choices"][0]["message"]["content"]
         return response_message
-    except TimeoutError:
-        print("TimeoutError occurred.")  # need to log
-        return "I could not find an answer."
+    except Timeout:
+        logger.warning(f"Completion timed out after {request_timeout} seconds")
+        return NO_ANSWER
+
+
+async def ask_stream(
+    query: str,
+    messages: list[str],
+    model: str = GPT_MODEL,
+    token_budget: int = 4096 - 500,
+    request_timeout: float = COMPLETION_TIMEOUT,
+    tokens: Sequence[int] | None = None,
+) -> AsyncIterator[str]:
+    """
+    Answers a query like `ask`, but yields the answer piece by piece
+    as the tokens are generated.
+
+    Args:
+        query (str): The query to be answered.
+        messages (list[str]): A list of relevant texts.
+        model (str, optional): The GPT model to use. Defaults to GPT_MODEL.
+        token_budget (int, optional): The maximum number of tokens to use for the response. Defaults to 4096 - 500.
+        request_timeout (float, optional): Seconds after which the completion request is aborted. Defaults to COMPLETION_TIMEOUT.
+        tokens (Sequence[int], optional): The snippet_tokens of the messages, if already known.
+
+    Yields:
+        str: The next piece of the generated response message.
+    """
+    message = query_message(
+        query, messages, model=model, token_budget=token_budget, tokens=tokens
+    )
+    chunks = await openai.ChatCompletion.acreate(  # type: ignore
+        model=model,
+        messages=chat_messages(message),
+        temperature=0,
+        stream=True,
+        request_timeout=request_timeout,
+    )
+    async for chunk in chunks:
+        content = chunk["choices"][0]["delta"].get("content")
+        if content:
+            yield content
@@ -0,0 +1,82 @@
+import os
+import time
+from typing import Callable, Sequence
+from db.db_types import PCQueryResult
+
+# Matches scoring less than this are not relevant to a question, unless the
+# chat's group document sets its own score_threshold
+MIN_RELEVANCE_SCORE = float(os.getenv("MIN_RELEVANCE_SCORE", 0.75))
+# A top match this much better than the next one is the only one kept
+DOMINANCE_GAP = float(os.getenv("RELEVANCE_DOMINANCE_GAP", 0.05))
+# Matches this close to the top match are as good as it, and all kept
+CLUSTER_SPREAD = float(os.getenv("RELEVANCE_CLUSTER_SPREAD", 0.02))
+# Seconds a chat's threshold is kept before it is read again
+THRESHOLD_TTL = 5 * 60
+
+
+def select_matches(
+    matches: Sequence[PCQueryResult],
+    threshold: float = MIN_RELEVANCE_SCORE,
+    top_k: int = 3,
+    max_k: int = 8,
+) -> list[PCQueryResult]:
+    """
+    Picks the matches a question is answered from, best first.
+
+    Matches below the threshold are dropped. If the best match is clearly
+    ahead of the others it is the only one kept, otherwise top_k are kept,
+    or more if more are about as good as the best one, up to max_k.
+
+    Args:
+        matches (Sequence[PCQueryResult]): The query matches, best first.
+        threshold (float): The minimum score of a relevant match.
+        top_k (int): The number of matches usually kept.
+        max_k (int): The most matches kept.
+
+    Returns:
+        list[PCQueryResult]: The matches to answer from, none if nothing is relevant.
+    """
+    relevant = [match for match in matches if match["score"] >= threshold]
+    if len(relevant) < 2:
+        return relevant
+    best = relevant[0]["score"]
+    if best - relevant[1]["score"] >= DOMINANCE_GAP:
+        return relevant[:1]
+    close = sum(1 for match in relevant if best - match["score"] <= CLUSTER_SPREAD)
+    return relevant[: min(max(top_k, close), max_k)]
+
+
+class ScoreThresholds:
+    """
+    The relevance threshold of every chat, read with `load` and kept for
+    `ttl` seconds. Chats without one, or all chats without `load`, use
+    `default`.
+    """
+
+    def __init__(
+        self,
+        default: float = MIN_RELEVANCE_SCORE,
+        load: Callable[[int], float | None] | None = None,
+        ttl: float = THRESHOLD_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.default = default
+        self.load = load
+        self.ttl = ttl
+        self._clock = clock
+        self._thresholds: dict[int, tuple[float, float]] = {}
+
+    def get(self, chat_id: int) -> float:
+        """
+        Returns the threshold of a chat, reading it again once it expired.
+        """
+        if self.load is None:
+            return self.default
+        cached = self._thresholds.get(chat_id)
+        if cached is not None and cached[1] > self._clock():
+            return cached[0]
+        threshold = self.load(chat_id)
+        if threshold is None:
+            threshold = self.default
+        self._thresholds[chat_id] = (threshold, self._clock() + self.ttl)
+        return threshold
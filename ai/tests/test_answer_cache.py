@@ -0,0 +1,54 @@
+import unittest
+from ai.answer_cache import AnswerCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestAnswerCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.cache = AnswerCache(threshold=0.9, ttl=60, clock=self.clock)
+
+    def test_similar_question_hits(self) -> None:
+        self.cache.put(1, [1.0, 0.0], "Friday")
+        self.assertEqual(self.cache.get(1, [2.0, 0.1]), "Friday")
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_dissimilar_question_misses(self) -> None:
+        self.cache.put(1, [1.0, 0.0], "Friday")
+        self.assertIsNone(self.cache.get(1, [0.0, 1.0]))
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_answers_are_per_chat(self) -> None:
+        self.cache.put(1, [1.0, 0.0], "Friday")
+        self.assertIsNone(self.cache.get(2, [1.0, 0.0]))
+
+    def test_entries_expire(self) -> None:
+        self.cache.put(1, [1.0, 0.0], "Friday")
+        self.clock.now = 61
+        self.assertIsNone(self.cache.get(1, [1.0, 0.0]))
+
+    def test_invalidate_drops_the_chat(self) -> None:
+        self.cache.put(1, [1.0, 0.0], "Friday")
+        self.cache.put(2, [1.0, 0.0], "Monday")
+        self.cache.invalidate(1)
+        self.assertIsNone(self.cache.get(1, [1.0, 0.0]))
+        self.assertEqual(self.cache.get(2, [1.0, 0.0]), "Monday")
+
+    def test_size_limits(self) -> None:
+        cache = AnswerCache(threshold=0.99, max_entries_per_chat=2, max_chats=2)
+        cache.put(1, [1.0, 0.0], "a")
+        cache.put(1, [0.0, 1.0], "b")
+        cache.put(1, [1.0, 1.0], "c")
+        self.assertIsNone(cache.get(1, [1.0, 0.0]))
+        self.assertEqual(cache.get(1, [0.0, 1.0]), "b")
+
+        cache.put(2, [1.0, 0.0], "x")
+        cache.put(3, [1.0, 0.0], "y")
+        self.assertIsNone(cache.get(1, [0.0, 1.0]))
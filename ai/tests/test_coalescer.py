@@ -0,0 +1,129 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+from openai.error import InvalidRequestError
+from ai.coalescer import EmbeddingCoalescer
+from ai.embedding_cache import EmbeddingCache
+
+
+def fake_embed(texts: list[str]) -> list[list[float]]:
+    return [[float(len(text))] for text in texts]
+
+
+class TestEmbeddingCoalescer(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_texts_share_one_request(self) -> None:
+        embed_fn = MagicMock(side_effect=fake_embed)
+        coalescer = EmbeddingCoalescer(window=0.01, embed_fn=embed_fn, count_tokens=len)
+
+        results = await asyncio.gather(
+            coalescer.embed("a"), coalescer.embed("bb"), coalescer.embed("ccc")
+        )
+
+        self.assertEqual(results, [[1.0], [2.0], [3.0]])
+        embed_fn.assert_called_once_with(["a", "bb", "ccc"])
+
+    async def test_duplicate_texts_are_embedded_once(self) -> None:
+        embed_fn = MagicMock(side_effect=fake_embed)
+        coalescer = EmbeddingCoalescer(window=0.01, embed_fn=embed_fn, count_tokens=len)
+
+        results = await asyncio.gather(
+            coalescer.embed("ok"), coalescer.embed("thanks"), coalescer.embed("ok")
+        )
+
+        self.assertEqual(results, [[2.0], [6.0], [2.0]])
+        embed_fn.assert_called_once_with(["ok", "thanks"])
+
+    async def test_flushes_when_batch_size_is_reached(self) -> None:
+        embed_fn = MagicMock(side_effect=fake_embed)
+        coalescer = EmbeddingCoalescer(
+            window=60, max_batch_size=2, embed_fn=embed_fn, count_tokens=len
+        )
+
+        results = await asyncio.wait_for(
+            asyncio.gather(coalescer.embed("a"), coalescer.embed("bb")), timeout=1
+        )
+
+        self.assertEqual(results, [[1.0], [2.0]])
+        embed_fn.assert_called_once_with(["a", "bb"])
+
+    async def test_flushes_before_exceeding_token_cap(self) -> None:
+        embed_fn = MagicMock(side_effect=fake_embed)
+        coalescer = EmbeddingCoalescer(
+            window=0.01, max_batch_tokens=5, embed_fn=embed_fn, count_tokens=len
+        )
+
+        await asyncio.gather(
+            coalescer.embed("aaa"), coalescer.embed("bbb"), coalescer.embed("c")
+        )
+
+        self.assertEqual(embed_fn.call_count, 2)
+        embed_fn.assert_any_call(["aaa"])
+        embed_fn.assert_any_call(["bbb", "c"])
+
+    async def test_errors_are_propagated_to_every_caller(self) -> None:
+        embed_fn = MagicMock(side_effect=RuntimeError("api down"))
+        coalescer = EmbeddingCoalescer(window=0.01, embed_fn=embed_fn, count_tokens=len)
+
+        results = await asyncio.gather(
+            coalescer.embed("a"), coalescer.embed("b"), return_exceptions=True
+        )
+
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+    async def test_empty_text_is_rejected(self) -> None:
+        coalescer = EmbeddingCoalescer(embed_fn=fake_embed, count_tokens=len)
+        with self.assertRaises(ValueError):
+            await coalescer.embed("")
+
+    async def test_long_text_is_embedded_in_chunks_on_its_own(self) -> None:
+        embed_fn = MagicMock(side_effect=lambda texts: [[1.0, 0.0]] * len(texts))
+        coalescer = EmbeddingCoalescer(
+            window=0.01,
+            embed_fn=embed_fn,
+            count_tokens=len,
+            max_input_tokens=4,
+            chunk=lambda text: [
+                (text[i : i + 4], len(text[i : i + 4])) for i in (0, 4)
+            ],
+        )
+
+        results = await asyncio.gather(
+            coalescer.embed("a"), coalescer.embed("bbbbbbbb")
+        )
+
+        self.assertEqual(results, [[1.0, 0.0], [1.0, 0.0]])
+        embed_fn.assert_any_call(["a"])
+        embed_fn.assert_any_call(["bbbb", "bbbb"])
+
+    async def test_rejected_text_only_fails_its_callers(self) -> None:
+        def embed_fn(texts: list[str]) -> list[list[float]]:
+            if "bad" in texts:
+                raise InvalidRequestError("too long", None)  # type: ignore
+            return fake_embed(texts)
+
+        coalescer = EmbeddingCoalescer(window=0.01, embed_fn=embed_fn, count_tokens=len)
+
+        results = await asyncio.gather(
+            coalescer.embed("a"),
+            coalescer.embed("bad"),
+            coalescer.embed("ccc"),
+            return_exceptions=True,
+        )
+
+        self.assertEqual(results[0], [1.0])
+        self.assertIsInstance(results[1], InvalidRequestError)
+        self.assertEqual(results[2], [3.0])
+
+    async def test_cached_texts_are_not_sent(self) -> None:
+        cache = EmbeddingCache()
+        cache.put_many(["a"], [[9.0]])
+        embed_fn = MagicMock(side_effect=fake_embed)
+        coalescer = EmbeddingCoalescer(
+            window=0.01, embed_fn=embed_fn, count_tokens=len, cache=cache
+        )
+
+        results = await asyncio.gather(coalescer.embed("a"), coalescer.embed("bb"))
+
+        self.assertEqual(results, [[9.0], [2.0]])
+        embed_fn.assert_called_once_with(["bb"])
+        self.assertEqual(cache.get_many(["bb"]), [[2.0]])
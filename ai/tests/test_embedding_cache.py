@@ -0,0 +1,121 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+from ai import EMBEDDING_MODEL
+from ai.embedder import embed, embed_cached
+from ai.embedding_cache import EmbeddingCache
+from utils import metrics
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "cache.sqlite3")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_miss_then_hit(self) -> None:
+        cache = EmbeddingCache()
+        self.assertEqual(cache.get_many(["ok"]), [None])
+
+        cache.put_many(["ok"], [[0.5, 0.25]])
+
+        self.assertEqual(cache.get_many(["ok"]), [[0.5, 0.25]])
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+
+    def test_whitespace_is_normalized(self) -> None:
+        cache = EmbeddingCache()
+        cache.put_many(["thanks a lot"], [[1.0]])
+        self.assertEqual(cache.get_many(["  thanks   a lot\n"]), [[1.0]])
+
+    def test_model_is_part_of_the_key(self) -> None:
+        self.assertNotEqual(
+            EmbeddingCache(model="model-a").key("ok"),
+            EmbeddingCache(model="model-b").key("ok"),
+        )
+
+    def test_least_recently_used_entry_is_evicted(self) -> None:
+        cache = EmbeddingCache(max_memory_entries=2)
+        cache.put_many(["a", "b"], [[1.0], [2.0]])
+        cache.get_many(["a"])
+        cache.put_many(["c"], [[3.0]])
+
+        self.assertEqual(cache.get_many(["b"]), [None])
+        self.assertEqual(cache.get_many(["a", "c"]), [[1.0], [3.0]])
+
+    def test_persistent_tier_survives_restarts(self) -> None:
+        EmbeddingCache(path=self.path).put_many(["hello"], [[0.5, 0.75]])
+
+        restarted = EmbeddingCache(path=self.path)
+
+        self.assertEqual(restarted.get_many(["hello"]), [[0.5, 0.75]])
+        self.assertEqual(restarted.stats()["disk_hits"], 1)
+        # promoted to the memory tier
+        restarted.get_many(["hello"])
+        self.assertEqual(restarted.stats()["memory_hits"], 1)
+
+    @patch("ai.embedder.openai.Embedding.create")
+    def test_embed_only_requests_misses(self, mock_openai: Mock) -> None:
+        cache = EmbeddingCache()
+        cache.put_many(["ok"], [[0.5]])
+        mock_openai.return_value = {"data": [{"index": 0, "embedding": [0.25]}]}
+
+        result = asyncio.run(embed_cached(["ok", "new", "ok", "new"], embed, cache))
+
+        self.assertEqual(result, [[0.5], [0.25], [0.5], [0.25]])
+        mock_openai.assert_called_once_with(model=EMBEDDING_MODEL, input=["new"])
+        self.assertEqual(cache.get_many(["new"]), [[0.25]])
+
+    @patch("ai.embedder.openai.Embedding.create")
+    def test_embed_skips_api_when_everything_is_cached(self, mock_openai: Mock) -> None:
+        cache = EmbeddingCache()
+        cache.put_many(["ok"], [[0.5]])
+
+        self.assertEqual(asyncio.run(embed_cached(["ok"], embed, cache)), [[0.5]])
+        mock_openai.assert_not_called()
+
+    def test_least_recently_used_entries_are_evicted_from_disk(self) -> None:
+        cache = EmbeddingCache(path=self.path, max_memory_entries=0, max_disk_entries=3)
+        cache.put_many(["a", "b", "c"], [[1.0], [2.0], [3.0]])
+        cache.get_many(["a"])
+        # a fourth entry evicts down to 90% of the cap, the two most recent
+        cache.put_many(["d"], [[4.0]])
+
+        restarted = EmbeddingCache(path=self.path)
+
+        self.assertEqual(
+            restarted.get_many(["a", "b", "c", "d"]), [[1.0], None, None, [4.0]]
+        )
+
+    def test_overwritten_entries_do_not_count_towards_the_cap(self) -> None:
+        cache = EmbeddingCache(path=self.path, max_memory_entries=0, max_disk_entries=3)
+        cache.put_many(["a", "b", "c"], [[1.0], [2.0], [3.0]])
+        cache.put_many(["a", "b", "c", "c"], [[1.0], [2.0], [3.0], [3.0]])
+
+        restarted = EmbeddingCache(path=self.path)
+
+        self.assertEqual(restarted.get_many(["a", "b", "c"]), [[1.0], [2.0], [3.0]])
+
+    def test_lookups_do_not_write_to_disk(self) -> None:
+        cache = EmbeddingCache(path=self.path, max_memory_entries=0)
+        cache.put_many(["a"], [[1.0]])
+
+        with patch.object(cache._store, "write") as mock_write:
+            cache.get_many(["a"])
+
+        mock_write.assert_not_called()
+
+    def test_hits_and_misses_are_counted_in_metrics(self) -> None:
+        metrics.reset()
+        cache = EmbeddingCache()
+        cache.put_many(["ok"], [[0.5]])
+
+        cache.get_many(["ok", "new"])
+
+        self.assertEqual(metrics.counters["embedding_cache.memory_hits"], 1)
+        self.assertEqual(metrics.counters["embedding_cache.misses"], 1)
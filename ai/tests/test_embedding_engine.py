@@ -0,0 +1,135 @@
+import asyncio
+import time
+import unittest
+from typing import Any
+from unittest.mock import MagicMock
+import numpy as np
+from openai.error import APIError, RateLimitError
+from ai.embedding_cache import EmbeddingCache
+from ai.embedding_engine import EmbeddingEngine, RateLimiter
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_waits_for_tokens_to_refill(self) -> None:
+        # 100 tokens per second
+        limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=6000)
+        await limiter.acquire(6000)
+
+        started = time.monotonic()
+        await limiter.acquire(10)
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.08)
+
+    async def test_pause_holds_requests_back(self) -> None:
+        limiter = RateLimiter()
+        limiter.pause(0.05)
+
+        started = time.monotonic()
+        await limiter.acquire(1)
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+
+class TestEmbeddingEngine(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.requests: list[list[str]] = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.failures: list[Exception] = []
+
+    async def request(self, texts: list[str]) -> list[list[float]]:
+        self.requests.append(texts)
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        # later requests complete first
+        await asyncio.sleep(0.01 / len(self.requests))
+        self.in_flight -= 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return [[float(text)] for text in texts]
+
+    def engine(self, **kwargs: Any) -> EmbeddingEngine:
+        options: dict[str, Any] = dict(
+            request_size=2,
+            max_in_flight=3,
+            cache=None,
+            request=self.request,
+            chunk=lambda texts: [[(text, len(text))] for text in texts],
+            rate_limit_pause=0.01,
+        )
+        options.update(kwargs)
+        return EmbeddingEngine(**options)
+
+    async def collect(
+        self, engine: EmbeddingEngine, texts: list[str]
+    ) -> list[tuple[int, list[float]]]:
+        return [result async for result in engine.embed(texts)]
+
+    async def test_embeddings_keep_their_index(self) -> None:
+        texts = [str(i) for i in range(9)]
+        results = await self.collect(self.engine(), texts)
+
+        self.assertEqual(sorted(results), [(i, [float(i)]) for i in range(9)])
+        self.assertEqual(len(self.requests), 5)
+        self.assertEqual(self.most_in_flight, 3)
+
+    async def test_empty_texts_are_skipped(self) -> None:
+        results = await self.collect(self.engine(), ["1", "", "2"])
+
+        self.assertEqual(sorted(results), [(0, [1.0]), (2, [2.0])])
+
+    async def test_failed_requests_are_retried(self) -> None:
+        self.failures = [
+            RateLimitError("slow down"),  # type: ignore
+            APIError("oops"),  # type: ignore
+        ]
+        results = await self.collect(self.engine(max_in_flight=1), ["1", "2"])
+
+        self.assertEqual(results, [(0, [1.0]), (1, [2.0])])
+        self.assertEqual(len(self.requests), 3)
+
+    async def test_gives_up_after_max_attempts(self) -> None:
+        self.failures = [APIError("oops")] * 2  # type: ignore
+        with self.assertRaises(APIError):
+            await self.collect(self.engine(max_attempts=2), ["1"])
+
+    async def test_cached_texts_are_not_requested(self) -> None:
+        cache = MagicMock(spec=EmbeddingCache)
+        cache.get_many.side_effect = lambda texts: [
+            [9.0] if text == "1" else None for text in texts
+        ]
+        results = await self.collect(self.engine(cache=cache), ["1", "2"])
+
+        self.assertEqual(sorted(results), [(0, [9.0]), (1, [2.0])])
+        self.assertEqual(self.requests, [["2"]])
+        cache.put_many.assert_called_once_with(["2"], [[2.0]])
+
+    async def test_requests_are_packed_by_tokens(self) -> None:
+        texts = ["1" * 4, "2", "3", "4" * 5, "5"]
+        engine = self.engine(request_size=10, max_request_tokens=6)
+
+        results = await self.collect(engine, texts)
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.requests, [["1111", "2", "3"], ["44444", "5"]])
+
+    async def test_long_texts_are_embedded_in_chunks_and_pooled(self) -> None:
+        async def request(texts: list[str]) -> list[list[float]]:
+            self.requests.append(texts)
+            return [[1.0, 0.0] if text[0] == "a" else [0.0, 1.0] for text in texts]
+
+        def chunk(texts: list[str]) -> list[list[tuple[str, int]]]:
+            return [
+                [
+                    (text[i : i + 3], len(text[i : i + 3]))
+                    for i in range(0, len(text), 3)
+                ]
+                for text in texts
+            ]
+
+        engine = self.engine(request=request, chunk=chunk, max_request_tokens=3)
+        results = dict(await self.collect(engine, ["aaabb", "b"]))
+
+        self.assertEqual(self.requests, [["aaa"], ["bb", "b"]])
+        np.testing.assert_allclose(results[0], np.array([3.0, 2.0]) / np.sqrt(13))
+        self.assertEqual(results[1], [0.0, 1.0])
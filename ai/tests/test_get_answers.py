@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from ai.constants import GPT_INFO, INTRODUCTION
+from ai.get_answers import PromptBuilder, ask, format_snippet, query_message
+
+
+class FakeEncoding:
+    """Counts one token per whitespace separated word."""
+
+    def __init__(self) -> None:
+        self.encoded: list[str] = []
+
+    def encode(self, text: str) -> list[int]:
+        self.encoded.append(text)
+        return [0] * len(text.split())
+
+    def encode_batch(self, texts: list[str], num_threads: int = 8) -> list[list[int]]:
+        return [self.encode(text) for text in texts]
+
+
+class TestPromptBuilder(unittest.TestCase):
+    def setUp(self) -> None:
+        self.encoding = FakeEncoding()
+        patcher = patch("ai.get_answers.get_encoding", return_value=self.encoding)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_prompt_format(self) -> None:
+        prompt = query_message("when?", ["first", "second"])
+        self.assertEqual(
+            prompt,
+            INTRODUCTION
+            + format_snippet("first")
+            + format_snippet("second")
+            + "\n\nQuestion: when?",
+        )
+
+    def test_stops_at_token_budget(self) -> None:
+        builder = PromptBuilder("when?", token_budget=10_000)
+        base = builder.tokens
+        snippet = len(format_snippet("one two").split())
+
+        prompt = query_message(
+            "when?", ["one two"] * 5, token_budget=base + 2 * snippet
+        )
+
+        self.assertEqual(prompt.count("Telegram Message"), 2)
+
+    def test_each_message_is_tokenized_once(self) -> None:
+        self.encoding.encoded.clear()
+        messages = [f"message {i}" for i in range(100)]
+
+        query_message("when?", messages, token_budget=10**6)
+
+        # the introduction, the question, and every message on its own
+        self.assertEqual(len(self.encoding.encoded), 102)
+
+    def test_known_token_counts_are_reused(self) -> None:
+        builder = PromptBuilder("when?", token_budget=10**6)
+        self.encoding.encoded.clear()
+
+        self.assertTrue(builder.add("hello", tokens=3))
+
+        self.assertEqual(self.encoding.encoded, [])
+        self.assertIn(format_snippet("hello"), builder.build())
+
+    def test_message_over_budget_is_rejected(self) -> None:
+        builder = PromptBuilder("when?", token_budget=10**6)
+        builder.token_budget = builder.tokens + 1
+        self.assertFalse(builder.add("a b c d e f"))
+        self.assertNotIn("a b c d e f", builder.build())
+
+
+class TestAsk(unittest.TestCase):
+    @patch("ai.get_answers.query_message", side_effect=lambda q, m, **_: q)
+    @patch("ai.get_answers.openai.ChatCompletion.create")
+    def test_request_messages_are_not_shared(
+        self, mock_create: MagicMock, mock_query_message: MagicMock
+    ) -> None:
+        mock_create.return_value = {"choices": [{"message": {"content": "answer"}}]}
+        gpt_info_before = [dict(info) for info in GPT_INFO]
+
+        self.assertEqual(ask("first prompt", []), "answer")
+        self.assertEqual(ask("second prompt", []), "answer")
+
+        first, second = [call.kwargs["messages"] for call in mock_create.call_args_list]
+        self.assertIsNot(first, second)
+        self.assertEqual(first[1], {"role": "user", "content": "first prompt"})
+        self.assertEqual(second[1], {"role": "user", "content": "second prompt"})
+        self.assertEqual(GPT_INFO, gpt_info_before)
@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import MagicMock
+from ai.relevance import ScoreThresholds, select_matches
+from db.db_types import PCQueryResult
+
+
+def matches(*scores: float) -> list[PCQueryResult]:
+    return [
+        {"id": f"1:{i}", "score": score, "values": []} for i, score in enumerate(scores)
+    ]
+
+
+class TestSelectMatches(unittest.TestCase):
+    def test_matches_below_the_threshold_are_dropped(self) -> None:
+        self.assertEqual(select_matches(matches(0.7, 0.6), threshold=0.75), [])
+
+    def test_dominant_match_is_kept_alone(self) -> None:
+        selected = select_matches(matches(0.92, 0.8, 0.79), threshold=0.75)
+
+        self.assertEqual([m["id"] for m in selected], ["1:0"])
+
+    def test_top_k_matches_are_kept_by_default(self) -> None:
+        selected = select_matches(matches(0.9, 0.87, 0.85, 0.84), threshold=0.75)
+
+        self.assertEqual(len(selected), 3)
+
+    def test_clustered_matches_are_all_kept_up_to_max_k(self) -> None:
+        scores = [0.9 - i / 1000 for i in range(10)]
+
+        self.assertEqual(len(select_matches(matches(*scores), 0.75, max_k=6)), 6)
+        self.assertEqual(len(select_matches(matches(*scores[:5]), 0.75)), 5)
+
+
+class TestScoreThresholds(unittest.TestCase):
+    def test_default_without_loader(self) -> None:
+        self.assertEqual(ScoreThresholds(default=0.7).get(1), 0.7)
+
+    def test_chat_threshold_is_cached_until_it_expires(self) -> None:
+        now = [0.0]
+        load = MagicMock(side_effect=[0.8, None])
+        thresholds = ScoreThresholds(
+            default=0.7, load=load, ttl=60, clock=lambda: now[0]
+        )
+
+        self.assertEqual(thresholds.get(1), 0.8)
+        self.assertEqual(thresholds.get(1), 0.8)
+        self.assertEqual(load.call_count, 1)
+        now[0] = 61
+        self.assertEqual(thresholds.get(1), 0.7)
@@ -0,0 +1,52 @@
+from functools import lru_cache
+import tiktoken  # for counting tokens
+
+from . import GPT_MODEL
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = GPT_MODEL) -> tiktoken.Encoding:
+    """
+    Return the tokenizer of a model. The lookup is done once per model.
+    """
+    return tiktoken.encoding_for_model(model)
+
+
+def num_tokens(text: str, model: str = GPT_MODEL) -> int:
+    """
+    Return the number of tokens in a string.
+
+    Parameters:
+    text (str): The input text.
+    model (str): The model to use for tokenization. Defaults to GPT_MODEL.
+
+    Returns:
+    int: The number of tokens in the input text.
+    """
+    return len(get_encoding(model).encode(text))
+
+
+def chunk_texts(
+    texts: list[str], max_tokens: int, model: str = GPT_MODEL
+) -> list[list[tuple[str, int]]]:
+    """
+    Split texts longer than max_tokens into chunks of at most max_tokens.
+
+    Parameters:
+    texts (list[str]): The texts to split.
+    max_tokens (int): The number of tokens of the longest chunk.
+    model (str): The model to use for tokenization. Defaults to GPT_MODEL.
+
+    Returns:
+    list[list[tuple[str, int]]]: For every text, its chunks and their number
+        of tokens, the text itself if it is short enough.
+    """
+    encoding = get_encoding(model)
+    chunks: list[list[tuple[str, int]]] = []
+    for text, tokens in zip(texts, encoding.encode_batch(texts)):
+        if len(tokens) <= max_tokens:
+            chunks.append([(text, len(tokens))])
+            continue
+        parts = [tokens[i : i + max_tokens] for i in range(0, len(tokens), max_tokens)]
+        chunks.append([(encoding.decode(part), len(part)) for part in parts])
+    return chunks
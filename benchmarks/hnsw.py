@@ -0,0 +1,101 @@
+"""
+Latency of the HNSW graph of the local index as a chat grows.
+
+One chat is filled with clustered embeddings, see benchmarks.quantization,
+in the batches the bot uploads, and at every checkpoint queries are timed
+through the exact search and through the graph with every given ef, and
+the graph's recall is measured against the exact search.
+
+    python -m benchmarks.hnsw --messages 20000 --ef_search 128 256 384
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from db.db_types import PCEmbeddingData
+from db.hnsw import HNSWConfig
+from db.local_index import LocalIndex
+from db.vectordb import query
+from .quantization import CHAT_ID, clustered_vectors
+
+BATCH_SIZE = 100
+
+
+def timed_queries(
+    index: LocalIndex, questions: list[list[float]], top_k: int
+) -> tuple[float, list[set[str]]]:
+    timings, results = [], []
+    for question in questions:
+        start = time.perf_counter()
+        matches = query(CHAT_ID, question, top_k, index)["matches"]
+        timings.append(time.perf_counter() - start)
+        results.append({match["id"] for match in matches})
+    timings.sort()
+    return timings[len(timings) // 2], results
+
+
+def main(
+    count: int,
+    checkpoints: list[int],
+    queries: int,
+    top_k: int,
+    ef_search: list[int],
+    noise: float,
+) -> None:
+    vectors = clustered_vectors(count, topics=200, noise=noise)
+    questions = clustered_vectors(queries, topics=200, noise=noise, seed=1).tolist()
+    config = HNSWConfig(min_vectors=min(checkpoints))
+
+    print(f"{queries} queries, recall@{top_k} of the graph against exact search")
+    print("  vectors   build s   exact ms    ef   graph ms   recall")
+    with tempfile.TemporaryDirectory() as path:
+        exact = LocalIndex(f"{path}/exact")
+        graph = LocalIndex(f"{path}/graph", hnsw=config)
+        build_time = 0.0
+        for start in range(0, count, BATCH_SIZE):
+            batch: list[PCEmbeddingData] = [
+                {
+                    "id": f"{CHAT_ID}:{i}",
+                    "values": vectors[i].tolist(),
+                    "metadata": {"chat_id": CHAT_ID},
+                }
+                for i in range(start, min(start + BATCH_SIZE, count))
+            ]
+            exact.upsert(vectors=batch)
+            began = time.perf_counter()
+            graph.upsert(vectors=batch)
+            graph.wait_for_graphs()
+            build_time += time.perf_counter() - began
+            size = start + len(batch)
+            if size not in checkpoints:
+                continue
+            exact_p50, truth = timed_queries(exact, questions, top_k)
+            print(f"  {size:7} {build_time:9.1f} {exact_p50 * 1000:10.2f}")
+            for ef in ef_search:
+                config.ef_search = ef
+                graph_p50, found = timed_queries(graph, questions, top_k)
+                recall = np.mean([len(f & t) / top_k for f, t in zip(found, truth)])
+                print(f"{ef:36} {graph_p50 * 1000:10.2f} {recall:8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument(
+        "--checkpoints", type=int, nargs="+", default=[2500, 5000, 10000, 20000]
+    )
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--ef_search", type=int, nargs="+", default=[128, 256, 384])
+    parser.add_argument("--noise", type=float, default=1.0)
+    args = parser.parse_args()
+    main(
+        args.messages,
+        args.checkpoints,
+        args.queries,
+        args.top_k,
+        args.ef_search,
+        args.noise,
+    )
@@ -0,0 +1,52 @@
+"""
+Micro-benchmark of keyword lookups in db.keyword_index.
+
+Indexes a chat of random messages and reports the lookup latency and the
+memory taken by the postings.
+
+    python -m benchmarks.keyword_index --messages 100000 --repeat 200
+"""
+import argparse
+import time
+
+from benchmarks.prompt_builder import random_messages
+from db.keyword_index import KeywordIndex
+
+
+def postings_bytes(index: KeywordIndex, chat_id: int) -> int:
+    chat = index._chat(chat_id)
+    return sum(
+        docs.itemsize * len(docs) + frequencies.itemsize * len(frequencies)
+        for docs, frequencies in chat.postings.values()
+    )
+
+
+def main(count: int, words: int, repeat: int) -> None:
+    messages = random_messages(count, words)
+    index = KeywordIndex()
+    start = time.perf_counter()
+    index.add_many(1, enumerate(messages))
+    build = time.perf_counter() - start
+
+    queries = [" ".join(message.split()[:3]) for message in messages[:repeat]]
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(1, query)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    print(f"{count} messages of {words} words")
+    print(f"  build:        {build * 1000:8.2f} ms")
+    print(f"  postings:     {postings_bytes(index, 1) / 2**20:8.2f} MB")
+    print(f"  p50 lookup:   {timings[len(timings) // 2] * 1000:8.3f} ms")
+    print(f"  p95 lookup:   {timings[int(len(timings) * 0.95)] * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--words", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    main(args.messages, args.words, args.repeat)
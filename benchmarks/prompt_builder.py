@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of prompt assembly in ai.get_answers.query_message.
+
+Compares the previous implementation, which re-tokenized the whole growing
+prompt for every message it appended, with the incremental PromptBuilder.
+
+    python -m benchmarks.prompt_builder --messages 200 --repeat 5
+"""
+import argparse
+import random
+import string
+import time
+from typing import Callable
+
+import tiktoken
+
+from ai import GPT_MODEL
+from ai.constants import INTRODUCTION
+from ai.get_answers import query_message
+
+
+def query_message_quadratic(
+    query: str,
+    messages: list[str],
+    model: str = GPT_MODEL,
+    token_budget: int = 4096 - 500,
+) -> str:
+    """The implementation query_message had before the PromptBuilder."""
+    question = f"\n\nQuestion: {query}"
+    message = INTRODUCTION
+    for text in messages:
+        next_doc = f'\n\nTelegram Message:\n"""\n{text}\n"""'
+        encoding = tiktoken.encoding_for_model(model)
+        if len(encoding.encode(message + next_doc + question)) > token_budget:
+            break
+        message += next_doc
+    return message + question
+
+
+def random_messages(count: int, words: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+
+    def word() -> str:
+        return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9)))
+
+    return [" ".join(word() for _ in range(words)) for _ in range(count)]
+
+
+def best_of(repeat: int, func: Callable[[], object]) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(count: int, words: int, token_budget: int, repeat: int) -> None:
+    messages = random_messages(count, words)
+    query = "When is the assignment deadline?"
+
+    # warm up tiktoken's caches so both sides are measured the same way
+    query_message(query, messages[:1])
+
+    quadratic = best_of(
+        repeat,
+        lambda: query_message_quadratic(query, messages, token_budget=token_budget),
+    )
+    linear = best_of(
+        repeat, lambda: query_message(query, messages, token_budget=token_budget)
+    )
+    print(f"{count} messages of {words} words, budget {token_budget} tokens")
+    print(f"  previous query_message: {quadratic * 1000:8.2f} ms")
+    print(f"  PromptBuilder:          {linear * 1000:8.2f} ms")
+    print(f"  speedup:                {quadratic / linear:8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--words", type=int, default=30)
+    parser.add_argument("--token_budget", type=int, default=4096 - 500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.messages, args.words, args.token_budget, args.repeat)
@@ -0,0 +1,104 @@
+"""
+Recall and latency report of the quantization options of the local index.
+
+Embeddings are simulated as noisy copies of a few hundred topic vectors,
+which makes them cluster like message embeddings do. Every option is
+compared with the exact float32 search on recall@k, query latency and the
+memory taken by what is searched.
+
+    python -m benchmarks.quantization --messages 10000 --top_k 10
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import numpy.typing as npt
+
+from db.local_index import EMBEDDING_DIMENSION, LocalIndex
+from db.vectordb import query
+
+CHAT_ID = 1
+
+
+def clustered_vectors(
+    count: int, topics: int, noise: float, seed: int = 0
+) -> npt.NDArray[np.float32]:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, EMBEDDING_DIMENSION), dtype=np.float32)
+    vectors = centers[rng.integers(topics, size=count)] + noise * rng.standard_normal(
+        (count, EMBEDDING_DIMENSION), dtype=np.float32
+    )
+    normalized: npt.NDArray[np.float32] = vectors / np.linalg.norm(
+        vectors, axis=1, keepdims=True
+    )
+    return normalized
+
+
+def build(path: str, quantization: str, vectors: npt.NDArray[np.float32]) -> LocalIndex:
+    index = LocalIndex(path, quantization=quantization)
+    for start in range(0, len(vectors), 2000):
+        index.upsert(
+            vectors=[
+                {
+                    "id": f"{CHAT_ID}:{i}",
+                    "values": vectors[i].tolist(),
+                    "metadata": {"chat_id": CHAT_ID},
+                }
+                for i in range(start, min(start + 2000, len(vectors)))
+            ]
+        )
+    index.wait_for_codes()
+    return index
+
+
+def searched_bytes(index: LocalIndex) -> int:
+    chat = index._chat(CHAT_ID)
+    count = len(chat.ids)
+    if chat.quantized is None:
+        return count * 4 * index.dimension
+    _, codes = chat.quantized
+    return count * int(codes[0].nbytes)
+
+
+def main(count: int, queries: int, top_k: int, topics: int, noise: float) -> None:
+    vectors = clustered_vectors(count, topics, noise)
+    questions = clustered_vectors(queries, topics, noise, seed=1).tolist()
+
+    print(f"{count} vectors, {queries} queries, recall@{top_k} against exact search")
+    print("  option   searched MB   recall   p50 ms   p95 ms   build s")
+    exact: list[set[str]] = []
+    with tempfile.TemporaryDirectory() as path:
+        for quantization in ["none", "float16", "int8", "pq"]:
+            start = time.perf_counter()
+            index = build(f"{path}/{quantization}", quantization, vectors)
+            build_time = time.perf_counter() - start
+
+            timings, results = [], []
+            for question in questions:
+                start = time.perf_counter()
+                matches = query(CHAT_ID, question, top_k, index)["matches"]
+                timings.append(time.perf_counter() - start)
+                results.append({match["id"] for match in matches})
+            if quantization == "none":
+                exact = results
+            recall = np.mean(
+                [len(found & truth) / top_k for found, truth in zip(results, exact)]
+            )
+            timings.sort()
+            print(
+                f"  {quantization:8} {searched_bytes(index) / 2**20:11.2f}"
+                f" {recall:8.3f} {timings[len(timings) // 2] * 1000:8.2f}"
+                f" {timings[int(len(timings) * 0.95)] * 1000:8.2f} {build_time:9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=1.0)
+    args = parser.parse_args()
+    main(args.messages, args.queries, args.top_k, args.topics, args.noise)
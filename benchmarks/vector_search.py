@@ -0,0 +1,114 @@
+"""
+Benchmark of the local vector backend against a remote index.
+
+Pinecone is stood in for by an HTTP server on localhost answering Pinecone's
+/query REST call from the same kind of index, so the difference between the
+two is the cost of the request itself: serializing the 1536 float query,
+the round trip and parsing the response. Real Pinecone calls also pay the
+network latency to the Pinecone region, which --rtt_ms adds to the server.
+
+    python -m benchmarks.vector_search --messages 10000 --repeat 100
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+import numpy as np
+
+from db.local_index import EMBEDDING_DIMENSION, LocalIndex
+from db.vectordb import chat_namespace, query
+
+CHAT_ID = 1
+
+
+def stand_in_server(index: LocalIndex, rtt: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(rtt)
+            results = index.query(
+                vector=body["vector"], top_k=body["topK"], namespace=body["namespace"]
+            )
+            payload = json.dumps(results).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def remote_query(url: str, vector: list[float], top_k: int) -> Any:
+    body = json.dumps(
+        {"vector": vector, "topK": top_k, "namespace": chat_namespace(CHAT_ID)}
+    ).encode()
+    request = urllib.request.Request(
+        url, data=body, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def percentiles(repeat: int, func: Callable[[], object]) -> tuple[float, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main(count: int, repeat: int, rtt_ms: float) -> None:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((count, EMBEDDING_DIMENSION), dtype=np.float32)
+    queries = rng.standard_normal((repeat, EMBEDDING_DIMENSION)).tolist()
+
+    with tempfile.TemporaryDirectory() as path:
+        index = LocalIndex(path)
+        for start in range(0, count, 1000):
+            index.upsert(
+                vectors=[
+                    {
+                        "id": f"{CHAT_ID}:{i}",
+                        "values": vectors[i].tolist(),
+                        "metadata": {"chat_id": CHAT_ID},
+                    }
+                    for i in range(start, min(start + 1000, count))
+                ]
+            )
+        server = stand_in_server(index, rtt_ms / 1000)
+        url = f"http://127.0.0.1:{server.server_address[1]}/query"
+
+        it = iter(queries * 2)
+        local = percentiles(repeat, lambda: query(CHAT_ID, next(it), 3, index))
+        remote = percentiles(repeat, lambda: remote_query(url, next(it), 3))
+        server.shutdown()
+
+    print(f"{count} vectors of {EMBEDDING_DIMENSION} dimensions in one chat")
+    print(
+        f"  local backend:   p50 {local[0] * 1000:7.2f} ms  p95 {local[1] * 1000:7.2f} ms"
+    )
+    print(
+        f"  stand-in server: p50 {remote[0] * 1000:7.2f} ms  p95 {remote[1] * 1000:7.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--rtt_ms", type=float, default=0)
+    args = parser.parse_args()
+    main(args.messages, args.repeat, args.rtt_ms)
@@ -1,11 +1,20 @@
+import asyncio
+import os
 import re
-from telegram import Bot
-from typing import Any
+import time
+from telegram import Bot, Message
+from telegram.error import RetryAfter, TelegramError
+from typing import Any, AsyncIterator, Callable
+from ai.constants import NO_ANSWER
+from . import logger
 from .messages import messages
 
 
 BOT_COMMANDS = ["/q", "/help"]
 
+# Minimum time between two edits of a streamed answer, to respect Telegram's limits
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", 1.0))
+
 
 def find_bot_command(text: str) -> str:
     """
@@ -45,3 +54,157 @@ def send_help_response(
     return bot.send_message(
         chat_id=chat_id, text=messages["help"].format(first_name, group_name)
     )  # type: ignore
+
+
+async def send_streamed_answer(
+    bot: Bot,
+    chat_id: int,
+    reply_to_message_id: int,
+    chunks: AsyncIterator[str],
+    edit_interval: float = STREAM_EDIT_INTERVAL,
+    clock: Callable[[], float] = time.monotonic,
+    placeholder: Message | None = None,
+) -> str:
+    """
+    This function sends a placeholder reply right away and edits it as the
+    pieces of the answer arrive, at most once every edit_interval seconds.
+    ---
+    Parameters:
+    bot: telegram.Bot
+        The bot object that is used to send and edit the message.
+    chat_id: int
+        The id of the chat to which the answer is to be sent.
+    reply_to_message_id: int
+        The id of the message the answer replies to.
+    chunks: AsyncIterator[str]
+        The pieces of the answer, in order.
+    placeholder: telegram.Message | None
+        The placeholder to edit, if it was already sent.
+    ---
+    Returns:
+    str
+        The full answer.
+    """
+    if placeholder is None:
+        placeholder = await _send_placeholder(bot, chat_id, reply_to_message_id)
+    answer = ""
+    last_edit = float("-inf")  # the first piece is shown immediately
+    async for chunk in chunks:
+        answer += chunk
+        if clock() - last_edit >= edit_interval:
+            last_edit = clock()
+            await edit_message(
+                bot,
+                chat_id,
+                placeholder.message_id,
+                messages["respond_to_question"].format(answer),
+            )
+
+    answer = answer.strip() or NO_ANSWER
+    await edit_message(
+        bot, chat_id, placeholder.message_id, answer, reply_to_message_id
+    )
+    return answer
+
+
+class Reply:
+    """
+    The reply to a question. With a placeholder, the "one moment" reply is
+    sent as soon as the Reply is created, while the answer is worked on, and
+    is edited into the answer. Without, the answer is sent once it is known.
+    """
+
+    def __init__(
+        self, bot: Bot, chat_id: int, reply_to_message_id: int, placeholder: bool
+    ) -> None:
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self._placeholder: asyncio.Task[Message] | None = None
+        if placeholder:
+            self._placeholder = asyncio.create_task(
+                _send_placeholder(bot, chat_id, reply_to_message_id)
+            )
+
+    async def send(self, text: str) -> None:
+        """Replies with the given text, in place of the placeholder if any."""
+        if self._placeholder is None:
+            await self.bot.send_message(
+                chat_id=self.chat_id,
+                text=text,
+                reply_to_message_id=self.reply_to_message_id,
+            )
+            return
+        placeholder = await self._placeholder
+        await edit_message(
+            self.bot,
+            self.chat_id,
+            placeholder.message_id,
+            text,
+            self.reply_to_message_id,
+        )
+
+    async def stream(self, chunks: AsyncIterator[str]) -> str:
+        """Streams the answer into the placeholder, see send_streamed_answer."""
+        placeholder = None
+        if self._placeholder is not None:
+            placeholder = await self._placeholder
+        return await send_streamed_answer(
+            self.bot,
+            self.chat_id,
+            self.reply_to_message_id,
+            chunks,
+            placeholder=placeholder,
+        )
+
+
+async def _send_placeholder(
+    bot: Bot, chat_id: int, reply_to_message_id: int
+) -> Message:
+    placeholder: Message = await bot.send_message(
+        chat_id=chat_id,
+        text=messages["respond_to_question"].format(""),
+        reply_to_message_id=reply_to_message_id,
+    )
+    return placeholder
+
+
+async def edit_message(
+    bot: Bot,
+    chat_id: int,
+    message_id: int,
+    text: str,
+    reply_to_message_id: int | None = None,
+) -> None:
+    """
+    This function edits a message of the bot, logging instead of raising
+    when it fails, as the next edit of a streamed answer catches up.
+    ---
+    Parameters:
+    reply_to_message_id: int | None
+        Set for the final edit, which nothing catches up with. It is retried
+        once flood control allows it, and if the message still can't be
+        edited, the text is sent as a new reply to this message instead.
+    """
+    try:
+        await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id)
+        return
+    except RetryAfter as e:
+        error: TelegramError = e
+        if reply_to_message_id is not None:
+            await asyncio.sleep(e.retry_after)
+            try:
+                await bot.edit_message_text(
+                    text=text, chat_id=chat_id, message_id=message_id
+                )
+                return
+            except TelegramError as retry_error:
+                error = retry_error
+    except TelegramError as e:
+        error = e
+    logger.warning(f"Could not edit message {message_id} in chat {chat_id}: {error}")
+    # an unchanged text already shows
+    if reply_to_message_id is not None and "not modified" not in error.message:
+        await bot.send_message(
+            chat_id=chat_id, text=text, reply_to_message_id=reply_to_message_id
+        )
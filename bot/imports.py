@@ -0,0 +1,170 @@
+"""
+Background history imports.
+
+An uploaded export is imported by a job running next to the bot's handlers,
+instead of inside the handler that received it, and reports its progress as
+it goes. Only a few jobs run at once, the others wait in the queue, so large
+imports only ever hold a few threads of the OpenAI, Pinecone and MongoDB
+pools that live messages and questions need too.
+"""
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Literal
+
+from bot import logger
+
+ImportStatus = Literal[
+    "queued", "downloading", "parsing", "embedding", "uploading", "done", "failed"
+]
+
+# Imports running at once, later ones are queued
+MAX_RUNNING_IMPORTS = int(os.getenv("MAX_RUNNING_IMPORTS", 2))
+# Seconds between two progress reports of an import
+PROGRESS_INTERVAL = float(os.getenv("IMPORT_PROGRESS_INTERVAL", 5))
+
+
+@dataclass
+class ImportJob:
+    id: str
+    # the chat the export was uploaded in
+    chat_id: int
+    status: ImportStatus = "queued"
+    # queued jobs that will start before this one, while it is queued
+    ahead: int = 0
+    # messages read from the export, already imported before, embedded, and stored
+    parsed: int = 0
+    skipped: int = 0
+    embedded: int = 0
+    uploaded: int = 0
+    chat_title: str | None = None
+    error: Exception | None = None
+    started: float | None = None
+    finished: float | None = None
+
+
+class ImportQueue:
+    """
+    Runs import jobs in the background, at most `max_running` at a time, and
+    reports the progress of every job, queued or running, every
+    `progress_interval` seconds if it changed, and once more when it is done
+    or failed.
+    """
+
+    def __init__(
+        self,
+        max_running: int = MAX_RUNNING_IMPORTS,
+        progress_interval: float = PROGRESS_INTERVAL,
+    ) -> None:
+        self.progress_interval = progress_interval
+        # queued and running jobs, and the last finished one of every chat
+        self.jobs: dict[str, ImportJob] = {}
+        self._slots = asyncio.Semaphore(max_running)
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    def submit(
+        self,
+        chat_id: int,
+        run: Callable[[ImportJob], Awaitable[None]],
+        report: Callable[[ImportJob], Awaitable[None]],
+    ) -> ImportJob:
+        """
+        Queues an import and returns its job right away.
+        ---
+        Parameters
+            chat_id: int
+                    The chat the export was uploaded in.
+            run: Callable[[ImportJob], Awaitable[None]]
+                    Imports the export, updating the status and counts of
+                    the job as it goes.
+            report: Callable[[ImportJob], Awaitable[None]]
+                    Reports the progress of the job to the uploader.
+        Returns
+            job: ImportJob
+                    The queued job.
+        """
+        # finished jobs are kept until the chat's next import, so the
+        # registry does not grow with every import the bot ever ran
+        for finished in [
+            j for j in self.jobs.values() if j.chat_id == chat_id and j.finished
+        ]:
+            del self.jobs[finished.id]
+        job = ImportJob(uuid.uuid4().hex[:8], chat_id)
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._run(job, run, report))
+        # the loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def join(self) -> None:
+        """Waits for every job submitted so far to finish."""
+        await asyncio.gather(*self._tasks)
+
+    async def _run(
+        self,
+        job: ImportJob,
+        run: Callable[[ImportJob], Awaitable[None]],
+        report: Callable[[ImportJob], Awaitable[None]],
+    ) -> None:
+        reporting = asyncio.create_task(self._report_progress(job, report))
+        try:
+            async with self._slots:
+                job.started = time.monotonic()
+                try:
+                    await run(job)
+                    job.status = "done"
+                except Exception as e:
+                    logger.exception(f"Import {job.id} of chat {job.chat_id} failed")
+                    job.status = "failed"
+                    job.error = e
+                finally:
+                    job.finished = time.monotonic()
+        finally:
+            reporting.cancel()
+        await self._report(job, report)
+
+    async def _report_progress(
+        self, job: ImportJob, report: Callable[[ImportJob], Awaitable[None]]
+    ) -> None:
+        reported = None
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            if job.started is None:
+                job.ahead = self._queued_before(job)
+            progress = (
+                job.status,
+                job.ahead,
+                job.parsed,
+                job.skipped,
+                job.embedded,
+                job.uploaded,
+            )
+            # Telegram refuses edits that leave a message as it was
+            if progress != reported:
+                reported = progress
+                await self._report(job, report)
+
+    def _queued_before(self, job: ImportJob) -> int:
+        # jobs are kept in the order they were submitted, and wait for a
+        # slot in that order
+        ahead = 0
+        for other in self.jobs.values():
+            if other is job:
+                break
+            if other.started is None:
+                ahead += 1
+        return ahead
+
+    async def _report(
+        self, job: ImportJob, report: Callable[[ImportJob], Awaitable[None]]
+    ) -> None:
+        try:
+            await report(job)
+        except Exception as e:
+            logger.warning(f"Could not report the progress of import {job.id}: {e}")
+
+
+import_queue = ImportQueue()
@@ -1,8 +1,38 @@
 import os
+import asyncio
+from bot import logger
 from bot.responses import start, help, handle_message, history
+from db.database import ensure_indexes
 from telegram.ext import ApplicationBuilder, Application, filters
 from telegram.ext import filters
 from telegram.ext import CommandHandler, MessageHandler, ContextTypes
+from utils import metrics
+
+# Updates handled at once, so a question waiting on GPT does not hold up the
+# messages of other chats
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 32))
+
+# Seconds between two logged snapshots of utils/metrics, 0 turns them off
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL_SECONDS", 300))
+
+# Keeps a reference to the metrics task, so it is not garbage collected
+_background_tasks: set[asyncio.Task[None]] = set()
+
+
+async def log_metrics(interval: float) -> None:
+    """
+    Logs the counters and stage timings of utils/metrics every interval seconds.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Metrics: {metrics.summary()}")
+
+
+async def start_background_tasks(app: Application) -> None:  # type: ignore
+    if METRICS_LOG_INTERVAL > 0:
+        task = asyncio.create_task(log_metrics(METRICS_LOG_INTERVAL))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
 
 def init(
@@ -12,7 +42,13 @@ def init(
 
     # Initialize Updater and Dispatcher
     PORT = int(os.environ.get("PORT", 5000))
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(MAX_CONCURRENT_UPDATES)
+        .post_init(start_background_tasks)
+        .build()
+    )
 
     # add a message handler
     msg_handler = MessageHandler(filters.ChatType.GROUPS & filters.ALL, handle_message)
@@ -27,6 +63,7 @@ def main(
     BOT_TOKEN: str,
     deploy: bool = False,
 ) -> None:
+    ensure_indexes()
     app.add_handler(CommandHandler("start", start, filters=~filters.ChatType.GROUPS))
     app.add_handler(CommandHandler("help", help, filters=~filters.ChatType.GROUPS))
     app.add_handler(MessageHandler(~filters.ChatType.GROUPS, history))
@@ -49,8 +49,15 @@ PS: I'm not single so if you DM me I won't reply. I only reply to messages on th
     """,
     "start_not_allowed_in_group": "You can only use /start in a private conversation with me and not on a group chat.",
     "unrecognized_command": "Sorry, I don't recognize that command. Please use /help to see the list of commands I recognize.",
-    "history_too_big": "The uploaded file is too big. Please upload a file less than 15MB.",
+    "no_relevant_messages": "Sorry, I could not find anything about this in the group's messages.",
+    "question_timeout": "Sorry, I could not find an answer in time. Please try again in a moment.",
+    "question_failed": "Sorry, something went wrong while answering your question. Please try again later.",
+    "history_too_big": "The uploaded file is too big. Please upload a file less than {}MB.",
     "history_invalid": "The uploaded file is invalid. Please upload a valid file.",
     "history_empty": "The uploaded file is empty. Please upload a valid file.",
+    "history_import_queued": "Your history is queued for import. I will keep this message updated as it goes.",
+    "history_import_waiting": "Your history is queued for import (job {}), {} other imports will start before it.",
+    "history_import_progress": "Importing your history (job {}): {}. {} messages read, {} already imported, {} embedded, {} stored.",
+    "history_import_failed": "Sorry, your history could not be imported. Please try again later.",
     "history_upload_success": "Your history has been uploaded successfully. I will now be able to answer questions from {}'s history.",
 }
@@ -1,26 +1,85 @@
-from telegram import Update
+from telegram import Bot, File, Update
 from telegram.ext import ContextTypes
 from db.database import (
     get_multiple_messages_by_id,
+    get_score_threshold,
     store_message_to_db,
     store_multiple_messages_to_db,
 )
-from db.vectordb import upload_vectors, query, batch_upload_vectors
+from db.vectordb import (
+    METADATA_TEXT,
+    batch_upload_vectors,
+    message_embedding,
+    query,
+    upload_vectors,
+)
+from db.history_export import InvalidExportError, read_export
+from db.import_ledger import import_ledger
+from db.keyword_index import keyword_index, reciprocal_rank_fusion
+from db.reply_graph import reply_graph
 from db.db_types import (
     AddMessageResult,
     SerializedMessage,
     PCEmbeddingData,
-    NoFromUserError,
 )
-from ai.embedder import embed, batch_embed_messages
-from ai.get_answers import ask
-from bot.helpers import find_bot_command, send_help_response
-from utils.batch import split_into_batches
+from ai.embedder import embed, embed_cached
+from ai.embedding_engine import embedding_engine
+from ai.answer_cache import answer_cache
+from ai.constants import NO_ANSWER
+from ai.coalescer import embedding_coalescer
+from ai.get_answers import ask, ask_stream, snippet_tokens
+from ai.relevance import ScoreThresholds, select_matches
+from bot.helpers import (
+    Reply,
+    edit_message,
+    find_bot_command,
+    send_help_response,
+)
+from utils.single_flight import SingleFlight
+from utils import metrics
+from utils.timeout import Deadline, TimeoutError
+from bot.imports import ImportJob, import_queue
 from bot.messages import messages as bot_messages
-import io
-import json
+from bot import logger
+from utils.executors import (
+    CPU_EXECUTOR,
+    IMPORT_EXECUTOR,
+    INDEX_EXECUTOR,
+    MONGO_EXECUTOR,
+    OPENAI_EXECUTOR,
+    PINECONE_EXECUTOR,
+    run_blocking,
+)
+import asyncio
+import os
+import tempfile
+import time
+from functools import partial
+from itertools import islice
+from typing import IO, Iterator
 
 MIN_QUESTION_LENGTH = 5
+# The number of messages a question is usually answered from
+RETRIEVAL_TOP_K = 3
+# The most matches a question is answered from, when many are about as relevant
+RETRIEVAL_MAX_K = 8
+# Lowest BM25 score of a keyword match, weaker ones do not displace vector matches
+KEYWORD_MIN_SCORE = float(os.getenv("KEYWORD_MIN_SCORE", 1.5))
+# Largest history export accepted, in megabytes
+MAX_HISTORY_SIZE_MB = int(os.getenv("MAX_HISTORY_SIZE_MB", 20))
+# Messages of an export embedded and stored at a time
+HISTORY_BATCH_SIZE = 2000
+# Stream answers into a progressively edited message instead of waiting for them
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").lower() == "true"
+# Acknowledge questions right away with a placeholder reply that is edited
+# into the answer, whether the answer is streamed or not
+ANSWER_PLACEHOLDER = os.getenv("ANSWER_PLACEHOLDER", "true").lower() == "true"
+
+# Completions in flight, keyed by chat and normalized question
+question_flight: SingleFlight[tuple[int, str], str | None] = SingleFlight()
+
+# Relevance threshold of every chat
+score_thresholds = ScoreThresholds(load=get_score_threshold)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -137,22 +196,45 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     else:
         # TODO: Logic to handle different types of messages
         message: SerializedMessage | None = SerializedMessage(msg) if msg else None
-        store_message = message and store_message_to_db(chat_id, message)
-        store_message_success = store_message == AddMessageResult.SUCCESS
-        if not store_message_success:
+        store_message = (
+            await run_blocking(MONGO_EXECUTOR, store_message_to_db, chat_id, message)
+            if message
+            else None
+        )
+        if store_message in (AddMessageResult.SUCCESS, AddMessageResult.UPDATED):
+            # new or edited messages may change the answers to cached questions
+            answer_cache.invalidate(chat_id)
+            await run_blocking(
+                INDEX_EXECUTOR, keyword_index.add, chat_id, msg.message_id, msg.text
+            )
+            if msg.reply_to_message:
+                await run_blocking(
+                    INDEX_EXECUTOR,
+                    reply_graph.add,
+                    chat_id,
+                    msg.message_id,
+                    msg.reply_to_message.message_id,
+                )
+        # edited messages are embedded again, overwriting their vector
+        if store_message not in (AddMessageResult.SUCCESS, AddMessageResult.UPDATED):
             return
         if not chat_id:
             return
-        embedding_ = embed([msg.text])
-        embedding: list[float] = embedding_[0]
-        upload_vectors(
+        # messages from all chats share one embeddings request
+        embedding = await embedding_coalescer.embed(msg.text)
+        await run_blocking(
+            PINECONE_EXECUTOR,
+            upload_vectors,
             [
-                {
-                    "id": f"{chat_id}:{msg.message_id}",
-                    "values": embedding,
-                    "metadata": {"chat_id": chat_id},
-                }
-            ]
+                message_embedding(
+                    chat_id,
+                    msg.message_id,
+                    embedding,
+                    msg.text,
+                    msg.date,
+                    (msg.reply_to_message.message_id if msg.reply_to_message else None),
+                )
+            ],
         )
 
 
@@ -166,25 +248,250 @@ async def respond_to_question(
     question: str
         The question to respond to.
     """
-    embedding_ = embed([question])
+    # every stage has its own budget, within the overall budget of the question
+    deadline = Deadline()
+    # the "one moment" placeholder is sent while the question is embedded
+    reply = Reply(context.bot, chat_id, message_id, placeholder=ANSWER_PLACEHOLDER)
+    started = time.perf_counter()
+    try:
+        await _respond_to_question(question, chat_id, context, deadline, reply)
+    except TimeoutError as e:
+        logger.warning(f"Question in chat {chat_id} timed out in stage {e.stage}")
+        await reply.send(bot_messages["question_timeout"])
+    except Exception:
+        # the placeholder is not left saying the answer is on its way
+        logger.exception(f"Could not answer a question in chat {chat_id}")
+        await reply.send(bot_messages["question_failed"])
+    finally:
+        metrics.observe("questions.total", time.perf_counter() - started)
+
+
+async def _respond_to_question(
+    question: str,
+    chat_id: int,
+    context: ContextTypes.DEFAULT_TYPE,
+    deadline: Deadline,
+    reply: Reply,
+) -> None:
+    async with deadline.stage("embed") as client_timeout:
+        embedding_ = await embed_cached(
+            [question], partial(embed, request_timeout=client_timeout)
+        )
     embedding: list[float] = embedding_[0]
 
-    top_3 = query(chat_id, embedding, top_k=3)["matches"]
+    cached_answer = answer_cache.get(chat_id, embedding)
+    if cached_answer is not None:
+        await reply.send(cached_answer)
+        return
 
-    msg_ids = [msg["id"] for msg in top_3]
-    msg_ids = [m_id.split(":")[1] for m_id in msg_ids]
+    # members asking the same question at the same time share one answer
+    resp, shared = await question_flight.do(
+        (chat_id, _normalize_question(question)),
+        lambda: _answer_question(question, embedding, chat_id, deadline, reply),
+    )
+    if shared and resp:
+        await reply.send(resp)
 
-    messages = get_multiple_messages_by_id(chat_id, msg_ids)
-    message_texts: list[str] = filter(
-        lambda t: isinstance(t, str), [msg["text"] for msg in messages]
-    )  # type: ignore
-    message_texts = list(message_texts)
 
-    resp = ask(question, message_texts, print_message=True)
-    if resp:
-        await context.bot.send_message(
-            chat_id=chat_id, text=resp, reply_to_message_id=message_id
+def _normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+async def _answer_question(
+    question: str,
+    embedding: list[float],
+    chat_id: int,
+    deadline: Deadline,
+    reply: Reply,
+) -> str | None:
+    """
+    Retrieves the messages relevant to a question, asks GPT and sends the
+    answer as the reply.
+    """
+    async with deadline.stage("retrieval") as client_timeout:
+        retrieved = await _retrieve_messages(
+            question, embedding, chat_id, client_timeout, deadline
+        )
+    if retrieved is None:
+        # nothing in the chat is about the question, GPT would only say so
+        metrics.increment("completions.avoided")
+        await reply.send(bot_messages["no_relevant_messages"])
+        return bot_messages["no_relevant_messages"]
+    message_texts, tokens = retrieved
+
+    metrics.increment("completions.requested")
+    async with deadline.stage("completion") as client_timeout:
+        if STREAM_ANSWERS:
+            resp: str | None = await reply.stream(
+                ask_stream(
+                    question,
+                    message_texts,
+                    request_timeout=client_timeout,
+                    tokens=tokens,
+                )
+            )
+        else:
+            resp = await run_blocking(
+                OPENAI_EXECUTOR,
+                ask,
+                question,
+                message_texts,
+                request_timeout=client_timeout,
+                tokens=tokens,
+            )
+            if resp:
+                await reply.send(resp)
+    # only answers are cached, a question no message answered yet may be
+    # answered by the next ones
+    if resp and resp.strip() != NO_ANSWER:
+        answer_cache.put(chat_id, embedding, resp)
+    return resp
+
+
+class _Snippets:
+    """
+    The texts of the messages a question is answered from, by message id.
+    Every batch of texts is tokenized as soon as it arrives, while the
+    rest are still being retrieved.
+    """
+
+    def __init__(self, chat_id: int, deadline: Deadline) -> None:
+        self.chat_id = chat_id
+        self.deadline = deadline
+        self.texts: dict[str, str] = {}
+        self._requested: set[str] = set()
+        self._tokens: list[tuple[list[str], asyncio.Future[list[int]]]] = []
+
+    def add(self, texts: dict[str, str]) -> None:
+        new = {m_id: text for m_id, text in texts.items() if m_id not in self.texts}
+        if not new:
+            return
+        self.texts.update(new)
+        self._requested.update(new)
+        batch = list(new.values())
+        self._tokens.append(
+            (
+                batch,
+                asyncio.ensure_future(
+                    run_blocking(CPU_EXECUTOR, snippet_tokens, batch)
+                ),
+            )
+        )
+
+    async def fetch(self, msg_ids: list[str]) -> None:
+        """Reads the messages not read yet from MongoDB."""
+        missing = [m_id for m_id in msg_ids if m_id not in self._requested]
+        if not missing:
+            return
+        self._requested.update(missing)
+        messages = await run_blocking(
+            MONGO_EXECUTOR,
+            get_multiple_messages_by_id,
+            self.chat_id,
+            missing,
+            timeout=self.deadline.budget("retrieval"),
+        )
+        self.add(
+            {
+                str(msg["id"]): msg["text"]
+                for msg in messages
+                if isinstance(msg["text"], str)
+            }
+        )
+
+    async def collect(self, msg_ids: list[str]) -> tuple[list[str], list[int]]:
+        """Returns the texts of the given messages and their token counts."""
+        counts: dict[str, int] = {}
+        for batch, tokens in self._tokens:
+            counts.update(zip(batch, await tokens))
+        texts = [self.texts[m_id] for m_id in msg_ids if m_id in self.texts]
+        return texts, [counts[text] for text in texts]
+
+
+async def _retrieve_messages(
+    question: str,
+    embedding: list[float],
+    chat_id: int,
+    client_timeout: float,
+    deadline: Deadline,
+) -> tuple[list[str], list[int]] | None:
+    """
+    Returns the texts of the messages a question is answered from and their
+    token counts, or None if neither the vector nor the keyword matches hold
+    anything relevant enough to answer from.
+    """
+    snippets = _Snippets(chat_id, deadline)
+    # keyword matches and their threads don't depend on the vector query, so
+    # they are looked up and read while it runs
+    query_results, threshold, keyword_ids = await asyncio.gather(
+        run_blocking(
+            PINECONE_EXECUTOR,
+            query,
+            chat_id,
+            embedding,
+            top_k=RETRIEVAL_MAX_K,
+            request_timeout=client_timeout,
+            include_metadata=METADATA_TEXT,
+        ),
+        run_blocking(MONGO_EXECUTOR, score_thresholds.get, chat_id),
+        _keyword_matches(question, chat_id, snippets),
+    )
+    matches = select_matches(
+        query_results["matches"], threshold, RETRIEVAL_TOP_K, RETRIEVAL_MAX_K
+    )
+    # the score threshold only gates the vector matches, keyword matches
+    # have a floor of their own
+    if not matches and not keyword_ids:
+        return None
+    dense_ids = [match["id"].split(":")[1] for match in matches]
+    # matches stored with their text need no trip to MongoDB
+    snippets.add(
+        {
+            m_id: match["metadata"]["text"]
+            for m_id, match in zip(dense_ids, matches)
+            if "text" in match.get("metadata", {})
+        }
+    )
+    # keyword matches take the place of the weakest vector matches, or join
+    # them when few vector matches are left, as when one dominates the others
+    limit = max(len(dense_ids), RETRIEVAL_TOP_K)
+    msg_ids = reciprocal_rank_fusion([dense_ids, keyword_ids])[:limit]
+    # the messages the hits reply to and the replies they got are fetched
+    # along with them, after them so they only fill the remaining budget
+    thread_ids = await run_blocking(
+        INDEX_EXECUTOR, reply_graph.context, chat_id, [int(m_id) for m_id in msg_ids]
+    )
+    msg_ids += [str(m_id) for m_id in thread_ids]
+    await snippets.fetch(msg_ids)
+    return await snippets.collect(msg_ids)
+
+
+async def _keyword_matches(
+    question: str, chat_id: int, snippets: _Snippets
+) -> list[str]:
+    """
+    Returns the ids of the messages matching the question by keyword, like
+    course codes or room numbers, and reads them and their threads.
+    """
+    keyword_ids = [
+        str(m_id)
+        for m_id in await run_blocking(
+            INDEX_EXECUTOR,
+            keyword_index.search,
+            chat_id,
+            question,
+            RETRIEVAL_TOP_K,
+            KEYWORD_MIN_SCORE,
         )
+    ]
+    keyword_threads = await run_blocking(
+        INDEX_EXECUTOR,
+        reply_graph.context,
+        chat_id,
+        [int(m_id) for m_id in keyword_ids],
+    )
+    await snippets.fetch(keyword_ids + [str(m_id) for m_id in keyword_threads])
+    return keyword_ids
 
 
 async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -197,82 +504,144 @@ async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = effective_chat and effective_chat.id
     if update.message is None:
         return
-    if update.message.document is None:
+    document = update.message.document
+    if document is None:
         return
     if chat_id:
-        # writing to a custom file
-        f = io.BytesIO()
-        file = await context.bot.get_file(update.message.document)
-        if not file.file_size:
+        # checked before get_file, which fails on files over the Bot API's limit
+        if not document.file_size:
             await context.bot.send_message(
                 chat_id=chat_id,
                 text=bot_messages["history_empty"],
             )
             return
 
-        # check if the file is bigger than 15MB
-        if file.file_size > 1024 * 1024 * 15:
+        if document.file_size > MAX_HISTORY_SIZE_MB * 1024 * 1024:
             await context.bot.send_message(
                 chat_id=chat_id,
-                text=bot_messages["history_too_big"],
+                text=bot_messages["history_too_big"].format(MAX_HISTORY_SIZE_MB),
             )
             return
+        file = await context.bot.get_file(document)
+        # imported in the background, the handler is free for other updates
+        queued = await context.bot.send_message(
+            chat_id=chat_id,
+            text=bot_messages["history_import_queued"],
+        )
+        import_queue.submit(
+            chat_id,
+            partial(_import_history, file),
+            partial(_report_import, context.bot, queued.message_id),
+        )
+
+
+async def _import_history(file: File, job: ImportJob) -> None:
+    """
+    Stores, embeds and indexes the messages of an export, a batch at a time,
+    updating the job as it goes.
+    """
+    job.status = "downloading"
+    # spooled to disk and parsed a message at a time, so memory does not
+    # grow with the size of the export
+    with tempfile.TemporaryFile() as f:
         await file.download_to_memory(f)
         f.seek(0)  # start of the file
-        try:
-            group_chat = json.load(f)
-        except json.JSONDecodeError:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=bot_messages["history_invalid"],
-            )
-            return
-
-        try:
-            group_chat_id: int = group_chat["id"]
-            group_chat_type: str = group_chat["type"]
-            group_chat_name: str = group_chat["name"]
-            messages = group_chat["messages"]
-        except KeyError:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=bot_messages["history_invalid"],
+        messages = read_export(f)
+        while True:
+            job.status = "parsing"
+            batch = await run_blocking(
+                IMPORT_EXECUTOR, _next_messages, messages, HISTORY_BATCH_SIZE
             )
-            return
-        serial_messages: list[SerializedMessage] = []
-
-        for msg in messages:
-            try:
-                serial_messages.append(
-                    SerializedMessage.from_exported_json(
-                        msg, group_chat_id, group_chat_type, group_chat_name
-                    )
+            if not batch:
+                break
+            job.parsed += len(batch)
+            chat_id: int = batch[0].chat_id  # type: ignore
+            job.chat_title = job.chat_title or batch[0].chat_title
+            # messages an earlier import of the export already did are skipped
+            missing = set(
+                await run_blocking(
+                    INDEX_EXECUTOR,
+                    import_ledger.missing,
+                    chat_id,
+                    [message.id for message in batch],
                 )
-            except NoFromUserError:
-                pass
-        serial_messages = list(
-            filter(lambda msg: msg.text not in [None, ""], serial_messages)
+            )
+            job.skipped += len(batch) - len(missing)
+            batch = [message for message in batch if message.id in missing]
+            if not batch:
+                continue
+            await _import_messages(chat_id, batch, job)
+            # the checkpoint, only once every step of the batch is done
+            await run_blocking(
+                INDEX_EXECUTOR,
+                import_ledger.record,
+                chat_id,
+                [message.id for message in batch],
+            )
+            answer_cache.invalidate(chat_id)
+
+
+async def _report_import(bot: Bot, message_id: int, job: ImportJob) -> None:
+    if job.status == "done":
+        text = bot_messages["history_upload_success"].format(
+            job.chat_title or "the group"
         )
-        message_batches_from_embedding = split_into_batches(serial_messages, 2000)
-        texts: list[str] = [message.text for message in serial_messages]  # type: ignore
-        batch_index = 0
-        for embedding_batch in batch_embed_messages(texts):
-            embedding_data: list[PCEmbeddingData] = [
-                {
-                    "id": f"{group_chat_id}:{message.id}",
-                    "values": embedding,
-                    "metadata": {"chat_id": group_chat_id},
-                }
-                for message, embedding in zip(
-                    message_batches_from_embedding[batch_index], embedding_batch
-                )
-            ]
-            batch_upload_vectors(embedding_data)
-            batch_index += 1
-        store_multiple_messages_to_db(group_chat_id, serial_messages)
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=bot_messages["history_upload_success"].format(
-                serial_messages[0].chat_title or "the group"
-            ),
+    elif job.status == "failed":
+        invalid = isinstance(job.error, InvalidExportError)
+        text = bot_messages["history_invalid" if invalid else "history_import_failed"]
+    elif job.status == "queued":
+        text = bot_messages["history_import_waiting"].format(job.id, job.ahead)
+    else:
+        text = bot_messages["history_import_progress"].format(
+            job.id, job.status, job.parsed, job.skipped, job.embedded, job.uploaded
+        )
+    await edit_message(bot, job.chat_id, message_id, text)
+
+
+def _next_messages(
+    messages: Iterator[SerializedMessage], count: int
+) -> list[SerializedMessage]:
+    return list(islice(messages, count))
+
+
+async def _import_messages(
+    chat_id: int, messages: list[SerializedMessage], job: ImportJob
+) -> None:
+    job.status = "embedding"
+    texts: list[str] = [message.text for message in messages]  # type: ignore
+    # many requests run at once, within the rate limits, and finish in any order
+    embeddings: list[list[float]] = [[] for _ in texts]
+    async for i, embedding in embedding_engine.embed(texts):
+        embeddings[i] = embedding
+        job.embedded += 1
+    job.status = "uploading"
+    embedding_data: list[PCEmbeddingData] = [
+        message_embedding(
+            chat_id,
+            message.id,
+            embedding,
+            message.text,
+            message.date,
+            message.reply_to_message,
         )
+        for message, embedding in zip(messages, embeddings)
+    ]
+    await run_blocking(PINECONE_EXECUTOR, batch_upload_vectors, embedding_data)
+    stored = await run_blocking(
+        MONGO_EXECUTOR, store_multiple_messages_to_db, chat_id, messages
+    )
+    if stored != AddMessageResult.SUCCESS:
+        raise RuntimeError(f"Could not store the messages of chat {chat_id}")
+    await run_blocking(
+        INDEX_EXECUTOR,
+        keyword_index.add_many,
+        chat_id,
+        [(message.id, message.text or "") for message in messages],
+    )
+    await run_blocking(
+        INDEX_EXECUTOR,
+        reply_graph.add_many,
+        chat_id,
+        [(message.id, message.reply_to_message) for message in messages],
+    )
+    job.uploaded += len(messages)
@@ -1,7 +1,14 @@
 import unittest
-from unittest.mock import AsyncMock, patch
+from typing import AsyncIterator
+from unittest.mock import AsyncMock, MagicMock, patch
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from bot.messages import messages
-from bot.helpers import find_bot_command, send_help_response
+from bot.helpers import (
+    Reply,
+    find_bot_command,
+    send_help_response,
+    send_streamed_answer,
+)
 
 
 class TestBotFunctions(unittest.IsolatedAsyncioTestCase):
@@ -39,3 +46,128 @@ class TestBotFunctions(unittest.IsolatedAsyncioTestCase):
         send_message_mock.assert_awaited_once_with(
             chat_id=chat_id, text=expected_message
         )
+
+
+class TestSendStreamedAnswer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.bot = AsyncMock()
+        self.bot.send_message.return_value = MagicMock(message_id=42)
+        self.now = 0.0
+
+    def clock(self) -> float:
+        return self.now
+
+    async def chunks(self, pieces: list[str]) -> AsyncIterator[str]:
+        for piece in pieces:
+            yield piece
+            self.now += 0.4
+
+    async def test_placeholder_is_sent_first(self) -> None:
+        await send_streamed_answer(
+            self.bot, 1, 2, self.chunks(["Hi"]), clock=self.clock
+        )
+        self.bot.send_message.assert_awaited_once_with(
+            chat_id=1,
+            text=messages["respond_to_question"].format(""),
+            reply_to_message_id=2,
+        )
+
+    async def test_edits_are_throttled(self) -> None:
+        answer = await send_streamed_answer(
+            self.bot,
+            1,
+            2,
+            self.chunks(["a", "b", "c", "d", "e"]),
+            edit_interval=1.0,
+            clock=self.clock,
+        )
+
+        self.assertEqual(answer, "abcde")
+        texts = [call.kwargs["text"] for call in self.bot.edit_message_text.mock_calls]
+        # the first piece right away, then once per second, then the final answer
+        self.assertEqual(
+            texts,
+            [
+                messages["respond_to_question"].format("a"),
+                messages["respond_to_question"].format("abcd"),
+                "abcde",
+            ],
+        )
+
+    async def test_empty_answer(self) -> None:
+        answer = await send_streamed_answer(self.bot, 1, 2, self.chunks([]))
+        self.assertEqual(answer, "I could not find an answer.")
+
+    async def test_failed_edits_do_not_abort_the_answer(self) -> None:
+        self.bot.edit_message_text.side_effect = [TelegramError("flood"), None]
+        answer = await send_streamed_answer(
+            self.bot, 1, 2, self.chunks(["Hi"]), clock=self.clock
+        )
+        self.assertEqual(answer, "Hi")
+
+    @patch("bot.helpers.asyncio.sleep")
+    async def test_final_edit_is_retried_after_flood_control(
+        self, mock_sleep: AsyncMock
+    ) -> None:
+        self.bot.edit_message_text.side_effect = [None, RetryAfter(3), None]
+        await send_streamed_answer(
+            self.bot, 1, 2, self.chunks(["Hi"]), clock=self.clock
+        )
+
+        mock_sleep.assert_awaited_once_with(3)
+        self.bot.edit_message_text.assert_awaited_with(
+            text="Hi", chat_id=1, message_id=42
+        )
+        self.bot.send_message.assert_awaited_once()
+
+    async def test_final_edit_falls_back_to_a_new_reply(self) -> None:
+        self.bot.edit_message_text.side_effect = [
+            None,
+            BadRequest("Message to edit not found"),
+        ]
+        await send_streamed_answer(
+            self.bot, 1, 2, self.chunks(["Hi"]), clock=self.clock
+        )
+
+        self.bot.send_message.assert_awaited_with(
+            chat_id=1, text="Hi", reply_to_message_id=2
+        )
+
+    async def test_unchanged_final_edit_is_not_sent_again(self) -> None:
+        self.bot.edit_message_text.side_effect = [
+            None,
+            BadRequest("Message is not modified"),
+        ]
+        await send_streamed_answer(
+            self.bot, 1, 2, self.chunks(["Hi"]), clock=self.clock
+        )
+
+        self.bot.send_message.assert_awaited_once()
+
+
+class TestReply(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.bot = AsyncMock()
+        self.bot.send_message.return_value = MagicMock(message_id=42)
+
+    async def test_placeholder_is_edited_into_the_reply(self) -> None:
+        reply = Reply(self.bot, 1, 2, placeholder=True)
+        await reply.send("Friday.")
+
+        self.bot.send_message.assert_awaited_once_with(
+            chat_id=1,
+            text=messages["respond_to_question"].format(""),
+            reply_to_message_id=2,
+        )
+        self.bot.edit_message_text.assert_awaited_once_with(
+            text="Friday.", chat_id=1, message_id=42
+        )
+
+    async def test_reply_without_placeholder_is_sent(self) -> None:
+        reply = Reply(self.bot, 1, 2, placeholder=False)
+        await reply.send("Friday.")
+
+        self.bot.send_message.assert_awaited_once_with(
+            chat_id=1, text="Friday.", reply_to_message_id=2
+        )
+        self.bot.edit_message_text.assert_not_awaited()
@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+from bot.imports import ImportJob, ImportQueue
+
+
+class TestImportQueue(unittest.IsolatedAsyncioTestCase):
+    async def test_imports_beyond_the_limit_wait(self) -> None:
+        queue = ImportQueue(max_running=1, progress_interval=60)
+        release = asyncio.Event()
+        reports: list[tuple[str, str]] = []
+
+        async def run(job: ImportJob) -> None:
+            job.status = "parsing"
+            await release.wait()
+
+        async def report(job: ImportJob) -> None:
+            reports.append((job.id, job.status))
+
+        first = queue.submit(1, run, report)
+        second = queue.submit(2, run, report)
+        await asyncio.sleep(0.01)
+
+        self.assertEqual((first.status, second.status), ("parsing", "queued"))
+        release.set()
+        await queue.join()
+        self.assertEqual(reports, [(first.id, "done"), (second.id, "done")])
+
+    async def test_progress_is_reported_until_failure(self) -> None:
+        queue = ImportQueue(progress_interval=0.01)
+        reports: list[tuple[str, int]] = []
+
+        async def run(job: ImportJob) -> None:
+            for _ in range(3):
+                job.parsed += 10
+                await asyncio.sleep(0.015)
+            raise ValueError("invalid export")
+
+        async def report(job: ImportJob) -> None:
+            reports.append((job.status, job.parsed))
+
+        job = queue.submit(1, run, report)
+        await queue.join()
+
+        self.assertEqual(job.status, "failed")
+        self.assertIsInstance(job.error, ValueError)
+        self.assertGreaterEqual(len(reports), 3)
+        self.assertEqual(reports[-1], ("failed", 30))
+
+    async def test_finished_jobs_are_dropped_on_the_next_import(self) -> None:
+        queue = ImportQueue(progress_interval=60)
+
+        async def run(job: ImportJob) -> None:
+            pass
+
+        async def report(job: ImportJob) -> None:
+            pass
+
+        first = queue.submit(1, run, report)
+        other_chat = queue.submit(2, run, report)
+        await queue.join()
+        second = queue.submit(1, run, report)
+
+        self.assertEqual(list(queue.jobs.values()), [other_chat, second])
+        self.assertNotIn(first.id, queue.jobs)
+        await queue.join()
+
+    async def test_queued_jobs_report_their_place_and_only_changes(self) -> None:
+        queue = ImportQueue(max_running=1, progress_interval=0.01)
+        release = asyncio.Event()
+        reports: list[tuple[str, str, int]] = []
+
+        async def run(job: ImportJob) -> None:
+            job.status = "parsing"
+            await release.wait()
+
+        async def report(job: ImportJob) -> None:
+            reports.append((job.id, job.status, job.ahead))
+
+        first = queue.submit(1, run, report)
+        second = queue.submit(2, run, report)
+        third = queue.submit(3, run, report)
+        await asyncio.sleep(0.05)
+        release.set()
+        await queue.join()
+
+        self.assertEqual(
+            [r for r in reports if r[0] == first.id],
+            [(first.id, "parsing", 0), (first.id, "done", 0)],
+        )
+        self.assertEqual(
+            [r for r in reports if r[0] == third.id],
+            [(third.id, "queued", 1), (third.id, "done", 1)],
+        )
+        self.assertEqual(reports.count((second.id, "queued", 0)), 1)
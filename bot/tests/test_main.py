@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+from telegram import Update
+from telegram.ext import ContextTypes, ExtBot, TypeHandler
+from bot.main import init, log_metrics
+from utils import metrics
+
+
+class TestInit(unittest.IsolatedAsyncioTestCase):
+    @patch("bot.main.MAX_CONCURRENT_UPDATES", 2)
+    @patch.object(ExtBot, "id", 1)
+    @patch.object(ExtBot, "initialize", AsyncMock())
+    async def test_updates_are_processed_concurrently(self) -> None:
+        app, *_ = init()
+        started: list[int] = []
+        both_started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            started.append(update.update_id)
+            if len(started) == 2:
+                both_started.set()
+            # only returns once the other update is being handled too
+            await release.wait()
+
+        app.add_handler(TypeHandler(Update, handle))
+        async with app:
+            await app.start()
+            await app.update_queue.put(Update(update_id=1))
+            await app.update_queue.put(Update(update_id=2))
+            try:
+                await asyncio.wait_for(both_started.wait(), timeout=2)
+            finally:
+                release.set()
+                await app.stop()
+
+        self.assertEqual(sorted(started), [1, 2])
+        self.assertEqual(app.concurrent_updates, 2)
+
+
+class TestLogMetrics(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        metrics.reset()
+
+    def tearDown(self) -> None:
+        metrics.reset()
+
+    async def test_snapshot_is_logged_periodically(self) -> None:
+        metrics.increment("timeouts.completion")
+        metrics.observe("stages.embed", 0.5)
+        with self.assertLogs("bot", level="INFO") as logs:
+            task = asyncio.create_task(log_metrics(0.01))
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        self.assertGreaterEqual(len(logs.output), 2)
+        self.assertIn(
+            "Metrics: stages.embed.p50=0.5 stages.embed.p95=0.5 timeouts.completion=1",
+            logs.output[0],
+        )
@@ -1,11 +1,38 @@
+import asyncio
 import json
+from collections import defaultdict
+from functools import partial
+import threading
 import unittest
 from unittest.mock import AsyncMock, MagicMock, patch
 from telegram import Update, Message, Chat, Document, User
 from datetime import datetime
-from bot.responses import start, help, history, handle_message
+from ai.answer_cache import AnswerCache
+from ai.constants import NO_ANSWER
+from ai.embedding_engine import EmbeddingEngine
+from openai.error import InvalidRequestError
+from ai.relevance import ScoreThresholds
+from bot.imports import ImportQueue
+from db.db_types import AddMessageResult
+from db.import_ledger import ImportLedger
+from bot.messages import messages as bot_messages
+from db.keyword_index import KeywordIndex
+from db.reply_graph import ReplyGraph
+from bot.responses import start, help, history, handle_message, respond_to_question
+from utils import metrics
+from utils.timeout import Deadline
 from datetime import datetime
-from typing import Optional, Any
+from typing import AsyncIterator, Optional, Any
+
+
+def patch_responses(
+    test: unittest.TestCase, name: str, *args: Any, **kwargs: Any
+) -> Any:
+    """Patches an attribute of bot.responses until the end of the test."""
+    patcher = patch("bot.responses." + name, *args, **kwargs)
+    mock = patcher.start()
+    test.addCleanup(patcher.stop)
+    return mock
 
 
 class TestResponses(unittest.IsolatedAsyncioTestCase):
@@ -143,6 +170,33 @@ class TestResponses(unittest.IsolatedAsyncioTestCase):
             "Incorrect chat title",
         )
 
+    @patch("bot.responses.upload_vectors")
+    @patch("bot.responses.embedding_coalescer")
+    @patch("bot.responses.store_message_to_db", return_value=AddMessageResult.UPDATED)
+    async def test_edited_message_vector_is_uploaded_again(
+        self,
+        mock_store_message_to_db: MagicMock,
+        mock_coalescer: MagicMock,
+        mock_upload_vectors: MagicMock,
+    ) -> None:
+        mock_coalescer.embed = AsyncMock(return_value=[0.5])
+        edited_message = Message(
+            message_id=1,
+            date=datetime.now(),
+            chat=Chat(id=12345, type="group", title="Test Chat"),
+            text="Edited Test",
+            from_user=User(id=123, first_name="TestUser", is_bot=False),
+        )
+
+        await handle_message(
+            Update(update_id=1, edited_message=edited_message), self.context
+        )
+
+        mock_coalescer.embed.assert_awaited_once_with("Edited Test")
+        (vectors,), _ = mock_upload_vectors.call_args
+        self.assertEqual(vectors[0]["id"], "12345:1")
+        self.assertEqual(vectors[0]["values"], [0.5])
+
 
 class TestHistory(unittest.IsolatedAsyncioTestCase):
     def setUp(self) -> None:
@@ -189,7 +243,12 @@ class TestHistory(unittest.IsolatedAsyncioTestCase):
             ),
         )
         self.context: AsyncMock = AsyncMock()
-        self.context.bot.send_message = AsyncMock()
+        self.context.bot.send_message = AsyncMock(return_value=MagicMock(message_id=99))
+        self.context.bot.edit_message_text = AsyncMock()
+        self.queue = ImportQueue()
+        self.ledger = ImportLedger()
+        patch_responses(self, "import_queue", self.queue)
+        patch_responses(self, "import_ledger", self.ledger)
         return_file = MagicMock()
         return_file.file_id = "1"
         return_file.file_unique_id = "1"
@@ -205,29 +264,176 @@ class TestHistory(unittest.IsolatedAsyncioTestCase):
             "history_empty": "History is empty.",
             "history_too_big": "History is too big.",
             "history_invalid": "History is invalid.",
+            "history_import_queued": "History queued.",
             "history_upload_success": "History uploaded successfully.",
         },
     )
-    @patch("bot.responses.batch_embed_messages")
-    @patch("bot.responses.store_multiple_messages_to_db")
+    @patch(
+        "bot.responses.store_multiple_messages_to_db",
+        return_value=AddMessageResult.SUCCESS,
+    )
     @patch("bot.responses.batch_upload_vectors")
     async def test_history(
         self,
         mock_batch_upload_vectors: MagicMock,
         mock_store_multiple_messages_to_db: MagicMock,
-        mock_batch_embed_messages: MagicMock,
     ) -> None:
-        mock_batch_embed_messages.return_value = [
-            [
-                [0.1, 0.2],
-                [0.2, 0.3],
-            ],
-        ]
+        self.use_engine()
         await history(self.update, self.context)
         self.context.bot.send_message.assert_awaited_once_with(
             chat_id=12345,
-            text="History uploaded successfully.",
+            text="History queued.",
         )
+        await self.queue.join()
+
+        self.context.bot.edit_message_text.assert_awaited_once_with(
+            text="History uploaded successfully.", chat_id=12345, message_id=99
+        )
+        (job,) = self.queue.jobs.values()
+        self.assertEqual(job.status, "done")
+        self.assertEqual((job.parsed, job.embedded, job.uploaded), (2, 2, 2))
+        uploaded = mock_batch_upload_vectors.call_args.args[0]
+        self.assertEqual([v["id"] for v in uploaded], ["12349:1", "12349:2"])
+        self.assertEqual([v["values"] for v in uploaded], [[4.0, 0.0], [6.0, 0.0]])
+        mock_store_multiple_messages_to_db.assert_called_once()
+
+    @patch(
+        "bot.responses.bot_messages",
+        {"history_too_big": "Please upload a file less than {}MB."},
+    )
+    @patch("bot.responses.MAX_HISTORY_SIZE_MB", 1)
+    async def test_history_too_big(self) -> None:
+        assert self.update.message is not None
+        update = Update(
+            update_id=1,
+            message=Message(
+                message_id=1,
+                date=datetime.now(),
+                chat=self.update.message.chat,
+                document=Document(
+                    "1", "1", "history.json", "application/json", 2 * 1024 * 1024
+                ),
+            ),
+        )
+
+        await history(update, self.context)
+
+        self.context.bot.send_message.assert_awaited_once_with(
+            chat_id=12345, text="Please upload a file less than 1MB."
+        )
+        # files over the limit can't be downloaded through the Bot API
+        self.context.bot.get_file.assert_not_awaited()
+
+    @patch(
+        "bot.responses.bot_messages",
+        {"history_invalid": "History is invalid.", "history_import_queued": ""},
+    )
+    async def test_history_invalid(self) -> None:
+        self.context.bot.get_file.return_value.download_to_memory.side_effect = (
+            lambda f: f.write(b'{"name": "TestGroup", "messages": [')
+        )
+
+        await history(self.update, self.context)
+        await self.queue.join()
+
+        self.context.bot.edit_message_text.assert_awaited_once_with(
+            text="History is invalid.", chat_id=12345, message_id=99
+        )
+
+    @patch(
+        "bot.responses.bot_messages",
+        {
+            "history_invalid": "History is invalid.",
+            "history_import_failed": "Import failed.",
+            "history_import_queued": "",
+        },
+    )
+    @patch("bot.responses.batch_upload_vectors", side_effect=ValueError("Pinecone"))
+    async def test_failed_import_of_a_valid_export(
+        self, mock_batch_upload_vectors: MagicMock
+    ) -> None:
+        self.use_engine()
+
+        with self.assertLogs("bot", level="ERROR"):
+            await history(self.update, self.context)
+            await self.queue.join()
+
+        self.context.bot.edit_message_text.assert_awaited_once_with(
+            text="Import failed.", chat_id=12345, message_id=99
+        )
+
+    def use_engine(self, failing: set[str] | None = None) -> list[list[str]]:
+        """Embeds with a fake engine, whose requests fail for failing texts."""
+        requests: list[list[str]] = []
+
+        async def request(texts: list[str]) -> list[list[float]]:
+            requests.append(texts)
+            if failing and failing.intersection(texts):
+                raise InvalidRequestError("invalid", None)  # type: ignore
+            return [[float(len(text)), 0.0] for text in texts]
+
+        engine = EmbeddingEngine(
+            request_size=1,
+            cache=None,
+            request=request,
+            chunk=lambda texts: [[(text, len(text))] for text in texts],
+        )
+        patch_responses(self, "embedding_engine", engine)
+        return requests
+
+    @patch("bot.responses.bot_messages", defaultdict(str))
+    @patch(
+        "bot.responses.store_multiple_messages_to_db",
+        return_value=AddMessageResult.SUCCESS,
+    )
+    @patch("bot.responses.batch_upload_vectors")
+    async def test_imported_messages_are_skipped(
+        self,
+        mock_batch_upload_vectors: MagicMock,
+        mock_store_multiple_messages_to_db: MagicMock,
+    ) -> None:
+        requests = self.use_engine()
+        self.ledger.record(12349, [1])
+
+        await history(self.update, self.context)
+        await self.queue.join()
+        (first,) = self.queue.jobs.values()
+        await history(self.update, self.context)
+        await self.queue.join()
+
+        (second,) = self.queue.jobs.values()
+        self.assertEqual((first.parsed, first.skipped, first.uploaded), (2, 1, 1))
+        self.assertEqual((second.parsed, second.skipped, second.uploaded), (2, 2, 0))
+        self.assertEqual(requests, [["Test 2"]])
+        mock_batch_upload_vectors.assert_called_once()
+
+    @patch("bot.responses.bot_messages", defaultdict(str))
+    @patch("bot.responses.HISTORY_BATCH_SIZE", 1)
+    @patch(
+        "bot.responses.store_multiple_messages_to_db",
+        return_value=AddMessageResult.SUCCESS,
+    )
+    @patch("bot.responses.batch_upload_vectors")
+    async def test_failed_import_resumes_after_its_last_batch(
+        self,
+        mock_batch_upload_vectors: MagicMock,
+        mock_store_multiple_messages_to_db: MagicMock,
+    ) -> None:
+        failing = {"Test 2"}
+        requests = self.use_engine(failing)
+
+        await history(self.update, self.context)
+        await self.queue.join()
+        (first,) = self.queue.jobs.values()
+        failing.clear()
+        await history(self.update, self.context)
+        await self.queue.join()
+
+        (second,) = self.queue.jobs.values()
+        self.assertEqual((first.status, first.uploaded), ("failed", 1))
+        self.assertEqual((second.status, second.skipped), ("done", 1))
+        self.assertEqual(requests, [["Test"], ["Test 2"], ["Test 2"]])
+        self.assertEqual(self.ledger.missing(12349, [1, 2]), [])
 
 
 class TestHandleMessage(unittest.IsolatedAsyncioTestCase):
@@ -338,3 +544,360 @@ class TestHandleMessage(unittest.IsolatedAsyncioTestCase):
         )
         await handle_message(update, self.context)
         self.context.bot.send_message.assert_not_called()
+
+
+class QuestionTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    Answers questions from a chat whose only match is "deadline is Friday",
+    with the embeddings, Pinecone, MongoDB and GPT mocked.
+    """
+
+    def setUp(self) -> None:
+        self.context = MagicMock()
+        self.context.bot.send_message = AsyncMock(return_value=MagicMock(message_id=99))
+        self.context.bot.edit_message_text = AsyncMock()
+        self.mock_ask = patch_responses(self, "ask", return_value="Friday")
+        self.mock_embed = patch_responses(self, "embed", return_value=[[1.0, 0.0]])
+        self.mock_query = patch_responses(
+            self, "query", return_value={"matches": [{"id": "12345:1", "score": 0.9}]}
+        )
+        self.mock_get_messages = patch_responses(
+            self,
+            "get_multiple_messages_by_id",
+            return_value=[{"id": 1, "text": "deadline is Friday"}],
+        )
+        patch_responses(self, "answer_cache", AnswerCache())
+        patch_responses(self, "score_thresholds", ScoreThresholds())
+        # tokenizing needs tiktoken's encodings, which are downloaded on first use
+        patch_responses(self, "snippet_tokens", lambda texts: [1] * len(texts))
+        metrics.reset()
+
+
+@patch("bot.responses.ANSWER_PLACEHOLDER", False)
+@patch("bot.responses.STREAM_ANSWERS", False)
+class TestRespondToQuestion(QuestionTestCase):
+    async def test_concurrent_questions_do_not_block_each_other(self) -> None:
+        # every completion waits until all four are in flight at once
+        all_asked = threading.Barrier(4, timeout=2)
+
+        def ask(*args: Any, **kwargs: Any) -> str:
+            all_asked.wait()
+            return "answer"
+
+        self.mock_ask.side_effect = ask
+
+        await asyncio.gather(
+            *(
+                respond_to_question("question " + str(i), 12345, i, self.context)
+                for i in range(4)
+            )
+        )
+
+        self.assertFalse(all_asked.broken)
+        self.assertEqual(self.context.bot.send_message.await_count, 4)
+
+    @patch("bot.responses.answer_cache", AnswerCache(threshold=0.9))
+    async def test_similar_question_is_answered_from_cache(self) -> None:
+        self.mock_embed.side_effect = [[[1.0, 0.0]], [[0.99, 0.05]]]
+
+        await respond_to_question("when is the deadline?", 12345, 1, self.context)
+        await respond_to_question("when's the deadline", 12345, 2, self.context)
+
+        self.mock_ask.assert_called_once()
+        self.mock_query.assert_called_once()
+        self.context.bot.send_message.assert_awaited_with(
+            chat_id=12345, text="Friday", reply_to_message_id=2
+        )
+
+    async def test_no_answer_is_not_cached(self) -> None:
+        self.mock_ask.return_value = NO_ANSWER
+
+        await respond_to_question("when is the deadline?", 12345, 1, self.context)
+        await respond_to_question("when is the deadline?", 12345, 2, self.context)
+
+        self.assertEqual(self.mock_ask.call_count, 2)
+
+    async def test_identical_concurrent_questions_share_one_completion(self) -> None:
+        asked = threading.Event()
+        release = threading.Event()
+
+        def ask(*args: Any, **kwargs: Any) -> str:
+            asked.set()
+            release.wait(timeout=2)
+            return "Friday"
+
+        async def ask_again() -> None:
+            # the other questions are asked while the first one is answered
+            await asyncio.get_running_loop().run_in_executor(None, asked.wait, 2)
+            await asyncio.gather(
+                respond_to_question("when is the  deadline", 12345, 2, self.context),
+                respond_to_question("When is the deadline?", 12345, 3, self.context),
+            )
+            release.set()
+
+        self.mock_ask.side_effect = ask
+
+        await asyncio.gather(
+            respond_to_question("When is the deadline?", 12345, 1, self.context),
+            ask_again(),
+        )
+
+        self.mock_ask.assert_called_once()
+        replied_to = sorted(
+            call.kwargs["reply_to_message_id"]
+            for call in self.context.bot.send_message.await_args_list
+        )
+        self.assertEqual(replied_to, [1, 2, 3])
+
+    @patch(
+        "bot.responses.Deadline",
+        partial(Deadline, budgets={"embed": 1, "retrieval": 1, "completion": 0.1}),
+    )
+    async def test_slow_completion_times_out_with_a_reply(self) -> None:
+        release = threading.Event()
+
+        def ask(*args: Any, **kwargs: Any) -> str:
+            release.wait(timeout=2)
+            return "too late"
+
+        self.mock_ask.side_effect = ask
+
+        try:
+            await respond_to_question("When is the deadline?", 12345, 1, self.context)
+        finally:
+            release.set()
+
+        self.context.bot.send_message.assert_awaited_once_with(
+            chat_id=12345,
+            text=bot_messages["question_timeout"],
+            reply_to_message_id=1,
+        )
+        self.assertEqual(metrics.counters["timeouts.completion"], 1)
+        self.assertLessEqual(self.mock_ask.call_args.kwargs["request_timeout"], 1)
+
+    async def test_failed_question_replies_with_an_error(self) -> None:
+        self.mock_query.side_effect = RuntimeError("Pinecone is down")
+
+        with self.assertLogs("bot", level="ERROR"):
+            await respond_to_question("essay deadline", 12345, 10, self.context)
+
+        self.context.bot.send_message.assert_awaited_once_with(
+            chat_id=12345,
+            text=bot_messages["question_failed"],
+            reply_to_message_id=10,
+        )
+
+    def use_keyword_index(self) -> None:
+        """Indexes a chat of course messages, one of which is about CS110."""
+        keyword_index = KeywordIndex()
+        keyword_index.add_many(
+            12345,
+            [(100 + i, "Message {} about the course".format(i)) for i in range(20)],
+        )
+        keyword_index.add(12345, 7, "CS110 is in room B2.14")
+        patch_responses(self, "keyword_index", keyword_index)
+        self.mock_query.return_value = {
+            "matches": [
+                {"id": "12345:1", "score": 0.9},
+                {"id": "12345:2", "score": 0.89},
+                {"id": "12345:3", "score": 0.88},
+            ]
+        }
+        self.mock_get_messages.side_effect = lambda chat_id, ids, **kwargs: [
+            {"id": int(m_id), "text": "message " + m_id} for m_id in ids
+        ]
+
+    async def test_keyword_matches_are_fused_with_vector_matches(self) -> None:
+        self.use_keyword_index()
+
+        await respond_to_question("Where is CS110?", 12345, 1, self.context)
+
+        # the keyword match is read while the vectors are queried
+        fetched = [args[1] for args, _ in self.mock_get_messages.call_args_list]
+        self.assertEqual(fetched, [["7"], ["1", "2"]])
+        (_, message_texts), kwargs = self.mock_ask.call_args
+        self.assertEqual(message_texts, ["message 1", "message 7", "message 2"])
+        self.assertEqual(kwargs["tokens"], [1, 1, 1])
+
+    async def test_weak_keyword_matches_do_not_displace_vector_matches(self) -> None:
+        self.use_keyword_index()
+
+        await respond_to_question("What about the course?", 12345, 1, self.context)
+
+        (_, message_texts), _ = self.mock_ask.call_args
+        self.assertEqual(message_texts, ["message 1", "message 2", "message 3"])
+
+    async def test_keyword_matches_are_answered_from_without_vector_matches(
+        self,
+    ) -> None:
+        self.use_keyword_index()
+        patch_responses(self, "score_thresholds", ScoreThresholds(load=lambda _: 0.95))
+
+        await respond_to_question("Where is CS110?", 12345, 1, self.context)
+
+        (_, message_texts), _ = self.mock_ask.call_args
+        self.assertEqual(message_texts, ["message 7"])
+
+    async def test_keyword_matches_join_a_dominant_vector_match(self) -> None:
+        self.use_keyword_index()
+        self.mock_query.return_value = {
+            "matches": [
+                {"id": "12345:1", "score": 0.9},
+                {"id": "12345:2", "score": 0.6},
+            ]
+        }
+
+        await respond_to_question("Where is CS110?", 12345, 1, self.context)
+
+        (_, message_texts), _ = self.mock_ask.call_args
+        self.assertEqual(message_texts, ["message 1", "message 7"])
+
+    async def test_threads_of_matches_are_fetched_in_one_batch(self) -> None:
+        graph = ReplyGraph()
+        graph.add_many(12345, [(2, 1), (3, 2)])
+        self.mock_query.return_value = {"matches": [{"id": "12345:2", "score": 0.9}]}
+        self.mock_get_messages.return_value = [
+            {"id": 2, "text": "It is due Friday"},
+            {"id": 1, "text": "When is the essay due?"},
+            {"id": 3, "text": "Thanks!"},
+        ]
+
+        with patch("bot.responses.reply_graph", graph):
+            await respond_to_question("essay deadline", 12345, 10, self.context)
+
+        self.mock_get_messages.assert_called_once()
+        (_, msg_ids), _ = self.mock_get_messages.call_args
+        self.assertEqual(msg_ids, ["2", "1", "3"])
+        (_, message_texts), _ = self.mock_ask.call_args
+        self.assertEqual(
+            message_texts, ["It is due Friday", "When is the essay due?", "Thanks!"]
+        )
+
+    async def test_matches_with_text_skip_the_message_fetch(self) -> None:
+        self.mock_query.return_value = {
+            "matches": [
+                {"id": "12345:1", "score": 0.9, "metadata": {"text": "Due Friday"}},
+                {"id": "12345:2", "score": 0.89, "metadata": {"text": "At noon"}},
+            ]
+        }
+
+        await respond_to_question("essay deadline", 12345, 10, self.context)
+
+        self.assertTrue(self.mock_query.call_args.kwargs["include_metadata"])
+        self.mock_get_messages.assert_not_called()
+        (_, message_texts), _ = self.mock_ask.call_args
+        self.assertEqual(message_texts, ["Due Friday", "At noon"])
+
+    async def test_matches_without_text_are_fetched(self) -> None:
+        self.mock_query.return_value = {
+            "matches": [
+                {"id": "12345:1", "score": 0.9, "metadata": {"text": "Due Friday"}},
+                {"id": "12345:2", "score": 0.89, "metadata": {"chat_id": 12345}},
+            ]
+        }
+        self.mock_get_messages.return_value = [{"id": 2, "text": "At noon"}]
+
+        await respond_to_question("essay deadline", 12345, 10, self.context)
+
+        (_, msg_ids), _ = self.mock_get_messages.call_args
+        self.assertEqual(msg_ids, ["2"])
+        (_, message_texts), _ = self.mock_ask.call_args
+        self.assertEqual(message_texts, ["Due Friday", "At noon"])
+
+    @patch("bot.responses.score_thresholds", ScoreThresholds(load=lambda _: 0.95))
+    async def test_question_without_relevant_matches_skips_the_completion(
+        self,
+    ) -> None:
+        await respond_to_question("essay deadline", 12345, 10, self.context)
+
+        self.mock_ask.assert_not_called()
+        self.mock_get_messages.assert_not_called()
+        self.context.bot.send_message.assert_awaited_once_with(
+            chat_id=12345,
+            text=bot_messages["no_relevant_messages"],
+            reply_to_message_id=10,
+        )
+        self.assertEqual(metrics.counters["completions.avoided"], 1)
+        self.assertEqual(metrics.counters["completions.requested"], 0)
+
+    async def test_more_matches_are_used_when_they_are_equally_relevant(self) -> None:
+        self.mock_query.return_value = {
+            "matches": [
+                {
+                    "id": "12345:" + str(i),
+                    "score": 0.9 - i / 1000,
+                    "metadata": {"text": "x"},
+                }
+                for i in range(1, 9)
+            ]
+        }
+
+        await respond_to_question("essay deadline", 12345, 10, self.context)
+
+        self.assertEqual(self.mock_query.call_args.kwargs["top_k"], 8)
+        (_, message_texts), _ = self.mock_ask.call_args
+        self.assertEqual(len(message_texts), 8)
+
+
+@patch("bot.responses.STREAM_ANSWERS", False)
+class TestAnswerPlaceholder(QuestionTestCase):
+    async def test_placeholder_is_edited_into_the_answer(self) -> None:
+        await respond_to_question("When is the deadline?", 12345, 1, self.context)
+
+        self.context.bot.send_message.assert_awaited_once_with(
+            chat_id=12345,
+            text=bot_messages["respond_to_question"].format(""),
+            reply_to_message_id=1,
+        )
+        self.context.bot.edit_message_text.assert_awaited_once_with(
+            text="Friday", chat_id=12345, message_id=99
+        )
+
+
+@patch("bot.responses.STREAM_ANSWERS", True)
+class TestStreamedAnswer(QuestionTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.mock_ask_stream = patch_responses(self, "ask_stream")
+
+    async def test_answer_is_streamed_into_placeholder(self) -> None:
+        async def chunks() -> AsyncIterator[str]:
+            for chunk in ["The deadline ", "is Friday."]:
+                yield chunk
+
+        self.mock_ask_stream.return_value = chunks()
+
+        await respond_to_question("when is the deadline?", 12345, 1, self.context)
+
+        self.context.bot.send_message.assert_awaited_once()
+        self.context.bot.edit_message_text.assert_awaited_with(
+            text="The deadline is Friday.", chat_id=12345, message_id=99
+        )
+
+    async def test_placeholder_is_sent_while_the_question_is_embedded(self) -> None:
+        async def chunks() -> AsyncIterator[str]:
+            yield "Friday."
+
+        placeholder_sent = threading.Event()
+
+        def embed(texts: list[str], **kwargs: Any) -> list[list[float]]:
+            # only returns once the placeholder went out, else times out
+            self.assertTrue(placeholder_sent.wait(timeout=2))
+            return [[1.0, 0.0]]
+
+        async def send_message(**kwargs: Any) -> MagicMock:
+            placeholder_sent.set()
+            return MagicMock(message_id=99)
+
+        self.mock_ask_stream.return_value = chunks()
+        self.mock_embed.side_effect = embed
+        self.context.bot.send_message.side_effect = send_message
+
+        await respond_to_question("when is the deadline?", 12345, 1, self.context)
+
+        self.context.bot.edit_message_text.assert_awaited_with(
+            text="Friday.", chat_id=12345, message_id=99
+        )
+        for name in ("embed", "retrieval", "completion"):
+            self.assertEqual(len(metrics.timings["stages." + name]), 1)
+        self.assertEqual(len(metrics.timings["questions.total"]), 1)
@@ -1,15 +1,55 @@
 from . import db
-from typing import List, Any, Dict
-from pymongo.command_cursor import CommandCursor
+from typing import List, Any, Dict, Sequence
+import pymongo
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+from bot import logger
 from db.db_types import AddMessageResult, SerializedMessage
 from bot.telegram_types import TMessage
 
+# Messages live in their own collection, one document per message,
+# uniquely identified by the chat they belong to and their Telegram id.
+MESSAGES_INDEX = [("chat_id", ASCENDING), ("id", ASCENDING)]
+
+# The message fields a prompt is built from
+PROMPT_FIELDS = ("text", "reply_to_message", "date")
+
+# Group chats whose active_groups document is known to exist
+_known_groups: set[int | None] = set()
+
+
+def ensure_indexes() -> None:
+    """
+    Creates the indexes the message storage relies on. Safe to call repeatedly.
+    """
+    db.messages.create_index(MESSAGES_INDEX, unique=True, name="chat_id_1_id_1")
+
+
+def _ensure_group(chat_id: int | None, group_name: str | None) -> None:
+    """
+    Creates the active_groups document of a group chat if it does not exist yet.
+    Only the first call per chat and process reaches the database.
+    """
+    if chat_id in _known_groups:
+        return
+    db.active_groups.update_one(
+        {"chat_id": chat_id},
+        {"$setOnInsert": {"group_name": group_name, "categories": []}},
+        upsert=True,
+    )
+    _known_groups.add(chat_id)
+
+
+def _message_document(chat_id: int | None, tmessage: TMessage) -> Dict[str, Any]:
+    return {**tmessage, "chat_id": chat_id}
+
 
 def store_message_to_db(
     chat_id: int | None, msg: SerializedMessage
 ) -> AddMessageResult:
     """
-    This function stores or updates a given message in the database.
+    This function stores or updates a given message in the database
+    with a single atomic upsert into the messages collection.
 
     Parameters:
     chat_id: int | None
@@ -17,42 +57,36 @@ def store_message_to_db(
     msg: SerializedMessage
         The message object that is to be stored or updated
     """
-
-    # Check if the group chat exists, else create a collection for it.
-    if not db.active_groups.find_one({"chat_id": chat_id}):
-        db.active_groups.insert_one(
-            {
-                "chat_id": chat_id,
-                "group_name": msg.chat_title,
-                "categories": [],
-            }
+    tmessage = msg.get_as_tmessage()
+
+    # The message as it was before the write tells us whether it is new
+    try:
+        _ensure_group(chat_id, msg.chat_title)
+        previous = db.messages.find_one_and_update(
+            {"chat_id": chat_id, "id": msg.get_id()},
+            {"$set": _message_document(chat_id, tmessage)},
+            projection={"_id": False},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
         )
-
-    # Check if the message already exists
-    existing_message = db.active_groups.find_one(
-        {"chat_id": chat_id, f"messages.{msg.get_id()}": {"$exists": True}}
+    except PyMongoError as e:
+        logger.error(f"Failed to store message {msg.get_id()} of chat {chat_id}: {e}")
+        return AddMessageResult.FAILURE
+
+    if previous is None:
+        return AddMessageResult.SUCCESS
+    if _same_content(previous, tmessage):
+        # nothing was modified by the write
+        return AddMessageResult.FAILURE
+    return AddMessageResult.UPDATED
+
+
+def _same_content(stored: Dict[str, Any], tmessage: TMessage) -> bool:
+    # dates lose their sub-millisecond precision in Mongo, so they are not compared
+    return all(
+        stored.get(key) == value for key, value in tmessage.items() if key != "date"
     )
 
-    # If the message exists, update it; otherwise, insert it as a new message
-    if existing_message:
-        update_result = db.active_groups.update_one(
-            {"chat_id": chat_id, f"messages.{msg.get_id()}": {"$exists": True}},
-            {"$set": {f"messages.{msg.get_id()}": msg.get_as_tmessage()}},
-        )
-        if update_result.modified_count > 0:
-            return AddMessageResult.UPDATED
-        else:
-            return AddMessageResult.FAILURE
-    else:
-        add_message_result = db.active_groups.update_one(
-            {"chat_id": chat_id},
-            {"$set": {f"messages.{msg.get_id()}": msg.get_as_tmessage()}},
-        )
-        if add_message_result.modified_count > 0:
-            return AddMessageResult.SUCCESS
-        else:
-            return AddMessageResult.FAILURE
-
 
 def store_multiple_messages_to_db(
     chat_id: int | None, messages: List[SerializedMessage]
@@ -67,56 +101,90 @@ def store_multiple_messages_to_db(
     messages: List[telegram.Message] | None
         The list of message objects that are to be stored
     """
-    # check if the group chat exists, else create a collection for it.
-    if not db.active_groups.find_one({"chat_id": chat_id}):
-        db.active_groups.insert_one(
-            {
-                "chat_id": chat_id,
-                "group_name": messages[0].chat_title if messages else None,
-                "categories": [],
-            }
+    if not messages:
+        return AddMessageResult.SUCCESS
+
+    # One unordered bulk write, pymongo splits it into server-sized batches
+    operations = [
+        UpdateOne(
+            {"chat_id": chat_id, "id": msg.get_id()},
+            {"$set": _message_document(chat_id, msg.get_as_tmessage())},
+            upsert=True,
         )
-
-    # Serialize messages with IDs for insertion
-    serialized_messages = [msg.get_as_tmessage() for msg in messages]
-
-    # Insert the messages into the database
-    db.active_groups.update_one(
-        {"chat_id": chat_id},
-        {
-            "$set": {f"messages.{msg['id']}": msg for msg in serialized_messages},
-        },
-    )
+        for msg in messages
+    ]
+    try:
+        _ensure_group(chat_id, messages[0].chat_title)
+        db.messages.bulk_write(operations, ordered=False)
+    except PyMongoError as e:
+        logger.error(f"Failed to store messages of chat {chat_id}: {e}")
+        return AddMessageResult.FAILURE
 
     return AddMessageResult.SUCCESS
 
 
-def get_multiple_messages_by_id(chat_id: int, message_ids: List[str]) -> List[TMessage]:
+def get_multiple_messages_by_id(
+    chat_id: int,
+    message_ids: List[str],
+    fields: Sequence[str] = PROMPT_FIELDS,
+    timeout: float | None = None,
+) -> List[TMessage]:
     """
     Retrieves a list of messages from the database based on chat_id and message_ids.
+    Only the requested messages are read, through the (chat_id, id) index.
 
     Parameters:
     chat_id: int
         The chat id of the group chat
     message_ids: List[int]
         The list of message IDs to retrieve
+    fields: Sequence[str]
+        The message fields to return, besides the id. Defaults to the fields
+        needed to build a prompt.
+    timeout: float | None
+        Seconds after which the query is aborted, or None for no limit.
 
     Returns:
     List[SerializedMessage]
-        The list of messages that match the given message IDs in the specified chat
+        The list of messages that match the given message IDs in the specified chat,
+        in the order of message_ids
     """
+    ids = [int(m_id) for m_id in message_ids]
+    if not ids:
+        return []
+
+    projection: Dict[str, bool] = {"_id": False, "id": True}
+    projection.update({field: True for field in fields})
+    with pymongo.timeout(timeout):
+        cursor = (
+            db.messages.find({"chat_id": chat_id, "id": {"$in": ids}}, projection)
+            .hint(MESSAGES_INDEX)
+            .limit(len(ids))
+        )
+        by_id: Dict[int, TMessage] = {msg["id"]: msg for msg in cursor}
 
-    pipeline: List[Dict[str, Any]] = [
-        {"$match": {"chat_id": chat_id}},
-        {"$project": {"messages": {"$objectToArray": "$messages"}}},
-        {"$unwind": "$messages"},
-        {"$match": {"messages.k": {"$in": message_ids}}},
-        {"$project": {"message": "$messages.v"}},
-    ]
+    return [by_id[m_id] for m_id in ids if m_id in by_id]
 
-    # Execute the aggregation pipeline
-    chat_group: CommandCursor[Dict[str, Any]] = db.active_groups.aggregate(pipeline)
 
-    result: list[TMessage] = [msg["message"] for msg in chat_group]
+def get_score_threshold(chat_id: int) -> float | None:
+    """
+    Retrieves the minimum relevance score of a group chat's matches, which
+    its active_groups document may set as `score_threshold`.
 
-    return result
+    Parameters:
+    chat_id: int
+        The chat id of the group chat
+
+    Returns:
+    float | None
+        The chat's threshold, or None if it has none or it could not be read
+    """
+    try:
+        group = db.active_groups.find_one(
+            {"chat_id": chat_id}, {"_id": False, "score_threshold": True}
+        )
+    except PyMongoError as e:
+        logger.error(f"Failed to read the score threshold of chat {chat_id}: {e}")
+        return None
+    threshold = group.get("score_threshold") if group else None
+    return float(threshold) if threshold is not None else None
@@ -60,7 +60,7 @@ class SerializedMessage:
             entities = json_dict["text_entities"]
             text = "".join([entity["text"] for entity in entities])
 
-        return cls(
+        serialized = cls(
             Message(
                 id,
                 datetime.fromisoformat(json_dict["date"]),
@@ -69,6 +69,9 @@ class SerializedMessage:
                 text=text,
             )
         )
+        # exports only refer to the replied message by its id
+        serialized.reply_to_message = json_dict.get("reply_to_message_id")
+        return serialized
 
     def __init__(self, msg: Message):
         self.id: int = msg.message_id
@@ -83,6 +86,7 @@ class SerializedMessage:
         self.photo: Optional[Tuple[PhotoSize, ...]] = msg.photo
         self.video: Union[Video, None] = msg.video
         self.voice: Union[Voice, None] = msg.voice
+        self.chat_id: Union[int, None] = msg.chat.id if msg.chat else None
         self.chat_title: Union[str, None] = msg.chat.title if msg.chat else None
 
     def get_as_tmessage(self) -> TMessage:
@@ -118,7 +122,16 @@ class SerializedMessage:
 
 
 PCEmbeddingMetadata = TypedDict(
-    "PCEmbeddingMetadata", {"category": NotRequired[str], "chat_id": int}
+    "PCEmbeddingMetadata",
+    {
+        "category": NotRequired[str],
+        "chat_id": int,
+        # the start of the message, its unix timestamp and the message it
+        # replies to, so an answer can be built without reading the messages
+        "text": NotRequired[str],
+        "date": NotRequired[int],
+        "reply_to": NotRequired[int],
+    },
 )
 PCEmbeddingData = TypedDict(
     "PCEmbeddingData",
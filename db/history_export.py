@@ -0,0 +1,166 @@
+"""
+Reads Telegram chat history exports, `result.json`, without loading them.
+
+An export is one JSON object holding the chat's `name`, `type` and `id`,
+followed by the array of all its `messages`. The file is read a chunk at a
+time and every message is decoded on its own, so memory holds one chunk and
+one message at a time instead of the whole text and parsed tree of the
+export.
+"""
+import io
+import json
+import re
+from typing import IO, Any, Iterator
+
+from db.db_types import NoFromUserError, SerializedMessage
+
+# Characters read from the export at a time
+CHUNK_SIZE = 64 * 1024
+# Longest value the reader buffers, a malformed export is rejected before
+# the rest of the file is buffered looking for the end of a value
+MAX_VALUE_SIZE = 16 * 1024 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+# Yielded as the value of the streamed member before its items
+_ARRAY_START = object()
+
+
+class InvalidExportError(ValueError):
+    """Raised when an uploaded file is not a Telegram chat history export."""
+
+
+class _Reader:
+    def __init__(self, f: IO[str], chunk_size: int, max_value_size: int) -> None:
+        self.f = f
+        self.chunk_size = chunk_size
+        self.max_value_size = max_value_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        if len(self.buffer) > self.max_value_size:
+            raise json.JSONDecodeError("Value too long", self.buffer, 0)
+        return True
+
+    def peek(self) -> str:
+        """Returns the next character that is not whitespace, "" at the end."""
+        while True:
+            match = _WHITESPACE.match(self.buffer, self.pos)
+            self.pos = match.end() if match else self.pos
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # a number at the end of the buffer may go on in the next chunk
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _members(
+    f: IO[str], streamed: str, chunk_size: int, max_value_size: int
+) -> Iterator[tuple[str, Any]]:
+    """
+    Yields the (key, value) members of the JSON object in f, in order. The
+    array of the `streamed` member is yielded an item at a time instead, as
+    (streamed, _ARRAY_START) and then one (streamed, item) pair per item.
+    """
+    reader = _Reader(f, chunk_size, max_value_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", reader.buffer, 0)
+        reader.expect(":")
+        if key == streamed and reader.peek() == "[":
+            reader.pos += 1
+            yield key, _ARRAY_START
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.peek() != ",":
+                        break
+                    reader.pos += 1
+                reader.expect("]")
+        else:
+            yield key, reader.value()
+        if reader.peek() != ",":
+            break
+        reader.pos += 1
+    reader.expect("}")
+
+
+def read_export(
+    f: IO[bytes],
+    chunk_size: int = CHUNK_SIZE,
+    max_value_size: int = MAX_VALUE_SIZE,
+) -> Iterator[SerializedMessage]:
+    """
+    Yields the messages of a chat history export that have a sender and a
+    text, in the order of the export.
+
+    Parameters:
+    f: IO[bytes]
+        The export, opened in binary mode
+    chunk_size: int
+        The number of characters read at a time
+    max_value_size: int
+        The length of the longest message accepted
+
+    Raises:
+    InvalidExportError
+        If the export is not valid JSON or UTF-8, a message can't be read,
+        the chat's name, type or id do not come before its messages, as
+        they do in Telegram exports, or it has no messages
+    """
+    text = io.TextIOWrapper(f, encoding="utf-8-sig")
+    chat: dict[str, Any] = {}
+    has_messages = False
+    try:
+        for key, value in _members(text, "messages", chunk_size, max_value_size):
+            if key != "messages":
+                chat[key] = value
+                continue
+            if value is _ARRAY_START:
+                has_messages = True
+                continue
+            try:
+                message = SerializedMessage.from_exported_json(
+                    value, chat["id"], chat["type"], chat["name"]
+                )
+            except NoFromUserError:
+                continue
+            if message.text:
+                yield message
+    except (ValueError, KeyError) as e:
+        raise InvalidExportError(f"Invalid export: {e!r}") from e
+    if not has_messages:
+        raise InvalidExportError("The export has no messages")
@@ -0,0 +1,108 @@
+"""
+Hierarchical navigable small world graphs for the local index.
+
+An HNSW graph links every vector to its nearest neighbours on a stack of
+layers, each holding an exponentially smaller random subset of the vectors.
+A search descends greedily from the sparse top layer and explores the
+bottom layer with a beam of `ef` candidates, which visits a number of
+vectors that grows logarithmically with the size of the chat.
+
+The graphs are hnswlib indexes, which insert and search in C++ without
+holding the GIL.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Sequence
+
+import hnswlib
+import numpy as np
+import numpy.typing as npt
+
+Vectors = npt.NDArray[np.float32]
+
+# Vectors a new graph has room for, it doubles whenever it is full
+INITIAL_CAPACITY = 1024
+
+
+@dataclass
+class HNSWConfig:
+    # neighbours per vector on the upper layers, twice as many on the bottom one
+    m: int = 32
+    # beam width while inserting, higher builds a better graph more slowly
+    ef_construction: int = 200
+    # beam width while searching, higher finds more of the true neighbours
+    ef_search: int = 384
+    # chats with fewer vectors are searched by brute force
+    min_vectors: int = 20000
+
+
+class HNSW:
+    """
+    The graph of one chat. It holds copies of the chat's normalized vectors,
+    labelled with their rows, so similarity is their dot product.
+
+    A graph must not be searched while vectors are added to it, its owner
+    serializes the calls.
+    """
+
+    def __init__(
+        self,
+        dimension: int,
+        config: HNSWConfig,
+        capacity: int = INITIAL_CAPACITY,
+        seed: int = 0,
+    ) -> None:
+        self.config = config
+        self.index = hnswlib.Index(space="ip", dim=dimension)
+        self.index.init_index(
+            max_elements=capacity,
+            M=config.m,
+            ef_construction=config.ef_construction,
+            random_seed=seed,
+        )
+        # inserts run on the thread of the chat's builder only
+        self.index.set_num_threads(1)
+
+    @property
+    def count(self) -> int:
+        return int(self.index.get_current_count())
+
+    def add(self, vectors: Vectors, rows: Sequence[int]) -> None:
+        """
+        Inserts the vectors of the given rows, or moves them in the graph if
+        their rows are already in it.
+        """
+        needed = self.count + len(rows)
+        capacity = int(self.index.get_max_elements())
+        if needed > capacity:
+            self.index.resize_index(max(needed, 2 * capacity))
+        self.index.add_items(vectors, np.asarray(rows))
+
+    def search(
+        self, query: Vectors, top_k: int, ef: int | None = None
+    ) -> list[tuple[int, float]]:
+        """
+        Returns the rows and similarities of the vectors closest to the query,
+        most similar first.
+        """
+        top_k = min(top_k, self.count)
+        if top_k <= 0:
+            return []
+        self.index.set_ef(max(ef or self.config.ef_search, top_k))
+        rows, distances = self.index.knn_query(query, k=top_k)
+        # the inner product distance is one minus the dot product
+        return [
+            (int(row), 1.0 - float(distance))
+            for row, distance in zip(rows[0], distances[0])
+        ]
+
+    def save(self, path: str) -> None:
+        self.index.save_index(path)
+
+    @classmethod
+    def load(cls, path: str, dimension: int, config: HNSWConfig) -> HNSW:
+        graph = cls(dimension, config, capacity=1)
+        graph.index.load_index(path)
+        graph.index.set_num_threads(1)
+        return graph
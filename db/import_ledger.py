@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+from utils import config
+from utils.sqlite_store import SQLiteStore
+
+
+class ImportLedger:
+    """
+    Record of the messages history imports completed: stored, embedded,
+    upserted and indexed.
+
+    Imports check it before every batch and only import the messages it does
+    not hold, and record a batch once all of it is done, so an import that
+    stopped halfway, or the same export uploaded again, only does what is
+    missing. Kept in a SQLite database, or in memory without a path.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self._store = SQLiteStore(
+            path or ":memory:",
+            "CREATE TABLE IF NOT EXISTS imported "
+            "(chat_id INTEGER, message_id INTEGER, PRIMARY KEY (chat_id, message_id))",
+        )
+
+    def missing(self, chat_id: int, message_ids: Sequence[int]) -> list[int]:
+        """
+        Returns the ids of the messages of a chat that were not imported yet.
+        ---
+        Parameters
+            chat_id: int
+                    The chat the messages belong to.
+            message_ids: Sequence[int]
+                    The ids of the messages to look up.
+        Returns
+            ids: list[int]
+                    The ids not in the ledger, in the given order.
+        """
+        with self._store.lock:
+            rows = self._store.select_in(
+                "SELECT message_id FROM imported WHERE chat_id = ? "
+                "AND message_id IN ({})",
+                (chat_id,),
+                message_ids,
+            )
+        imported = {message_id for (message_id,) in rows}
+        return [m_id for m_id in message_ids if m_id not in imported]
+
+    def record(self, chat_id: int, message_ids: Sequence[int]) -> None:
+        """
+        Records messages of a chat as imported.
+        ---
+        Parameters
+            chat_id: int
+                    The chat the messages belong to.
+            message_ids: Sequence[int]
+                    The ids of the imported messages.
+        """
+        with self._store.lock:
+            self._store.write(
+                "INSERT OR IGNORE INTO imported (chat_id, message_id) VALUES (?, ?)",
+                [(chat_id, message_id) for message_id in message_ids],
+            )
+
+
+import_ledger = ImportLedger(path=config.IMPORT_LEDGER_PATH)
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Iterable, Sequence
+
+import numpy as np
+
+from utils import config
+from utils.sqlite_store import SQLiteStore
+
+# Words, numbers and codes like "cs110" or "b2.14" each make one token
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-]\w+)*")
+# Term frequencies are stored as unsigned shorts
+MAX_TERM_FREQUENCY = 2**16 - 1
+# Words of a query that say nothing about what it is about, they would match
+# most messages of a chat
+STOPWORDS = frozenset(
+    "a about an and any are as at be by can could did do does for from has have "
+    "how i if in is it its me my of on or our should so that the their there "
+    "this to was we were what when where which who why will with would you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class _ChatIndex:
+    """
+    The inverted index of one chat.
+
+    Documents are numbered in the order they are added. Every term maps to
+    two parallel arrays, the numbers of the documents it occurs in and its
+    frequency in each of them. A document that is added again, e.g. because
+    the message was edited, gets a new number and its old one is marked dead.
+    """
+
+    def __init__(self) -> None:
+        self.message_ids = array("q")
+        self.lengths = array("I")
+        self.live = bytearray()
+        self.postings: dict[str, tuple[array[int], array[int]]] = {}
+        self.doc_of_message: dict[int, int] = {}
+        self.live_count = 0
+        self.live_length = 0
+
+    def add(self, message_id: int, terms: Sequence[str]) -> None:
+        old = self.doc_of_message.get(message_id)
+        if old is not None:
+            self.live[old] = 0
+            self.live_count -= 1
+            self.live_length -= self.lengths[old]
+
+        doc = len(self.message_ids)
+        self.message_ids.append(message_id)
+        self.lengths.append(len(terms))
+        self.live.append(1)
+        self.doc_of_message[message_id] = doc
+        self.live_count += 1
+        self.live_length += len(terms)
+        for term, frequency in Counter(terms).items():
+            if term not in self.postings:
+                self.postings[term] = (array("I"), array("H"))
+            docs, frequencies = self.postings[term]
+            docs.append(doc)
+            frequencies.append(min(frequency, MAX_TERM_FREQUENCY))
+
+    def search(
+        self, terms: Iterable[str], top_k: int, k1: float, b: float
+    ) -> list[tuple[int, float]]:
+        if not self.live_count:
+            return []
+        live = np.frombuffer(self.live, dtype=np.uint8)
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+        average_length = self.live_length / self.live_count
+        scores = np.zeros(len(self.message_ids), dtype=np.float32)
+        for term in set(terms):
+            if term not in self.postings:
+                continue
+            docs_, frequencies_ = self.postings[term]
+            docs = np.frombuffer(docs_, dtype=np.uint32)
+            frequencies = np.frombuffer(frequencies_, dtype=np.uint16).astype(
+                np.float32
+            )
+            document_frequency = int(live[docs].sum())
+            if not document_frequency:
+                continue
+            idf = math.log(
+                1
+                + (self.live_count - document_frequency + 0.5)
+                / (document_frequency + 0.5)
+            )
+            norm = k1 * (1 - b + b * lengths[docs] / average_length)
+            scores[docs] += idf * frequencies * (k1 + 1) / (frequencies + norm)
+        scores *= live
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(scores[hits], -top_k)[-top_k:]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.message_ids[doc], float(scores[doc])) for doc in hits]
+
+
+class KeywordIndex:
+    """
+    Per-chat inverted index of message texts, ranked with BM25.
+
+    Postings are kept in compact arrays in memory and the tokenized messages
+    in a SQLite database, from which the index of a chat is rebuilt the
+    first time the chat is used after a restart.
+    """
+
+    def __init__(self, path: str | None = None, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._chats: dict[int, _ChatIndex] = {}
+        self._store = SQLiteStore(
+            path,
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(chat_id INTEGER, message_id INTEGER, terms TEXT NOT NULL, "
+            "PRIMARY KEY (chat_id, message_id))",
+        )
+
+    def add(self, chat_id: int, message_id: int, text: str) -> None:
+        self.add_many(chat_id, [(message_id, text)])
+
+    def add_many(self, chat_id: int, messages: Iterable[tuple[int, str]]) -> None:
+        """
+        Indexes the texts of messages of a chat, replacing earlier versions.
+        ---
+        Parameters
+            chat_id: int
+                    The chat the messages belong to.
+            messages: Iterable[tuple[int, str]]
+                    The id and text of each message.
+        """
+        documents = [(message_id, tokenize(text)) for message_id, text in messages]
+        with self._store.lock:
+            index = self._chat(chat_id)
+            for message_id, terms in documents:
+                index.add(message_id, terms)
+            self._store.write(
+                "INSERT OR REPLACE INTO documents (chat_id, message_id, terms) "
+                "VALUES (?, ?, ?)",
+                [
+                    (chat_id, message_id, " ".join(terms))
+                    for message_id, terms in documents
+                ],
+            )
+
+    def search(
+        self, chat_id: int, query: str, top_k: int = 3, min_score: float = 0.0
+    ) -> list[int]:
+        """
+        Returns the ids of the messages of a chat that best match the query,
+        best match first, leaving out those scoring less than min_score.
+        """
+        return [
+            message_id
+            for message_id, score in self.scores(chat_id, query, top_k)
+            if score >= min_score
+        ]
+
+    def scores(
+        self, chat_id: int, query: str, top_k: int = 3
+    ) -> list[tuple[int, float]]:
+        """
+        Returns the ids and BM25 scores of the messages of a chat that best
+        match the query, best match first. Stopwords of the query are ignored.
+        """
+        terms = [term for term in tokenize(query) if term not in STOPWORDS]
+        with self._store.lock:
+            return self._chat(chat_id).search(terms, top_k, self.k1, self.b)
+
+    def _chat(self, chat_id: int) -> _ChatIndex:
+        if chat_id not in self._chats:
+            index = _ChatIndex()
+            rows = self._store.select(
+                "SELECT message_id, terms FROM documents WHERE chat_id = ?",
+                (chat_id,),
+            )
+            for message_id, terms in rows:
+                index.add(message_id, terms.split())
+            self._chats[chat_id] = index
+        return self._chats[chat_id]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> list[str]:
+    """
+    Fuses several rankings of ids into one, scoring every id by the sum of
+    1 / (k + rank) over the rankings it appears in.
+    ---
+    Parameters
+        rankings: Sequence[Sequence[str]]
+                The rankings to fuse, best first.
+        k: int
+                Dampens the weight of the top ranks, 60 in the original paper.
+    Returns
+        ids: list[str]
+                Every id of the rankings, best first.
+    """
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1 / (k + rank)
+    return sorted(scores, key=lambda id: scores[id], reverse=True)
+
+
+keyword_index = KeywordIndex(path=config.KEYWORD_INDEX_PATH)
@@ -0,0 +1,497 @@
+from __future__ import annotations
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Literal, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from .hnsw import HNSW, HNSWConfig
+from .quantization import Quantizer, make_quantizer
+from .db_types import (
+    PCEmbeddingData,
+    PCEmbeddingMetadata,
+    PCQueryResult,
+    PCQueryResults,
+)
+
+# Dimensions of OpenAI's text-embedding-ada-002 embeddings
+EMBEDDING_DIMENSION = 1536
+# Rows a chat's matrix starts with, it doubles whenever it is full
+INITIAL_CAPACITY = 1024
+# With quantization, this many candidates per requested match are re-ranked
+RERANK_FACTOR = 10
+# Quantizers are refitted whenever a chat doubles, until it has this many rows
+REFIT_LIMIT = 16384
+# A chat's graph is saved after this many vectors were added to it
+GRAPH_SAVE_INTERVAL = 1000
+# Vectors added to a graph at a time, searches of the chat wait for a batch
+GRAPH_ADD_BATCH = 10
+
+
+class _ChatVectors:
+    """
+    The vectors of one chat, as the rows of a float32 matrix memory-mapped
+    from a file. Rows are normalized so a dot product is a cosine similarity.
+
+    With a quantizer, compressed codes of the rows are kept in memory and
+    searched instead, and only the best candidates are read back from the
+    matrix to be ranked exactly. The quantizer is fitted in a background
+    thread, and the matrix is searched until its first fit is done.
+
+    With an HNSW config, a graph of the rows is built in a background
+    thread once the chat reaches its `min_vectors`, and searched instead of
+    either once it holds every row, see db/hnsw.py.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int,
+        quantizer: Quantizer | None = None,
+        hnsw: HNSWConfig | None = None,
+    ) -> None:
+        self.path = path
+        self.dimension = dimension
+        self.quantizer = quantizer
+        self.hnsw = hnsw
+        self.ids: list[str] = []
+        self.metadata: list[PCEmbeddingMetadata] = []
+        self.row_of_id: dict[str, int] = {}
+        capacity = INITIAL_CAPACITY
+        if os.path.exists(path):
+            capacity = max(capacity, os.path.getsize(path) // (4 * dimension))
+        self.matrix = self._map(capacity)
+        # the fitted copy of the quantizer and the codes it made, replaced
+        # together so a search never mixes codes of two fits
+        self.quantized: tuple[Quantizer, npt.NDArray[Any]] | None = None
+        # rows the quantizer was last fitted on
+        self.fitted_count = 0
+        # the thread fitting the quantizer, and the rows overwritten or added
+        # while it runs, guarded by fitter_lock
+        self.fitter: threading.Thread | None = None
+        self.refit_rows: set[int] = set()
+        self.fitter_lock = threading.Lock()
+        # the graph searches go through, once it holds every row
+        self.graph: HNSW | None = None
+        self.graph_path = path.removesuffix(".f32") + ".hnsw.bin"
+        # a graph is not safe to search while vectors are added to it
+        self.graph_lock = threading.Lock()
+        self.unsaved_rows = 0
+        # the thread adding rows to the graph, and the rows overwritten
+        # since, guarded by builder_lock
+        self.builder: threading.Thread | None = None
+        self.edited_rows: set[int] = set()
+        self.builder_lock = threading.Lock()
+        self.deleted = False
+
+    def _map(self, capacity: int) -> np.memmap[Any, np.dtype[np.float32]]:
+        mode: Literal["r+", "w+"] = "r+" if os.path.exists(self.path) else "w+"
+        if mode == "r+" and os.path.getsize(self.path) < capacity * 4 * self.dimension:
+            with open(self.path, "r+b") as f:
+                f.truncate(capacity * 4 * self.dimension)
+        return np.memmap(
+            self.path, dtype=np.float32, mode=mode, shape=(capacity, self.dimension)
+        )
+
+    def set(
+        self,
+        row: int,
+        id: str,
+        vector: Sequence[float],
+        metadata: PCEmbeddingMetadata,
+    ) -> None:
+        if row == len(self.matrix):
+            self.matrix.flush()
+            self.matrix = self._map(2 * len(self.matrix))
+        values = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(values)
+        self.matrix[row] = values / norm if norm else values
+        if row == len(self.ids):
+            # searches run without the index lock and only see the rows of
+            # `ids`, so a row is added there once the rest of it is in place
+            self.metadata.append(metadata)
+            self.ids.append(id)
+        else:
+            self.metadata[row] = metadata
+        self.row_of_id[id] = row
+
+    def update_codes(self, rows: Sequence[int]) -> None:
+        """
+        Encodes the given rows with the current fit of the quantizer, and
+        starts refitting it on every row in a background thread whenever the
+        chat has doubled in size since it was last fitted.
+        """
+        if self.quantizer is None:
+            return
+        with self.fitter_lock:
+            if self.quantized is not None:
+                quantizer, codes = self.quantized
+                codes = self._grow(quantizer, codes)
+                self._encode(quantizer, codes, rows)
+                self.quantized = (quantizer, codes)
+            if self.fitter is not None:
+                # the running fit encodes these too before it is searched
+                self.refit_rows.update(rows)
+                return
+            if self.fitted_count < REFIT_LIMIT and len(self.ids) >= max(
+                self.quantizer.min_fit_size, 2 * self.fitted_count
+            ):
+                fitter = threading.Thread(target=self._fit, daemon=True)
+                fitter.start()
+                self.fitter = fitter
+
+    def wait_for_codes(self) -> None:
+        """
+        Waits until the quantizer is fitted on every row added so far.
+        """
+        while (fitter := self.fitter) is not None:
+            fitter.join()
+
+    def _fit(self) -> None:
+        """
+        Fits a copy of the quantizer on every row and encodes them with it,
+        then replaces the current fit and codes once they hold every row.
+        """
+        try:
+            assert self.quantizer is not None
+            fitted = count = len(self.ids)
+            quantizer = copy.deepcopy(self.quantizer)
+            quantizer.fit(np.asarray(self.matrix[:fitted]))
+            codes = quantizer.empty(len(self.matrix))
+            self._encode(quantizer, codes, range(count))
+            while not self.deleted:
+                added = len(self.ids)
+                if added - count <= INITIAL_CAPACITY:
+                    break
+                # encodes most rows added meanwhile without holding the lock
+                codes = self._grow(quantizer, codes)
+                self._encode(quantizer, codes, range(count, added))
+                count = added
+            with self.fitter_lock:
+                added = len(self.ids)
+                codes = self._grow(quantizer, codes)
+                self._encode(
+                    quantizer, codes, sorted(self.refit_rows.union(range(count, added)))
+                )
+                self.quantized = (quantizer, codes)
+                self.fitted_count = fitted
+                self.refit_rows.clear()
+                self.fitter = None
+        except BaseException:
+            with self.fitter_lock:
+                self.refit_rows.clear()
+                self.fitter = None
+            raise
+
+    def _grow(self, quantizer: Quantizer, codes: npt.NDArray[Any]) -> npt.NDArray[Any]:
+        """
+        Returns the codes with room for every row of the matrix.
+        """
+        if len(codes) >= len(self.matrix):
+            return codes
+        grown = quantizer.empty(len(self.matrix))
+        grown[: len(codes)] = codes
+        return grown
+
+    def _encode(
+        self, quantizer: Quantizer, codes: npt.NDArray[Any], rows: Sequence[int]
+    ) -> None:
+        for start in range(0, len(rows), INITIAL_CAPACITY):
+            chunk = np.asarray(rows[start : start + INITIAL_CAPACITY])
+            codes[chunk] = quantizer.encode(self.matrix[chunk])
+
+    def update_graph(self, rows: Sequence[int]) -> None:
+        """
+        Starts adding the given rows to the graph in a background thread,
+        building it over every row if the chat just reached the size for
+        one. Overwritten rows are moved in the graph, as their vectors are
+        copied into it.
+        """
+        if self.hnsw is None:
+            return
+        if self.graph is None and len(self.ids) < self.hnsw.min_vectors:
+            return
+        with self.builder_lock:
+            self.edited_rows.update(rows)
+            # a running builder adds the new rows before it stops
+            if self.builder is None:
+                builder = threading.Thread(target=self._build, daemon=True)
+                builder.start()
+                self.builder = builder
+
+    def wait_for_graph(self) -> None:
+        """
+        Waits until the graph holds every row added so far.
+        """
+        while (builder := self.builder) is not None:
+            builder.join()
+
+    def _build(self) -> None:
+        """
+        Adds rows to the graph until it holds every row of the chat. A new
+        graph is only searched once it does, until then searches go through
+        the matrix.
+        """
+        try:
+            graph = self.graph
+            if graph is None:
+                graph = self._load_graph()
+            while True:
+                with self.builder_lock:
+                    count = len(self.ids)
+                    # rows past the graph's count are added with the new ones
+                    edited = sorted(
+                        row for row in self.edited_rows if row < graph.count
+                    )
+                    self.edited_rows.clear()
+                    if self.deleted or (graph.count >= count and not edited):
+                        self.graph = graph
+                        self.builder = None
+                        return
+                self._add_to_graph(graph, [*edited, *range(graph.count, count)])
+        except BaseException:
+            with self.builder_lock:
+                self.builder = None
+            raise
+
+    def _load_graph(self) -> HNSW:
+        assert self.hnsw is not None
+        if os.path.exists(self.graph_path):
+            saved = HNSW.load(self.graph_path, self.dimension, self.hnsw)
+            # a graph ahead of the saved ids is from an interrupted upsert
+            if saved.count <= len(self.ids):
+                return saved
+        return HNSW(self.dimension, self.hnsw)
+
+    def _add_to_graph(self, graph: HNSW, rows: Sequence[int]) -> None:
+        for start in range(0, len(rows), GRAPH_ADD_BATCH):
+            if self.deleted:
+                return
+            batch = rows[start : start + GRAPH_ADD_BATCH]
+            vectors = np.asarray(self.matrix[np.asarray(batch)])
+            with self.graph_lock:
+                graph.add(vectors, batch)
+            self.unsaved_rows += len(batch)
+            if self.unsaved_rows >= GRAPH_SAVE_INTERVAL:
+                graph.save(self.graph_path)
+                self.unsaved_rows = 0
+
+    def search(self, vector: Sequence[float], top_k: int) -> list[tuple[int, float]]:
+        count = len(self.ids)
+        if not count or top_k <= 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+
+        graph = self.graph
+        if graph is not None:
+            with self.graph_lock:
+                return graph.search(query, top_k)
+
+        candidates = top_k * RERANK_FACTOR
+        quantized = self.quantized
+        if quantized is not None and count > candidates:
+            quantizer, codes = quantized
+            approximate = quantizer.scores(query, codes[:count])
+            rows = np.sort(np.argpartition(approximate, -candidates)[-candidates:])
+            scores = self.matrix[rows] @ query
+        else:
+            rows = np.arange(count)
+            scores = self.matrix[:count] @ query
+
+        best = np.arange(len(rows))
+        if len(rows) > top_k:
+            best = np.argpartition(scores, -top_k)[-top_k:]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+
+class LocalIndex:
+    """
+    In-process stand-in for a Pinecone index.
+
+    Every chat's vectors live in their own memory-mapped float32 matrix,
+    `<path>/<chat_id>.f32`, and their ids and metadata in a SQLite database
+    next to them. A query is one matrix-vector product over the chat's
+    matrix and an argpartition for the top matches.
+
+    With `quantization` set to "float16", "int8" or "pq", the matrices stay
+    on disk and compressed codes of them are searched in memory instead, see
+    db/quantization.py. The codes are rebuilt in the background when a chat
+    is loaded, see `wait_for_codes`, and the matrix is searched until then.
+
+    With `hnsw` set, chats of at least `hnsw.min_vectors` vectors are
+    searched through an HNSW graph, `<path>/<chat_id>.hnsw.bin`, which is
+    saved as it grows and caught up with the matrix when a chat is loaded.
+    Graphs are built and caught up in the background, see `wait_for_graphs`.
+
+    Implements the parts of pinecone.Index the bot uses, `upsert`, `query`
+    and `delete` on the namespace of a chat, so it can be passed wherever one
+    is. A namespace is a chat id, see db.vectordb.chat_namespace.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int = EMBEDDING_DIMENSION,
+        quantization: str = "none",
+        hnsw: HNSWConfig | None = None,
+    ) -> None:
+        self.path = path
+        self.dimension = dimension
+        self.quantization = quantization
+        self.hnsw = hnsw
+        # fail early on an unknown quantization
+        make_quantizer(quantization, dimension)
+        os.makedirs(path, exist_ok=True)
+        self._chats: dict[int, _ChatVectors] = {}
+        # upserts and queries come from a thread pool
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(path, "vectors.sqlite3"), check_same_thread=False
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS vectors "
+            "(chat_id INTEGER, row INTEGER, id TEXT NOT NULL, metadata TEXT NOT NULL, "
+            "PRIMARY KEY (chat_id, row))"
+        )
+        self._connection.commit()
+
+    def upsert(
+        self, vectors: Sequence[PCEmbeddingData], namespace: str = "", **kwargs: Any
+    ) -> None:
+        """
+        Inserts vectors, or overwrites them if their id already exists.
+        Without a namespace, the chat of a vector is read from its chat_id
+        metadata.
+        """
+        with self._lock:
+            rows = []
+            chat_rows: dict[int, list[int]] = {}
+            for vector in vectors:
+                chat_id = int(namespace or vector["metadata"]["chat_id"])
+                chat = self._chat(chat_id)
+                row = chat.row_of_id.get(vector["id"], len(chat.ids))
+                chat.set(row, vector["id"], vector["values"], vector["metadata"])
+                chat_rows.setdefault(chat_id, []).append(row)
+                rows.append(
+                    (chat_id, row, vector["id"], json.dumps(vector["metadata"]))
+                )
+            for chat_id, updated in chat_rows.items():
+                self._chats[chat_id].matrix.flush()
+                self._chats[chat_id].update_codes(updated)
+                self._chats[chat_id].update_graph(updated)
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO vectors (chat_id, row, id, metadata) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._connection.commit()
+
+    def query(
+        self,
+        vector: Sequence[float],
+        top_k: int,
+        namespace: str = "",
+        filter: dict[str, Any] | None = None,
+        include_metadata: bool = False,
+        include_values: bool = False,
+        **kwargs: Any,
+    ) -> PCQueryResults:
+        """
+        Returns the top_k vectors of a chat most similar to the given one.
+        The chat is the namespace, or else the {"chat_id": {"$eq": chat_id}}
+        filter, the only one supported.
+        """
+        if namespace:
+            chat_id = int(namespace)
+        elif filter is not None:
+            chat_id = filter["chat_id"]["$eq"]
+        else:
+            raise ValueError("Queries need a namespace or a chat_id filter")
+        # loaded chats are searched without waiting for upserts
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            with self._lock:
+                chat = self._chat(chat_id)
+        best = chat.search(vector, top_k)
+        matches: list[PCQueryResult] = []
+        for row, score in best:
+            match: PCQueryResult = {"id": chat.ids[row], "score": score, "values": []}
+            if include_values:
+                match["values"] = chat.matrix[row].tolist()
+            if include_metadata:
+                match["metadata"] = chat.metadata[row]
+            matches.append(match)
+        return {"matches": matches, "namespace": namespace}
+
+    def delete(
+        self, delete_all: bool = False, namespace: str = "", **kwargs: Any
+    ) -> None:
+        """
+        Deletes every vector of the chat of the namespace.
+        Only deleting a whole namespace is supported.
+        """
+        if not delete_all or not namespace:
+            raise ValueError("Only whole namespaces can be deleted")
+        chat_id = int(namespace)
+        with self._lock:
+            chat = self._chats.pop(chat_id, None)
+            if chat is not None:
+                # its builder stops after the batch it is adding, unsaved
+                chat.deleted = True
+                chat.wait_for_graph()
+                chat.wait_for_codes()
+                # searches still holding the chat keep reading the unlinked files
+                chat.matrix.flush()
+            for path in (
+                os.path.join(self.path, f"{chat_id}.f32"),
+                os.path.join(self.path, f"{chat_id}.hnsw.bin"),
+            ):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._connection.execute(
+                "DELETE FROM vectors WHERE chat_id = ?", (chat_id,)
+            )
+            self._connection.commit()
+
+    def wait_for_graphs(self) -> None:
+        """
+        Waits until the graphs of the loaded chats hold all their vectors.
+        """
+        for chat in list(self._chats.values()):
+            chat.wait_for_graph()
+
+    def wait_for_codes(self) -> None:
+        """
+        Waits until the quantizers of the loaded chats are fitted on all
+        their vectors.
+        """
+        for chat in list(self._chats.values()):
+            chat.wait_for_codes()
+
+    def _chat(self, chat_id: int) -> _ChatVectors:
+        if chat_id not in self._chats:
+            chat = _ChatVectors(
+                os.path.join(self.path, f"{chat_id}.f32"),
+                self.dimension,
+                make_quantizer(self.quantization, self.dimension),
+                self.hnsw,
+            )
+            rows = self._connection.execute(
+                "SELECT id, metadata FROM vectors WHERE chat_id = ? ORDER BY row",
+                (chat_id,),
+            )
+            for row, (id, metadata) in enumerate(rows):
+                chat.ids.append(id)
+                chat.metadata.append(json.loads(metadata))
+                chat.row_of_id[id] = row
+            chat.update_codes(range(len(chat.ids)))
+            chat.update_graph([])
+            self._chats[chat_id] = chat
+        return self._chats[chat_id]
@@ -0,0 +1,95 @@
+"""
+Moves messages out of the legacy `active_groups.messages` map into the
+`messages` collection.
+
+Group documents are streamed one at a time and their messages are upserted
+in bulk batches, so the migration can be re-run safely at any point.
+
+    python -m db.migrate_messages --batch_size 1000 --unset
+"""
+import argparse
+from typing import Any, Dict, Iterable, List
+from pymongo import UpdateOne
+
+from bot import logger
+from db import db
+from db.database import ensure_indexes
+from utils.batch import split_into_batches
+
+
+def _upsert_operations(
+    chat_id: int | None, messages: Iterable[Dict[str, Any]]
+) -> List[UpdateOne]:
+    return [
+        UpdateOne(
+            {"chat_id": chat_id, "id": message["id"]},
+            {"$set": {**message, "chat_id": chat_id}},
+            upsert=True,
+        )
+        for message in messages
+    ]
+
+
+def migrate_group(group: Dict[str, Any], batch_size: int = 1000) -> int:
+    """
+    Copies the messages of one legacy group document into the messages collection.
+
+    Parameters:
+    group: Dict[str, Any]
+        The active_groups document, with its messages map
+    batch_size: int
+        The number of upserts sent per bulk write
+
+    Returns:
+    int
+        The number of messages copied
+    """
+    messages = list((group.get("messages") or {}).values())
+    for batch in split_into_batches(messages, batch_size):
+        db.messages.bulk_write(
+            _upsert_operations(group["chat_id"], batch), ordered=False
+        )
+    return len(messages)
+
+
+def migrate(batch_size: int = 1000, unset: bool = False) -> int:
+    """
+    Migrates every group chat that still stores its messages inline.
+
+    Parameters:
+    batch_size: int
+        The number of upserts sent per bulk write
+    unset: bool
+        Whether to remove the messages map from the group document once copied
+
+    Returns:
+    int
+        The total number of messages copied
+    """
+    ensure_indexes()
+    total = 0
+    # batch_size=1 keeps at most one (up to 16MB) group document in memory
+    groups = db.active_groups.find(
+        {"messages": {"$exists": True}},
+        {"chat_id": True, "messages": True},
+        batch_size=1,
+    )
+    for group in groups:
+        copied = migrate_group(group, batch_size)
+        if unset:
+            db.active_groups.update_one(
+                {"_id": group["_id"]}, {"$unset": {"messages": ""}}
+            )
+        logger.info(f"Migrated {copied} messages of chat {group['chat_id']}")
+        total += copied
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--unset", action="store_true")
+    args = parser.parse_args()
+
+    total = migrate(batch_size=args.batch_size, unset=args.unset)
+    logger.info(f"Migration complete, {total} messages copied")
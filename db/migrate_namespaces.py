@@ -0,0 +1,129 @@
+"""
+Copies the vectors of every chat out of the shared default namespace of the
+Pinecone index into the chat's own namespace, see db.vectordb.chat_namespace.
+
+Vector ids, `<chat_id>:<message_id>`, are read from the messages collection
+and the vectors are fetched and upserted in batches spread over a thread
+pool. Copies are upserts, so the migration can be re-run safely at any point.
+
+    python -m db.migrate_namespaces --batch_size 100 --workers 8 --delete
+"""
+import argparse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import groupby
+from typing import Any, Iterator
+
+import pinecone
+
+from bot import logger
+from db import db
+from db.database import MESSAGES_INDEX
+from db.db_types import PCEmbeddingData
+from db.vectordb import chat_namespace, init_pinecone
+from utils.batch import split_into_batches
+
+
+def _vector_ids(batch_size: int) -> Iterator[tuple[int, list[str]]]:
+    # sorted on the unique index, so messages arrive grouped by chat
+    messages = db.messages.find({}, {"chat_id": True, "id": True, "_id": False}).sort(
+        MESSAGES_INDEX
+    )
+    for chat_id, chat_messages in groupby(messages, lambda m: m["chat_id"]):
+        ids = [f"{chat_id}:{message['id']}" for message in chat_messages]
+        for batch in split_into_batches(ids, batch_size):
+            yield chat_id, batch
+
+
+def migrate_batch(
+    index: pinecone.Index, chat_id: int, ids: list[str], delete: bool = False
+) -> int:
+    """
+    Copies the vectors of one batch of a chat's messages into its namespace.
+
+    Parameters:
+    index: pinecone.Index
+        The index holding the vectors
+    chat_id: int
+        The chat the messages belong to
+    ids: list[str]
+        The vector ids of the messages, messages without a vector are skipped
+    delete: bool
+        Whether to delete the vectors from the default namespace once copied
+
+    Returns:
+    int
+        The number of vectors copied
+    """
+    fetched: dict[str, Any] = index.fetch(ids=ids).to_dict()["vectors"]
+    vectors: list[PCEmbeddingData] = [
+        {
+            "id": id,
+            "values": vector["values"],
+            "metadata": vector.get("metadata", {"chat_id": chat_id}),
+        }
+        for id, vector in fetched.items()
+    ]
+    if vectors:
+        index.upsert(vectors=vectors, namespace=chat_namespace(chat_id))
+        if delete:
+            index.delete(ids=list(fetched))
+    return len(vectors)
+
+
+def migrate(
+    index: pinecone.Index, batch_size: int = 100, workers: int = 8, delete: bool = False
+) -> int:
+    """
+    Migrates the vectors of every chat with messages in the messages collection.
+
+    Parameters:
+    index: pinecone.Index
+        The index holding the vectors
+    batch_size: int
+        The number of vectors fetched and upserted per request
+    workers: int
+        The number of batches migrated in parallel
+    delete: bool
+        Whether to delete the vectors from the default namespace once copied
+
+    Returns:
+    int
+        The total number of vectors copied
+    """
+    total = 0
+    # batches are submitted as earlier ones finish, so the ids of the whole
+    # collection are never queued at once
+    pending: deque[tuple[int, Future[int]]] = deque()
+
+    def wait_for_oldest() -> None:
+        nonlocal total
+        chat_id, future = pending.popleft()
+        copied = future.result()
+        logger.debug(f"Migrated {copied} vectors of chat {chat_id}")
+        total += copied
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chat_id, ids in _vector_ids(batch_size):
+            if len(pending) >= 2 * workers:
+                wait_for_oldest()
+            pending.append(
+                (chat_id, executor.submit(migrate_batch, index, chat_id, ids, delete))
+            )
+        while pending:
+            wait_for_oldest()
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--delete", action="store_true")
+    args = parser.parse_args()
+
+    index = init_pinecone()
+    if index is None:
+        raise SystemExit("The migration needs a Pinecone index")
+    total = migrate(index, args.batch_size, args.workers, args.delete)
+    logger.info(f"Migration complete, {total} vectors copied")
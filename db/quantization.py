@@ -0,0 +1,213 @@
+"""
+Compressed codes for the vectors of the local index.
+
+A quantizer encodes normalized float32 vectors into compact codes whose
+dot products with a query approximate the exact ones. The local index
+searches the codes for candidates and re-ranks them with the exact vectors.
+"""
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+Vectors = npt.NDArray[np.float32]
+
+# Rows scored at a time, which bounds the temporary float32 copies of the codes
+SCORE_CHUNK_ROWS = 4096
+
+
+class Quantizer(ABC):
+    """
+    Base class of the quantizers. Subclasses implement `empty`, `encode` and
+    `scores`, and `fit` if they learn their parameters from the vectors.
+    """
+
+    # Vectors needed before the quantizer can be fitted
+    min_fit_size = 1
+
+    def __init__(self, dimension: int) -> None:
+        self.dimension = dimension
+        self.fitted = False
+
+    def fit(self, vectors: Vectors) -> None:
+        self.fitted = True
+
+    @abstractmethod
+    def empty(self, rows: int) -> npt.NDArray[Any]:
+        """Returns room for the codes of the given number of vectors."""
+
+    @abstractmethod
+    def encode(self, vectors: Vectors) -> npt.NDArray[Any]:
+        """Returns the codes of the given vectors."""
+
+    @abstractmethod
+    def scores(self, query: Vectors, codes: npt.NDArray[Any]) -> Vectors:
+        """Returns the approximate dot products of the query with the codes."""
+
+
+class Float16Quantizer(Quantizer):
+    """Keeps every dimension as a half precision float, 2x smaller."""
+
+    def empty(self, rows: int) -> npt.NDArray[Any]:
+        return np.zeros((rows, self.dimension), dtype=np.float16)
+
+    def encode(self, vectors: Vectors) -> npt.NDArray[Any]:
+        return vectors.astype(np.float16)
+
+    def scores(self, query: Vectors, codes: npt.NDArray[Any]) -> Vectors:
+        return _chunked_dot(codes, query)
+
+
+class Int8Quantizer(Quantizer):
+    """
+    Maps every dimension linearly onto a signed byte, 4x smaller.
+    The scale of each dimension is fitted to the largest value it takes.
+    """
+
+    def __init__(self, dimension: int) -> None:
+        super().__init__(dimension)
+        self.scale = np.ones(dimension, dtype=np.float32)
+
+    def fit(self, vectors: Vectors) -> None:
+        largest = np.abs(vectors).max(axis=0)
+        self.scale = np.where(largest > 0, largest / 127, 1.0).astype(np.float32)
+        self.fitted = True
+
+    def empty(self, rows: int) -> npt.NDArray[Any]:
+        return np.zeros((rows, self.dimension), dtype=np.int8)
+
+    def encode(self, vectors: Vectors) -> npt.NDArray[Any]:
+        codes: npt.NDArray[np.int8] = np.clip(
+            np.rint(vectors / self.scale), -127, 127
+        ).astype(np.int8)
+        return codes
+
+    def scores(self, query: Vectors, codes: npt.NDArray[Any]) -> Vectors:
+        return _chunked_dot(codes, query * self.scale)
+
+
+class ProductQuantizer(Quantizer):
+    """
+    Splits vectors into `subspaces` slices and encodes every slice as the
+    index of the nearest of 256 centroids learned with k-means, one byte per
+    slice. Dot products with a query are sums of its precomputed dot
+    products with the centroids.
+    """
+
+    centroids = 256
+    min_fit_size = 1024
+
+    def __init__(
+        self,
+        dimension: int,
+        subspaces: int | None = None,
+        iterations: int = 8,
+        max_fit_size: int = 2560,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(dimension)
+        # slices of 4 dimensions by default, 16x smaller than float32
+        subspaces = subspaces or dimension // 4
+        if not subspaces or dimension % subspaces:
+            raise ValueError(f"{dimension} dimensions can't be split in {subspaces}")
+        self.subspaces = subspaces
+        self.iterations = iterations
+        self.max_fit_size = max_fit_size
+        self._rng = np.random.default_rng(seed)
+        # (subspaces, centroids, dimension / subspaces)
+        self.codebooks = np.zeros(
+            (subspaces, self.centroids, dimension // subspaces), dtype=np.float32
+        )
+
+    def fit(self, vectors: Vectors) -> None:
+        if len(vectors) > self.max_fit_size:
+            sample = self._rng.choice(len(vectors), self.max_fit_size, replace=False)
+            vectors = vectors[np.sort(sample)]
+        slices = np.ascontiguousarray(self._split(vectors))
+        for m in range(self.subspaces):
+            self.codebooks[m] = self._kmeans(slices[m])
+        self.fitted = True
+
+    def empty(self, rows: int) -> npt.NDArray[Any]:
+        return np.zeros((rows, self.subspaces), dtype=np.uint8)
+
+    def encode(self, vectors: Vectors) -> npt.NDArray[Any]:
+        slices = np.ascontiguousarray(self._split(vectors))
+        codes = np.empty((self.subspaces, len(vectors)), dtype=np.uint8)
+        for m in range(self.subspaces):
+            codes[m] = self._nearest(slices[m], self.codebooks[m])
+        return codes.T.copy()
+
+    def scores(self, query: Vectors, codes: npt.NDArray[Any]) -> Vectors:
+        # (subspaces, centroids) dot products of the query slices with the centroids
+        table = np.einsum("mcd,md->mc", self.codebooks, self._split(query[None])[:, 0])
+        flat = table.ravel()
+        offsets = np.arange(self.subspaces, dtype=np.intp) * self.centroids
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+            chunk = codes[start : start + SCORE_CHUNK_ROWS]
+            scores[start : start + len(chunk)] = flat[chunk + offsets].sum(axis=1)
+        return scores
+
+    def _split(self, vectors: Vectors) -> Vectors:
+        # (subspaces, rows, dimension / subspaces)
+        return vectors.reshape(len(vectors), self.subspaces, -1).transpose(1, 0, 2)
+
+    def _kmeans(self, points: Vectors) -> Vectors:
+        start = self._rng.choice(len(points), self.centroids, replace=False)
+        centroids = points[start].copy()
+        for _ in range(self.iterations):
+            assigned = self._nearest(points, centroids)
+            counts = np.bincount(assigned, minlength=self.centroids)
+            sums = np.stack(
+                [
+                    np.bincount(assigned, weights=column, minlength=self.centroids)
+                    for column in points.T
+                ],
+                axis=1,
+            )
+            # empty clusters keep their previous centroid
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        fitted: Vectors = centroids
+        return fitted
+
+    @staticmethod
+    def _nearest(points: Vectors, centroids: Vectors) -> npt.NDArray[np.intp]:
+        # |p - c|^2 without |p|^2, which is the same for every centroid,
+        # computed in place as this is the bulk of fitting and encoding
+        distances = points @ (-2 * centroids.T)
+        distances += (centroids**2).sum(axis=1)
+        nearest: npt.NDArray[np.intp] = np.argmin(distances, axis=1)
+        return nearest
+
+
+def _chunked_dot(codes: npt.NDArray[Any], query: Vectors) -> Vectors:
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+        chunk = codes[start : start + SCORE_CHUNK_ROWS]
+        scores[start : start + len(chunk)] = chunk.astype(np.float32) @ query
+    return scores
+
+
+QUANTIZERS: dict[str, type[Quantizer]] = {
+    "float16": Float16Quantizer,
+    "int8": Int8Quantizer,
+    "pq": ProductQuantizer,
+}
+
+
+def make_quantizer(name: str, dimension: int) -> Quantizer | None:
+    """
+    Returns the quantizer called `name`, or None for "none".
+    """
+    if name == "none":
+        return None
+    if name not in QUANTIZERS:
+        raise ValueError(
+            f"Unknown quantization {name}, use one of none, {', '.join(QUANTIZERS)}"
+        )
+    return QUANTIZERS[name](dimension)
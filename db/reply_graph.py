@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+from bisect import insort
+from typing import Iterable, Sequence
+
+from utils import config
+from utils.sqlite_store import SQLiteStore
+
+
+class _ChatThreads:
+    def __init__(self) -> None:
+        self.parent: dict[int, int] = {}
+        self.children: dict[int, list[int]] = {}
+
+    def add(self, message_id: int, parent_id: int) -> None:
+        if self.parent.get(message_id) == parent_id:
+            return
+        self.parent[message_id] = parent_id
+        # replies are kept in the order they were sent
+        insort(self.children.setdefault(parent_id, []), message_id)
+
+
+class ReplyGraph:
+    """
+    Per-chat index of which message replies to which.
+
+    Kept in memory for lookups without a database round trip, and in a
+    SQLite database, from which the threads of a chat are loaded the first
+    time the chat is used after a restart.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self._chats: dict[int, _ChatThreads] = {}
+        self._store = SQLiteStore(
+            path,
+            "CREATE TABLE IF NOT EXISTS replies "
+            "(chat_id INTEGER, message_id INTEGER, parent_id INTEGER NOT NULL, "
+            "PRIMARY KEY (chat_id, message_id))",
+        )
+
+    def add(self, chat_id: int, message_id: int, parent_id: int | None) -> None:
+        self.add_many(chat_id, [(message_id, parent_id)])
+
+    def add_many(self, chat_id: int, replies: Iterable[tuple[int, int | None]]) -> None:
+        """
+        Records the messages of a chat that reply to another message.
+        ---
+        Parameters
+            chat_id: int
+                    The chat the messages belong to.
+            replies: Iterable[tuple[int, int | None]]
+                    The id of each message and of the message it replies to,
+                    None if it is not a reply.
+        """
+        edges = [(message_id, parent) for message_id, parent in replies if parent]
+        if not edges:
+            return
+        with self._store.lock:
+            threads = self._chat(chat_id)
+            for message_id, parent_id in edges:
+                threads.add(message_id, parent_id)
+            self._store.write(
+                "INSERT OR REPLACE INTO replies (chat_id, message_id, parent_id) "
+                "VALUES (?, ?, ?)",
+                [(chat_id, message_id, parent_id) for message_id, parent_id in edges],
+            )
+
+    def context(
+        self, chat_id: int, message_ids: Sequence[int], max_replies: int = 2
+    ) -> list[int]:
+        """
+        Returns the ids of the messages that complete the threads of the given
+        messages: the message each of them replies to, then the first replies
+        to each of them. Ids already in message_ids are left out.
+        ---
+        Parameters
+            chat_id: int
+                    The chat the messages belong to.
+            message_ids: Sequence[int]
+                    The ids of the messages to find the threads of.
+            max_replies: int
+                    The number of replies taken per message.
+        Returns
+            ids: list[int]
+                    The ids of the parents, then the ids of the replies.
+        """
+        with self._store.lock:
+            threads = self._chat(chat_id)
+            parents = [threads.parent.get(m_id) for m_id in message_ids]
+            replies = [
+                reply
+                for m_id in message_ids
+                for reply in threads.children.get(m_id, [])[:max_replies]
+            ]
+        seen = set(message_ids)
+        context: list[int] = []
+        for m_id in [*parents, *replies]:
+            if m_id is not None and m_id not in seen:
+                seen.add(m_id)
+                context.append(m_id)
+        return context
+
+    def _chat(self, chat_id: int) -> _ChatThreads:
+        if chat_id not in self._chats:
+            threads = _ChatThreads()
+            rows = self._store.select(
+                "SELECT message_id, parent_id FROM replies WHERE chat_id = ?",
+                (chat_id,),
+            )
+            for message_id, parent_id in rows:
+                threads.add(message_id, parent_id)
+            self._chats[chat_id] = threads
+        return self._chats[chat_id]
+
+
+reply_graph = ReplyGraph(path=config.REPLY_GRAPH_PATH)
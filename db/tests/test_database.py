@@ -1,17 +1,21 @@
 import unittest
 from datetime import datetime
 from unittest.mock import MagicMock, patch
+from pymongo.errors import PyMongoError
 from telegram import Chat, Message, User
 from db.database import (
     store_message_to_db,
     store_multiple_messages_to_db,
     get_multiple_messages_by_id,
+    get_score_threshold,
 )
+from db.database import MESSAGES_INDEX, _known_groups
 from db.db_types import AddMessageResult, SerializedMessage
 
 
 class TestDatabase(unittest.TestCase):
     def setUp(self) -> None:
+        _known_groups.clear()
         self.chat_id = 12345
         self.user = User(id=123, first_name="Test", is_bot=False)
         self.chat = Chat(id=self.chat_id, type="group", title="Test Group")
@@ -26,63 +30,66 @@ class TestDatabase(unittest.TestCase):
 
     @patch("db.database.db")
     def test_store_message_to_db_new(self, mock_db: MagicMock) -> None:
-        mock_db.active_groups.find_one.side_effect = [None, None]
-        mock_db.active_groups.insert_one.return_value = MagicMock()
-        mock_db.active_groups.update_one.return_value = MagicMock(
-            acknowledged=True, matched_count=1, modified_count=1
-        )
+        mock_db.messages.find_one_and_update.return_value = None
 
         result = store_message_to_db(self.chat_id, self.serialized_message)
         self.assertEqual(result, AddMessageResult.SUCCESS)
 
+    @patch("db.database.db")
+    def test_store_message_to_db_single_upsert(self, mock_db: MagicMock) -> None:
+        mock_db.messages.find_one_and_update.return_value = None
+
+        store_message_to_db(self.chat_id, self.serialized_message)
+
+        mock_db.messages.find_one_and_update.assert_called_once()
+        args, kwargs = mock_db.messages.find_one_and_update.call_args
+        self.assertEqual(args[0], {"chat_id": self.chat_id, "id": 1})
+        self.assertTrue(kwargs["upsert"])
+        mock_db.messages.find_one.assert_not_called()
+        mock_db.messages.insert_one.assert_not_called()
+
+    @patch("db.database.db")
+    def test_store_message_to_db_creates_group_once(self, mock_db: MagicMock) -> None:
+        mock_db.messages.find_one_and_update.return_value = None
+
+        store_message_to_db(self.chat_id, self.serialized_message)
+        store_message_to_db(self.chat_id, self.serialized_message)
+
+        mock_db.active_groups.update_one.assert_called_once()
+        _, kwargs = mock_db.active_groups.update_one.call_args
+        self.assertTrue(kwargs["upsert"])
+
     @patch("db.database.db")
     def test_store_message_to_db_existing(self, mock_db: MagicMock) -> None:
-        mock_db.active_groups.find_one.return_value = True
-        update_mock = MagicMock()
-        update_mock.modified_count = 0  # Explicitly set to an integer
-        mock_db.active_groups.update_one.return_value = update_mock
+        mock_db.messages.find_one_and_update.return_value = (
+            self.serialized_message.get_as_tmessage()
+        )
 
         result = store_message_to_db(self.chat_id, self.serialized_message)
         self.assertEqual(result, AddMessageResult.FAILURE)
 
     @patch("db.database.db")
     def test_store_message_to_db_failure(self, mock_db: MagicMock) -> None:
-        mock_db.active_groups.find_one.side_effect = [None, None]
-        mock_db.active_groups.insert_one.return_value = MagicMock()
-
-        # Set modified_count of the MagicMock object to an integer
-        update_mock = MagicMock(acknowledged=False)
-        update_mock.modified_count = 0  # Explicitly set to an integer
-        mock_db.active_groups.update_one.return_value = update_mock
+        mock_db.messages.find_one_and_update.side_effect = PyMongoError("down")
 
         result = store_message_to_db(self.chat_id, self.serialized_message)
         self.assertEqual(result, AddMessageResult.FAILURE)
 
     @patch("db.database.db")
     def test_store_message_to_db_new_group(self, mock_db: MagicMock) -> None:
-        mock_db.active_groups.find_one.return_value = None
-        mock_db.active_groups.insert_one.return_value = MagicMock()
-        mock_db.active_groups.update_one.return_value = MagicMock(
-            acknowledged=True, matched_count=1, modified_count=1
-        )
+        mock_db.messages.find_one_and_update.return_value = None
 
         result = store_message_to_db(self.chat_id, self.serialized_message)
         self.assertEqual(result, AddMessageResult.SUCCESS)
 
     @patch("db.database.db")
     def test_store_message_to_db_existing_message(self, mock_db: MagicMock) -> None:
-        mock_db.active_groups.find_one.return_value = {
-            "chat_id": self.chat_id,
-            "group_name": self.chat.title,
-            "categories": [],
-            "messages": {self.message.message_id: self.message.to_dict()},
-        }
-        update_mock = MagicMock()
-        update_mock.modified_count = 0  # Explicitly set to an integer
-        mock_db.active_groups.update_one.return_value = update_mock
+        previous = self.serialized_message.get_as_tmessage()
+        previous["text"] = "Original message"
+        mock_db.messages.find_one_and_update.return_value = previous
 
         result = store_message_to_db(self.chat_id, self.serialized_message)
-        self.assertEqual(result, AddMessageResult.FAILURE)
+        self.assertEqual(result, AddMessageResult.UPDATED)
 
 
 class TestStoreMessagesToDB(unittest.TestCase):
@@ -111,11 +118,72 @@ class TestStoreMessagesToDB(unittest.TestCase):
 
     @patch("db.database.db")
     def test_store_multiple_messages_to_db(self, mock_db: MagicMock) -> None:
-        mock_db.active_groups.find_one.side_effect = [None, None]
-        mock_db.active_groups.insert_one.return_value = MagicMock()
-        mock_db.active_groups.update_one.return_value = MagicMock(
-            acknowledged=True, matched_count=1, modified_count=1
-        )
-
         result = store_multiple_messages_to_db(self.chat_id, self.serialized_messages)
         self.assertEqual(result, AddMessageResult.SUCCESS)
+
+        mock_db.messages.bulk_write.assert_called_once()
+        (operations,), kwargs = mock_db.messages.bulk_write.call_args
+        self.assertEqual(len(operations), 2)
+        self.assertFalse(kwargs["ordered"])
+
+    @patch("db.database.db")
+    def test_store_multiple_messages_to_db_failure(self, mock_db: MagicMock) -> None:
+        mock_db.messages.bulk_write.side_effect = PyMongoError("down")
+
+        result = store_multiple_messages_to_db(self.chat_id, self.serialized_messages)
+        self.assertEqual(result, AddMessageResult.FAILURE)
+
+
+class TestGetMultipleMessagesById(unittest.TestCase):
+    @patch("db.database.db")
+    def test_indexed_lookup_of_requested_ids(self, mock_db: MagicMock) -> None:
+        cursor = mock_db.messages.find.return_value.hint.return_value
+        cursor.limit.return_value = iter([{"id": 2, "text": "hi"}])
+
+        result = get_multiple_messages_by_id(12345, ["2", "7"])
+
+        self.assertEqual(result, [{"id": 2, "text": "hi"}])
+        (query, projection), _ = mock_db.messages.find.call_args
+        self.assertEqual(query, {"chat_id": 12345, "id": {"$in": [2, 7]}})
+        self.assertEqual(
+            projection,
+            {
+                "_id": False,
+                "id": True,
+                "text": True,
+                "reply_to_message": True,
+                "date": True,
+            },
+        )
+        mock_db.messages.find.return_value.hint.assert_called_once_with(MESSAGES_INDEX)
+        cursor.limit.assert_called_once_with(2)
+        mock_db.active_groups.aggregate.assert_not_called()
+
+    @patch("db.database.db")
+    def test_keeps_requested_order(self, mock_db: MagicMock) -> None:
+        cursor = mock_db.messages.find.return_value.hint.return_value
+        cursor.limit.return_value = iter(
+            [{"id": 1, "text": "a"}, {"id": 2, "text": "b"}, {"id": 3, "text": "c"}]
+        )
+
+        result = get_multiple_messages_by_id(12345, ["3", "1", "2"])
+
+        self.assertEqual([msg["id"] for msg in result], [3, 1, 2])
+
+    @patch("db.database.db")
+    def test_no_ids_skips_the_query(self, mock_db: MagicMock) -> None:
+        self.assertEqual(get_multiple_messages_by_id(12345, []), [])
+        mock_db.messages.find.assert_not_called()
+
+
+class TestGetScoreThreshold(unittest.TestCase):
+    @patch("db.database.db")
+    def test_get_score_threshold(self, mock_db: MagicMock) -> None:
+        mock_db.active_groups.find_one.return_value = {"score_threshold": 0.8}
+        self.assertEqual(get_score_threshold(12345), 0.8)
+
+        mock_db.active_groups.find_one.return_value = {}
+        self.assertIsNone(get_score_threshold(12345))
+
+        mock_db.active_groups.find_one.side_effect = PyMongoError("down")
+        self.assertIsNone(get_score_threshold(12345))
@@ -110,3 +110,17 @@ class TestSerializedMessage(unittest.TestCase):
 
     def test_get_id(self) -> None:
         self.assertEqual(self.serialized_message.get_id(), self.message.message_id)
+
+    def test_from_exported_json_keeps_reply(self) -> None:
+        exported = {
+            "id": 2,
+            "date": "2021-09-07T14:40:00",
+            "from": "Test User",
+            "from_id": "user123",
+            "text": "Friday",
+            "reply_to_message_id": 1,
+        }
+        serialized = SerializedMessage.from_exported_json(
+            exported, 12345, "group", "Test Group"
+        )
+        self.assertEqual(serialized.reply_to_message, 1)
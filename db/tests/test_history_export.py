@@ -0,0 +1,73 @@
+import io
+import json
+import unittest
+from typing import Any
+from db.history_export import InvalidExportError, read_export
+
+
+def message(id: int, text: Any = "Test") -> dict[str, Any]:
+    return {
+        "id": id,
+        "date": "2021-09-07T14:40:00",
+        "from": "TestUser Lastname",
+        "from_id": "user12345",
+        "text": text,
+        "text_entities": [],
+    }
+
+
+class TestReadExport(unittest.TestCase):
+    def setUp(self) -> None:
+        self.export: dict[str, Any] = {
+            "name": "TestGroup",
+            "type": "private_group",
+            "id": 12349,
+            "messages": [message(i, f"message {i} é") for i in range(1, 51)],
+        }
+
+    def read(self, export: bytes, chunk_size: int = 7) -> list[Any]:
+        return list(read_export(io.BytesIO(export), chunk_size=chunk_size))
+
+    def test_messages_are_read_across_chunks(self) -> None:
+        for indent in (None, 1):
+            export = json.dumps(self.export, indent=indent, ensure_ascii=False)
+            messages = self.read(export.encode("utf-8"))
+
+            self.assertEqual([m.id for m in messages], list(range(1, 51)))
+            self.assertEqual(messages[-1].text, "message 50 é")
+            self.assertEqual(messages[0].chat_title, "TestGroup")
+
+    def test_messages_without_sender_or_text_are_skipped(self) -> None:
+        service = {"id": 2, "date": "2021-09-07T14:40:00", "action": "pin_message"}
+        self.export["messages"] = [message(1), service, message(3, "")]
+
+        messages = self.read(json.dumps(self.export).encode("utf-8"))
+
+        self.assertEqual([m.id for m in messages], [1])
+
+    def test_empty_chat(self) -> None:
+        self.export["messages"] = []
+        self.assertEqual(self.read(json.dumps(self.export).encode("utf-8")), [])
+
+    def test_invalid_exports(self) -> None:
+        export = json.dumps(self.export).encode("utf-8")
+        with self.assertRaises(InvalidExportError):
+            self.read(export[:-40])
+        with self.assertRaises(InvalidExportError):
+            self.read(b"not json")
+        with self.assertRaises(InvalidExportError):
+            self.read(json.dumps({"name": "TestGroup"}).encode("utf-8"))
+        with self.assertRaises(InvalidExportError):
+            del self.export["id"]
+            self.read(json.dumps(self.export).encode("utf-8"))
+
+    def test_long_values_are_rejected(self) -> None:
+        self.export["messages"] = [message(1, "x" * 1000)]
+        with self.assertRaises(InvalidExportError):
+            list(
+                read_export(
+                    io.BytesIO(json.dumps(self.export).encode("utf-8")),
+                    chunk_size=64,
+                    max_value_size=500,
+                )
+            )
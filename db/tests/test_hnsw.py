@@ -0,0 +1,157 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+import numpy as np
+import numpy.typing as npt
+from db.hnsw import HNSW, HNSWConfig
+from db.local_index import LocalIndex
+from db.vectordb import query
+
+
+def random_vectors(
+    count: int, dimension: int, seed: int = 0
+) -> npt.NDArray[np.float32]:
+    vectors = np.random.default_rng(seed).standard_normal(
+        (count, dimension), dtype=np.float32
+    )
+    normalized: npt.NDArray[np.float32] = vectors / np.linalg.norm(
+        vectors, axis=1, keepdims=True
+    )
+    return normalized
+
+
+class TestHNSW(unittest.TestCase):
+    def setUp(self) -> None:
+        self.vectors = random_vectors(1000, 16)
+        self.graph = HNSW(16, HNSWConfig(m=8, ef_construction=64), capacity=10)
+        self.graph.add(self.vectors, range(len(self.vectors)))
+
+    def test_finds_most_of_the_true_neighbours(self) -> None:
+        queries = random_vectors(20, 16, seed=1)
+        recall = []
+        for q in queries:
+            exact = set(np.argsort(-(self.vectors @ q))[:10].tolist())
+            found = {row for row, _ in self.graph.search(q, 10, ef=64)}
+            recall.append(len(exact & found) / 10)
+
+        self.assertGreater(np.mean(recall), 0.9)
+
+    def test_vector_in_the_graph_is_its_own_nearest(self) -> None:
+        row, similarity = self.graph.search(self.vectors[123], 1)[0]
+
+        self.assertEqual(row, 123)
+        self.assertAlmostEqual(similarity, 1.0, places=5)
+
+    def test_overwritten_vector_moves_in_the_graph(self) -> None:
+        self.graph.add(self.vectors[[7]], [123])
+
+        self.assertEqual(self.graph.count, 1000)
+        found = {row for row, _ in self.graph.search(self.vectors[7], 2)}
+        self.assertEqual(found, {7, 123})
+        self.assertNotEqual(self.graph.search(self.vectors[123], 1)[0][0], 123)
+
+    def test_save_and_load(self) -> None:
+        with tempfile.TemporaryDirectory() as path:
+            self.graph.save(os.path.join(path, "graph.bin"))
+            loaded = HNSW.load(os.path.join(path, "graph.bin"), 16, self.graph.config)
+
+        q = random_vectors(1, 16, seed=2)[0]
+        self.assertEqual(loaded.search(q, 5), self.graph.search(q, 5))
+
+
+class TestLocalIndexGraph(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.vectors = random_vectors(120, 8)
+        self.config = HNSWConfig(m=4, ef_construction=32, min_vectors=100)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def upsert(self, index: LocalIndex, rows: range) -> None:
+        index.upsert(
+            vectors=[
+                {
+                    "id": f"1:{i}",
+                    "values": self.vectors[i].tolist(),
+                    "metadata": {"chat_id": 1},
+                }
+                for i in rows
+            ]
+        )
+
+    def test_graph_is_built_once_the_chat_is_large_enough(self) -> None:
+        index = LocalIndex(self.tmp_dir.name, dimension=8, hnsw=self.config)
+        self.upsert(index, range(99))
+        self.assertIsNone(index._chat(1).graph)
+
+        self.upsert(index, range(99, 120))
+        index.wait_for_graphs()
+        graph = index._chat(1).graph
+        assert graph is not None
+        self.assertEqual(graph.count, 120)
+        results = query(1, self.vectors[110].tolist(), top_k=1, index=index)
+        self.assertEqual(results["matches"][0]["id"], "1:110")
+
+    def test_graph_catches_up_when_the_chat_is_loaded(self) -> None:
+        index = LocalIndex(self.tmp_dir.name, dimension=8, hnsw=self.config)
+        self.upsert(index, range(100))
+        index.wait_for_graphs()
+        index._chat(1).graph.save(index._chat(1).graph_path)  # type: ignore
+        self.upsert(index, range(100, 120))
+
+        reopened = LocalIndex(self.tmp_dir.name, dimension=8, hnsw=self.config)
+        reopened._chat(1)
+        reopened.wait_for_graphs()
+        graph = reopened._chat(1).graph
+        assert graph is not None
+        self.assertEqual(graph.count, 120)
+        results = query(1, self.vectors[115].tolist(), top_k=1, index=reopened)
+        self.assertEqual(results["matches"][0]["id"], "1:115")
+
+    def test_chat_is_searched_exactly_while_its_graph_is_built(self) -> None:
+        index = LocalIndex(self.tmp_dir.name, dimension=8, hnsw=self.config)
+        release = threading.Event()
+        add = HNSW.add
+
+        def blocked_add(
+            graph: HNSW, vectors: npt.NDArray[np.float32], rows: list[int]
+        ) -> None:
+            release.wait(timeout=5)
+            add(graph, vectors, rows)
+
+        with patch.object(HNSW, "add", blocked_add):
+            try:
+                self.upsert(index, range(120))
+                self.assertIsNone(index._chat(1).graph)
+                results = query(1, self.vectors[110].tolist(), top_k=1, index=index)
+                self.assertEqual(results["matches"][0]["id"], "1:110")
+            finally:
+                release.set()
+            index.wait_for_graphs()
+
+        graph = index._chat(1).graph
+        assert graph is not None
+        self.assertEqual(graph.count, 120)
+
+    def test_edited_vector_moves_in_the_graph(self) -> None:
+        index = LocalIndex(self.tmp_dir.name, dimension=8, hnsw=self.config)
+        self.upsert(index, range(120))
+        index.wait_for_graphs()
+        index.upsert(
+            vectors=[
+                {
+                    "id": "1:3",
+                    "values": self.vectors[110].tolist(),
+                    "metadata": {"chat_id": 1},
+                }
+            ]
+        )
+        index.wait_for_graphs()
+
+        results = query(1, self.vectors[110].tolist(), top_k=2, index=index)
+        self.assertEqual(
+            {match["id"] for match in results["matches"]}, {"1:3", "1:110"}
+        )
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+from db.import_ledger import ImportLedger
+
+
+class TestImportLedger(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "ledger.sqlite3")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_only_unrecorded_messages_are_missing(self) -> None:
+        ledger = ImportLedger()
+        ledger.record(12345, range(0, 1200, 2))
+
+        missing = ledger.missing(12345, list(range(1200)))
+
+        self.assertEqual(missing, list(range(1, 1200, 2)))
+        self.assertEqual(ledger.missing(67890, [0, 2]), [0, 2])
+
+    def test_recording_twice_is_harmless(self) -> None:
+        ledger = ImportLedger()
+        ledger.record(12345, [1, 2])
+        ledger.record(12345, [2, 3])
+
+        self.assertEqual(ledger.missing(12345, [1, 2, 3, 4]), [4])
+
+    def test_ledger_is_kept_on_disk(self) -> None:
+        ImportLedger(self.path).record(12345, [1])
+
+        self.assertEqual(ImportLedger(self.path).missing(12345, [1, 2]), [2])
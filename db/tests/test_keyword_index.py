@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from db.keyword_index import KeywordIndex, reciprocal_rank_fusion, tokenize
+
+
+class TestKeywordIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "keywords.sqlite3")
+        self.index = KeywordIndex()
+        self.index.add_many(
+            12345,
+            [
+                (1, "The CS110 session moved to room B2.14"),
+                (2, "Does anyone know when the session starts?"),
+                (3, "The assignment deadline is Friday"),
+            ],
+        )
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_tokenize_keeps_codes_together(self) -> None:
+        self.assertEqual(tokenize("Room B2.14, CS-110!"), ["room", "b2.14", "cs-110"])
+
+    def test_exact_token_ranks_first(self) -> None:
+        self.assertEqual(self.index.search(12345, "Which room is CS110 in?")[0], 1)
+        self.assertEqual(self.index.search(12345, "session", top_k=1), [2])
+
+    def test_rare_terms_weigh_more(self) -> None:
+        (first, first_score), (_, second_score), *_ = self.index.scores(
+            12345, "the session deadline"
+        )
+        self.assertEqual(first, 3)
+        self.assertGreater(first_score, second_score)
+
+    def test_stopwords_are_ignored(self) -> None:
+        self.assertEqual(self.index.search(12345, "When is the"), [])
+
+    def test_weak_matches_are_left_out(self) -> None:
+        ((_, score),) = self.index.scores(12345, "deadline")
+
+        self.assertEqual(self.index.search(12345, "deadline", min_score=score), [3])
+        self.assertEqual(self.index.search(12345, "deadline", min_score=score + 1), [])
+
+    def test_chats_are_separate(self) -> None:
+        self.assertEqual(self.index.search(67890, "CS110"), [])
+
+    def test_edited_message_replaces_old_text(self) -> None:
+        self.index.add(12345, 3, "The assignment deadline is Monday")
+
+        self.assertEqual(self.index.search(12345, "friday"), [])
+        self.assertEqual(self.index.search(12345, "monday"), [3])
+
+    def test_index_is_rebuilt_from_disk(self) -> None:
+        KeywordIndex(path=self.path).add(12345, 7, "Lunch is in the Tower")
+
+        self.assertEqual(KeywordIndex(path=self.path).search(12345, "tower"), [7])
+
+
+class TestReciprocalRankFusion(unittest.TestCase):
+    def test_ids_in_both_rankings_come_first(self) -> None:
+        fused = reciprocal_rank_fusion([["1", "2", "3"], ["4", "3"]])
+        self.assertEqual(fused[0], "3")
+        self.assertEqual(set(fused), {"1", "2", "3", "4"})
+
+    def test_ties_keep_the_order_of_the_rankings(self) -> None:
+        self.assertEqual(reciprocal_rank_fusion([["1"], ["2"]]), ["1", "2"])
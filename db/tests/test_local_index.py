@@ -0,0 +1,87 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+from db.db_types import PCEmbeddingData
+from db.local_index import LocalIndex
+from db.vectordb import delete_chat_vectors, query, upload_vectors
+
+
+def vector(id: str, values: list[float], chat_id: int = 12345) -> PCEmbeddingData:
+    return {"id": id, "values": values, "metadata": {"chat_id": chat_id}}
+
+
+class TestLocalIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index = LocalIndex(self.tmp_dir.name, dimension=2)
+        self.index.upsert(
+            vectors=[
+                vector("12345:1", [1.0, 0.0]),
+                vector("12345:2", [0.0, 1.0]),
+                vector("12345:3", [1.0, 1.0]),
+                vector("67890:1", [1.0, 0.0], chat_id=67890),
+            ]
+        )
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_most_similar_first(self) -> None:
+        results = query(12345, [2.0, 0.1], top_k=2, index=self.index)
+
+        self.assertEqual([m["id"] for m in results["matches"]], ["12345:1", "12345:3"])
+        self.assertGreater(results["matches"][0]["score"], 0.99)
+
+    def test_only_the_chat_is_searched(self) -> None:
+        results = query(67890, [0.0, 1.0], top_k=5, index=self.index)
+
+        self.assertEqual([m["id"] for m in results["matches"]], ["67890:1"])
+
+    def test_upsert_overwrites_existing_id(self) -> None:
+        upload_vectors([vector("12345:1", [0.0, 1.0])], self.index)
+
+        results = query(12345, [0.0, 1.0], top_k=5, index=self.index)
+        self.assertEqual(len(results["matches"]), 3)
+        self.assertAlmostEqual(results["matches"][1]["score"], 1.0, places=5)
+
+    def test_metadata_is_returned_on_request(self) -> None:
+        results = self.index.query(
+            vector=[1.0, 0.0],
+            top_k=1,
+            namespace="12345",
+            include_metadata=True,
+        )
+        self.assertEqual(results["matches"][0]["metadata"], {"chat_id": 12345})
+
+    def test_chat_filter_is_supported(self) -> None:
+        results = self.index.query(
+            vector=[0.0, 1.0], top_k=1, filter={"chat_id": {"$eq": 12345}}
+        )
+        self.assertEqual(results["matches"][0]["id"], "12345:2")
+
+    def test_delete_chat_vectors(self) -> None:
+        delete_chat_vectors(12345, self.index)
+
+        self.assertEqual(
+            query(12345, [1.0, 0.0], top_k=5, index=self.index)["matches"], []
+        )
+        self.assertEqual(
+            len(query(67890, [1.0, 0.0], top_k=5, index=self.index)["matches"]), 1
+        )
+        reopened = LocalIndex(self.tmp_dir.name, dimension=2)
+        self.assertEqual(
+            query(12345, [1.0, 0.0], top_k=5, index=reopened)["matches"], []
+        )
+
+    @patch("db.local_index.INITIAL_CAPACITY", 2)
+    def test_matrix_grows_and_survives_restarts(self) -> None:
+        index = LocalIndex(self.tmp_dir.name + "/grown", dimension=2)
+        index.upsert(
+            vectors=[vector(f"1:{i}", [1.0, float(i)], chat_id=1) for i in range(5)]
+        )
+
+        reopened = LocalIndex(self.tmp_dir.name + "/grown", dimension=2)
+        results = query(1, [0.0, 1.0], top_k=1, index=reopened)
+        self.assertEqual(results["matches"][0]["id"], "1:4")
+        results = query(1, [1.0, 0.0], top_k=5, index=reopened)
+        self.assertEqual(len(results["matches"]), 5)
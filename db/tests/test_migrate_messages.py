@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from db.migrate_messages import migrate, migrate_group
+
+
+class TestMigrateMessages(unittest.TestCase):
+    def setUp(self) -> None:
+        self.group = {
+            "_id": "group-1",
+            "chat_id": 12345,
+            "messages": {
+                "1": {"id": 1, "text": "first"},
+                "2": {"id": 2, "text": "second"},
+                "3": {"id": 3, "text": "third"},
+            },
+        }
+
+    @patch("db.migrate_messages.db")
+    def test_migrate_group_in_batches(self, mock_db: MagicMock) -> None:
+        copied = migrate_group(self.group, batch_size=2)
+
+        self.assertEqual(copied, 3)
+        self.assertEqual(mock_db.messages.bulk_write.call_count, 2)
+        (operations,), kwargs = mock_db.messages.bulk_write.call_args_list[0]
+        self.assertEqual(len(operations), 2)
+        self.assertEqual(operations[0]._filter, {"chat_id": 12345, "id": 1})
+        self.assertFalse(kwargs["ordered"])
+
+    @patch("db.migrate_messages.ensure_indexes")
+    @patch("db.migrate_messages.db")
+    def test_migrate_streams_groups_and_unsets(
+        self, mock_db: MagicMock, mock_ensure_indexes: MagicMock
+    ) -> None:
+        mock_db.active_groups.find.return_value = iter([self.group])
+
+        total = migrate(unset=True)
+
+        self.assertEqual(total, 3)
+        mock_ensure_indexes.assert_called_once()
+        _, kwargs = mock_db.active_groups.find.call_args
+        self.assertEqual(kwargs["batch_size"], 1)
+        mock_db.active_groups.update_one.assert_called_once_with(
+            {"_id": "group-1"}, {"$unset": {"messages": ""}}
+        )
+
+    @patch("db.migrate_messages.ensure_indexes")
+    @patch("db.migrate_messages.db")
+    def test_migrate_keeps_legacy_map_by_default(
+        self, mock_db: MagicMock, mock_ensure_indexes: MagicMock
+    ) -> None:
+        mock_db.active_groups.find.return_value = iter([self.group])
+
+        migrate()
+
+        mock_db.active_groups.update_one.assert_not_called()
@@ -0,0 +1,66 @@
+import unittest
+from typing import Any, Iterator
+from unittest.mock import MagicMock, patch
+from db.migrate_namespaces import migrate, migrate_batch
+
+
+class TestMigrateNamespaces(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = MagicMock()
+        self.index.fetch.side_effect = lambda ids: MagicMock(
+            to_dict=lambda: {
+                "vectors": {
+                    id: {"id": id, "values": [0.1], "metadata": {"chat_id": 1}}
+                    # the second message of every chat has no vector
+                    for id in ids
+                    if not id.endswith(":2")
+                }
+            }
+        )
+
+    def test_migrate_batch_copies_fetched_vectors(self) -> None:
+        copied = migrate_batch(self.index, 1, ["1:1", "1:2", "1:3"], delete=True)
+
+        self.assertEqual(copied, 2)
+        _, kwargs = self.index.upsert.call_args
+        self.assertEqual(kwargs["namespace"], "1")
+        self.assertEqual([v["id"] for v in kwargs["vectors"]], ["1:1", "1:3"])
+        self.index.delete.assert_called_once_with(ids=["1:1", "1:3"])
+
+    @patch("db.migrate_namespaces.db")
+    def test_migrate_batches_messages_per_chat(self, mock_db: MagicMock) -> None:
+        messages = [{"chat_id": 1, "id": i} for i in range(1, 4)]
+        messages += [{"chat_id": 2, "id": i} for i in range(1, 3)]
+        mock_db.messages.find.return_value.sort.return_value = iter(messages)
+
+        total = migrate(self.index, batch_size=2, workers=2)
+
+        self.assertEqual(total, 3)
+        fetched = sorted(call.kwargs["ids"] for call in self.index.fetch.call_args_list)
+        self.assertEqual(fetched, [["1:1", "1:2"], ["1:3"], ["2:1", "2:2"]])
+        self.index.delete.assert_not_called()
+
+    @patch("db.migrate_namespaces.db")
+    def test_migrate_bounds_the_batches_in_flight(self, mock_db: MagicMock) -> None:
+        read: list[int] = []
+
+        def messages() -> Iterator[dict[str, int]]:
+            for i in range(1, 21):
+                read.append(i)
+                yield {"chat_id": i, "id": 1}
+
+        mock_db.messages.find.return_value.sort.return_value = messages()
+        # the number of messages read when each batch was migrated
+        read_when_migrated: list[int] = []
+
+        def migrate_batch(*args: Any) -> int:
+            read_when_migrated.append(len(read))
+            return 1
+
+        with patch("db.migrate_namespaces.migrate_batch", migrate_batch):
+            total = migrate(self.index, batch_size=1, workers=1)
+
+        self.assertEqual(total, 20)
+        # two batches in flight, the next one read and one read ahead
+        for migrated, read_count in enumerate(read_when_migrated):
+            self.assertLessEqual(read_count, migrated + 4)
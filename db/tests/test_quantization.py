@@ -0,0 +1,140 @@
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+import numpy as np
+import numpy.typing as npt
+from db.local_index import LocalIndex
+from db.quantization import (
+    Float16Quantizer,
+    Int8Quantizer,
+    ProductQuantizer,
+    Quantizer,
+    make_quantizer,
+)
+from db.vectordb import query
+
+
+def unit_vectors(count: int, dimension: int, seed: int = 0) -> npt.NDArray[np.float32]:
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dimension), dtype=np.float32)
+    normalized: npt.NDArray[np.float32] = vectors / np.linalg.norm(
+        vectors, axis=1, keepdims=True
+    )
+    return normalized
+
+
+class TestQuantizers(unittest.TestCase):
+    def setUp(self) -> None:
+        self.vectors = unit_vectors(1024, 16)
+        self.query = self.vectors[0]
+        self.exact = self.vectors @ self.query
+
+    def assert_approximates(self, quantizer: Quantizer, correlation: float) -> None:
+        quantizer.fit(self.vectors)
+        codes = quantizer.encode(self.vectors)
+        scores = quantizer.scores(self.query, codes)
+
+        self.assertEqual(scores.shape, self.exact.shape)
+        self.assertGreater(np.corrcoef(scores, self.exact)[0, 1], correlation)
+        self.assertEqual(int(np.argmax(scores)), 0)
+
+    def test_float16(self) -> None:
+        self.assert_approximates(Float16Quantizer(16), 0.999)
+
+    def test_int8(self) -> None:
+        quantizer = Int8Quantizer(16)
+        self.assert_approximates(quantizer, 0.99)
+        self.assertEqual(quantizer.encode(self.vectors).nbytes, 1024 * 16)
+
+    def test_product_quantization(self) -> None:
+        quantizer = ProductQuantizer(16)
+        self.assert_approximates(quantizer, 0.9)
+        self.assertEqual(quantizer.encode(self.vectors).shape, (1024, 4))
+
+    def test_subspaces_must_divide_dimensions(self) -> None:
+        with self.assertRaises(ValueError):
+            ProductQuantizer(16, subspaces=5)
+
+    def test_unknown_quantization(self) -> None:
+        self.assertIsNone(make_quantizer("none", 16))
+        with self.assertRaises(ValueError):
+            make_quantizer("int4", 16)
+
+
+class TestQuantizedLocalIndex(unittest.TestCase):
+    def test_reranked_matches_equal_exact_matches(self) -> None:
+        vectors = unit_vectors(1200, 16)
+        question = unit_vectors(1, 16, seed=1)[0].tolist()
+        results = {}
+        with tempfile.TemporaryDirectory() as path:
+            for quantization in ["none", "int8", "pq"]:
+                index = LocalIndex(
+                    f"{path}/{quantization}", dimension=16, quantization=quantization
+                )
+                index.upsert(
+                    vectors=[
+                        {
+                            "id": f"1:{i}",
+                            "values": vector.tolist(),
+                            "metadata": {"chat_id": 1},
+                        }
+                        for i, vector in enumerate(vectors)
+                    ]
+                )
+                index.wait_for_codes()
+                matches = query(1, question, top_k=3, index=index)["matches"]
+                results[quantization] = [match["id"] for match in matches]
+
+        self.assertEqual(results["int8"], results["none"])
+        self.assertEqual(results["pq"], results["none"])
+
+    def test_chat_is_searched_exactly_while_its_quantizer_is_fitted(self) -> None:
+        vectors = unit_vectors(1200, 16)
+        release = threading.Event()
+        fit = ProductQuantizer.fit
+
+        def blocked_fit(
+            quantizer: ProductQuantizer, fitted: npt.NDArray[np.float32]
+        ) -> None:
+            release.wait(timeout=5)
+            fit(quantizer, fitted)
+
+        with tempfile.TemporaryDirectory() as path:
+            index = LocalIndex(path, dimension=16, quantization="pq")
+            with patch.object(ProductQuantizer, "fit", blocked_fit):
+                try:
+                    index.upsert(
+                        vectors=[
+                            {
+                                "id": f"1:{i}",
+                                "values": vector.tolist(),
+                                "metadata": {"chat_id": 1},
+                            }
+                            for i, vector in enumerate(vectors)
+                        ]
+                    )
+                    self.assertIsNone(index._chat(1).quantized)
+                    # overwritten while the quantizer is fitted
+                    index.upsert(
+                        vectors=[
+                            {
+                                "id": "1:5",
+                                "values": vectors[700].tolist(),
+                                "metadata": {"chat_id": 1},
+                            }
+                        ]
+                    )
+                    matches = query(1, vectors[1100].tolist(), top_k=1, index=index)
+                    self.assertEqual(matches["matches"][0]["id"], "1:1100")
+                finally:
+                    release.set()
+                index.wait_for_codes()
+
+            chat = index._chat(1)
+            assert chat.quantized is not None
+            quantizer, codes = chat.quantized
+            self.assertEqual(chat.fitted_count, 1200)
+            np.testing.assert_array_equal(
+                codes[5], quantizer.encode(vectors[700][None])[0]
+            )
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+from db.reply_graph import ReplyGraph
+
+
+class TestReplyGraph(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "replies.sqlite3")
+        self.graph = ReplyGraph()
+        # 1 <- 2 <- 3, and 4, 5, 6 all reply to 1
+        self.graph.add_many(12345, [(1, None), (2, 1), (3, 2), (6, 1), (4, 1), (5, 1)])
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_parents_come_before_replies(self) -> None:
+        self.assertEqual(self.graph.context(12345, [2]), [1, 3])
+
+    def test_first_replies_are_taken(self) -> None:
+        self.assertEqual(self.graph.context(12345, [1], max_replies=2), [2, 4])
+
+    def test_messages_are_not_repeated(self) -> None:
+        self.assertEqual(self.graph.context(12345, [1, 2]), [4, 3])
+
+    def test_chats_are_separate(self) -> None:
+        self.assertEqual(self.graph.context(67890, [2]), [])
+
+    def test_graph_is_loaded_from_disk(self) -> None:
+        ReplyGraph(path=self.path).add(12345, 8, 7)
+
+        self.assertEqual(ReplyGraph(path=self.path).context(12345, [7]), [8])
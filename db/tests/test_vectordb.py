@@ -1,11 +1,16 @@
+import os
+import time
 import unittest
+from datetime import datetime, timezone
 from unittest.mock import patch, MagicMock
 from db.vectordb import (
     batch_upload_vectors,
     upload_vectors,
     query,
     delete,
+    delete_chat_vectors,
     init_pinecone,
+    message_embedding,
 )
 from db.db_types import PCEmbeddingData, PCEmbeddingMetadata, PCQueryResults
 
@@ -23,7 +28,23 @@ class TestVectorDB(unittest.TestCase):
         mock_index.upsert = MagicMock()
 
         upload_vectors(mock_embeddings, mock_index)
-        mock_index.upsert.assert_called_once_with(vectors=mock_embeddings)
+        mock_index.upsert.assert_called_once_with(
+            vectors=mock_embeddings, namespace="12345"
+        )
+
+    def test_upload_vectors_of_several_chats(self) -> None:
+        mock_embeddings: list[PCEmbeddingData] = [
+            PCEmbeddingData(id="1:1", values=[0.1], metadata={"chat_id": 1}),
+            PCEmbeddingData(id="2:1", values=[0.2], metadata={"chat_id": 2}),
+            PCEmbeddingData(id="1:2", values=[0.3], metadata={"chat_id": 1}),
+        ]
+        mock_index = MagicMock()
+
+        upload_vectors(mock_embeddings, mock_index)
+        mock_index.upsert.assert_any_call(
+            vectors=[mock_embeddings[0], mock_embeddings[2]], namespace="1"
+        )
+        mock_index.upsert.assert_any_call(vectors=[mock_embeddings[1]], namespace="2")
 
     @patch("db.vectordb.init_pinecone", return_value=MagicMock())
     @patch("db.vectordb.upload_vectors")
@@ -52,9 +73,75 @@ class TestVectorDB(unittest.TestCase):
         self.assertIsInstance(result, dict)
         self.assertEqual(result, mock_response)
         mock_index.query.assert_called_once_with(
-            vector=[0.1, 0.2], top_k=5, filter={"chat_id": {"$eq": 12345}}
+            vector=[0.1, 0.2], top_k=5, namespace="12345"
+        )
+
+    def test_query_with_metadata(self) -> None:
+        mock_index = MagicMock()
+
+        query(12345, [0.1, 0.2], 5, mock_index, include_metadata=True)
+        mock_index.query.assert_called_once_with(
+            vector=[0.1, 0.2], top_k=5, namespace="12345", include_metadata=True
+        )
+
+    @patch("db.vectordb.LEGACY_NAMESPACE", True)
+    def test_query_merges_the_legacy_namespace(self) -> None:
+        mock_index = MagicMock()
+        mock_index.query.side_effect = [
+            {"matches": [{"id": "12345:1", "score": 0.8}], "namespace": "12345"},
+            {
+                "matches": [
+                    {"id": "12345:2", "score": 0.9},
+                    {"id": "12345:1", "score": 0.8},
+                    {"id": "12345:3", "score": 0.7},
+                ],
+                "namespace": "",
+            },
+        ]
+
+        result = query(12345, [0.1, 0.2], 2, mock_index)
+
+        self.assertEqual([m["id"] for m in result["matches"]], ["12345:2", "12345:1"])
+        mock_index.query.assert_called_with(
+            vector=[0.1, 0.2], top_k=2, filter={"chat_id": {"$eq": 12345}}
+        )
+
+    @patch("db.vectordb.METADATA_TEXT_LENGTH", 5)
+    def test_message_embedding(self) -> None:
+        date = datetime(2023, 10, 1, tzinfo=timezone.utc)
+
+        embedding = message_embedding(12345, 7, [0.1], "Due on Friday", date)
+
+        self.assertEqual(embedding["id"], "12345:7")
+        self.assertEqual(
+            embedding["metadata"],
+            {"chat_id": 12345, "text": "Due o", "date": 1696118400},
         )
 
+    def test_naive_message_date_is_read_as_utc(self) -> None:
+        try:
+            with patch.dict(os.environ, {"TZ": "America/New_York"}):
+                time.tzset()
+                embedding = message_embedding(
+                    12345, 7, [0.1], date=datetime(2023, 10, 1)
+                )
+        finally:
+            time.tzset()
+
+        self.assertEqual(embedding["metadata"]["date"], 1696118400)
+
+    @patch("db.vectordb.METADATA_TEXT", False)
+    def test_message_embedding_without_text(self) -> None:
+        embedding = message_embedding(12345, 7, [0.1], "Due on Friday", reply_to=6)
+
+        self.assertEqual(embedding["metadata"], {"chat_id": 12345})
+
+    def test_delete_chat_vectors(self) -> None:
+        mock_index = MagicMock()
+
+        delete_chat_vectors(12345, mock_index)
+        mock_index.delete.assert_called_once_with(delete_all=True, namespace="12345")
+
     @patch("db.vectordb.pinecone")
     def test_delete(self, mock_pinecone: MagicMock) -> None:
         delete("test_index")
@@ -1,9 +1,23 @@
 import os
 import pinecone
-from typing import Sequence, cast, Optional
+from datetime import datetime, timezone
+from typing import Any, Sequence, cast, Optional
 from math import ceil
 
-from .db_types import PCEmbeddingData, PCQueryResults
+from .db_types import PCEmbeddingData, PCEmbeddingMetadata, PCQueryResults
+from .hnsw import HNSWConfig
+from .local_index import LocalIndex
+
+# "pinecone", or "local" to search an in-process index instead
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+# Store the start of every message with its vector, so questions are answered
+# from the query results without fetching the messages from MongoDB
+METADATA_TEXT = os.getenv("VECTOR_METADATA_TEXT", "true").lower() == "true"
+# Characters of a message kept in its vector metadata
+METADATA_TEXT_LENGTH = int(os.getenv("VECTOR_METADATA_TEXT_LENGTH", 2000))
+# Also query the default namespace, where vectors uploaded before namespaces
+# sit until db.migrate_namespaces has moved them
+LEGACY_NAMESPACE = os.getenv("VECTOR_LEGACY_NAMESPACE", "false").lower() == "true"
 
 
 def init_pinecone() -> Optional[pinecone.Index]:
@@ -16,15 +30,87 @@ def init_pinecone() -> Optional[pinecone.Index]:
     return pinecone.Index(pinecone.list_indexes()[0])
 
 
-embedding_index = None
+def init_local_index() -> LocalIndex:
+    # smaller chats are searched faster by scoring every vector, 0 turns graphs off
+    min_vectors = int(os.getenv("HNSW_MIN_VECTORS", 20000))
+    return LocalIndex(
+        os.getenv("LOCAL_INDEX_PATH", "vector_index"),
+        quantization=os.getenv("VECTOR_QUANTIZATION", "none"),
+        hnsw=HNSWConfig(
+            m=int(os.getenv("HNSW_M", 32)),
+            ef_construction=int(os.getenv("HNSW_EF_CONSTRUCTION", 200)),
+            ef_search=int(os.getenv("HNSW_EF_SEARCH", 384)),
+            min_vectors=min_vectors,
+        )
+        if min_vectors
+        else None,
+    )
+
+
+def chat_namespace(chat_id: int) -> str:
+    """
+    Returns the namespace holding the vectors of a chat. Every chat has its
+    own, so a query only reads the chat's vectors and deleting them is one call.
+    """
+    return str(chat_id)
+
+
+def message_embedding(
+    chat_id: int,
+    message_id: int,
+    embedding: list[float],
+    text: str | None = None,
+    date: datetime | None = None,
+    reply_to: int | None = None,
+) -> PCEmbeddingData:
+    """
+    Builds the vector of a message, with its text, date and the message it
+    replies to in the metadata when METADATA_TEXT is set.
+    ---
+    Parameters
+        chat_id: int
+                The chat the message was sent in.
+        message_id: int
+                The Telegram id of the message.
+        embedding: list[float]
+                The embedding of the message text.
+        text: str | None
+                The message text, truncated to METADATA_TEXT_LENGTH characters.
+        date: datetime | None
+                When the message was sent, in UTC if it has no time zone.
+        reply_to: int | None
+                The id of the message it replies to.
+    Returns
+        embedding_data: PCEmbeddingData
+                The vector to upload.
+    """
+    metadata: PCEmbeddingMetadata = {"chat_id": chat_id}
+    if METADATA_TEXT:
+        # Pinecone rejects null metadata values, missing ones are left out
+        if text is not None:
+            metadata["text"] = text[:METADATA_TEXT_LENGTH]
+        if date is not None:
+            # naive dates, as in history exports, would be read in the
+            # server's time zone
+            if date.tzinfo is None:
+                date = date.replace(tzinfo=timezone.utc)
+            metadata["date"] = int(date.timestamp())
+        if reply_to is not None:
+            metadata["reply_to"] = reply_to
+    return {"id": f"{chat_id}:{message_id}", "values": embedding, "metadata": metadata}
+
+
+embedding_index: pinecone.Index | LocalIndex | None = None
 # Use init_pinecone only when necessary and not in a test environment
 if os.getenv("ENVIRONMENT") != "TEST":
-    embedding_index = init_pinecone()
+    embedding_index = (
+        init_local_index() if VECTOR_BACKEND == "local" else init_pinecone()
+    )
 
 
 def batch_upload_vectors(
     all_embeddings: Sequence[PCEmbeddingData],
-    index: pinecone.Index | None = embedding_index,
+    index: pinecone.Index | LocalIndex | None = embedding_index,
 ) -> None:
     """
     Takes in a very large list of embedding data, breaks this into batches of maximum size 100
@@ -34,8 +120,8 @@ def batch_upload_vectors(
     ----------
     all_embeddings : Sequence[PCEmbeddingData]
             The list of all message embeddings to upload to the Pinecone index.
-    index : pinecone.Index
-            The Pinecone index to upload the vectors to.
+    index : pinecone.Index | LocalIndex
+            The Pinecone or local index to upload the vectors to.
     """
     if index is None:
         return
@@ -54,38 +140,86 @@ def batch_upload_vectors(
 
 def upload_vectors(
     message_embeddings: Sequence[PCEmbeddingData],
-    index: pinecone.Index | None = embedding_index,
+    index: pinecone.Index | LocalIndex | None = embedding_index,
 ) -> None:
     """
-    Uploads a list of message embeddings to the Pinecone index.
+    Uploads a list of message embeddings to the Pinecone index,
+    into the namespace of the chat in their metadata.
     Max recommended length of message_embeddings is 100.
     Parameters
     ----------
-    index : pinecone.Index
-                The Pinecone index to upload the vectors to.
+    index : pinecone.Index | LocalIndex
+                The Pinecone or local index to upload the vectors to.
     message_embeddings : Sequence[PCEmbeddingData]
                 The list of message embeddings to upload to the Pinecone index. Each element is of the form
                 {"id": <string>, "values": <list[float]>, "metadata": <dict[str, Any]>}.
     """
-    return index.upsert(vectors=message_embeddings)  # type: ignore
+    if index is None:
+        return
+    namespaces: dict[str, list[PCEmbeddingData]] = {}
+    for embedding in message_embeddings:
+        namespace = chat_namespace(embedding["metadata"]["chat_id"])
+        namespaces.setdefault(namespace, []).append(embedding)
+    for namespace, embeddings in namespaces.items():
+        index.upsert(vectors=embeddings, namespace=namespace)
 
 
 def query(
     chat_id: int,
     query_vector: list[float],
     top_k: int = 5,
-    index: pinecone.Index | None = embedding_index,
+    index: pinecone.Index | LocalIndex | None = embedding_index,
+    request_timeout: float | None = None,
+    include_metadata: bool = False,
 ) -> PCQueryResults:
-    """Queries the Pinecone index with a query vector."""
+    """
+    Queries the namespace of a chat with a query vector, returning the
+    metadata of the matches if include_metadata is set. With
+    LEGACY_NAMESPACE, the chat's vectors in the default namespace are
+    queried too and the best top_k matches of both are returned.
+    """
     if index is None:
         return {"matches": [], "namespace": ""}
+    # only passed when set, the client applies its own default otherwise
+    options: dict[str, Any] = (
+        {} if request_timeout is None else {"_request_timeout": request_timeout}
+    )
+    if include_metadata:
+        options["include_metadata"] = True
     res = index.query(
-        vector=query_vector, top_k=top_k, filter={"chat_id": {"$eq": chat_id}}
+        vector=query_vector,
+        top_k=top_k,
+        namespace=chat_namespace(chat_id),
+        **options,
     )
     results = cast(PCQueryResults, res)
+    if LEGACY_NAMESPACE:
+        legacy = cast(
+            PCQueryResults,
+            index.query(
+                vector=query_vector,
+                top_k=top_k,
+                filter={"chat_id": {"$eq": chat_id}},
+                **options,
+            ),
+        )
+        # a vector already copied over is in both namespaces
+        matches = {m["id"]: m for m in [*legacy["matches"], *results["matches"]]}
+        best = sorted(matches.values(), key=lambda m: m["score"], reverse=True)
+        results = {"matches": best[:top_k], "namespace": results["namespace"]}
     return results
 
 
+def delete_chat_vectors(
+    chat_id: int,
+    index: pinecone.Index | LocalIndex | None = embedding_index,
+) -> None:
+    """Deletes every vector of a chat by dropping its namespace."""
+    if index is None:
+        return
+    index.delete(delete_all=True, namespace=chat_namespace(chat_id))
+
+
 def delete(index_name: str) -> None:
     """Deletes the Pinecone index."""
     pinecone.delete_index(name=index_name)
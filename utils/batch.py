@@ -21,3 +21,38 @@ def split_into_batches(objects: Sequence[T], batch_size: int) -> list[list[T]]:
         objects = list(objects)
     num_batches = ceil(len(objects) / batch_size)
     return [objects[i * batch_size : (i + 1) * batch_size] for i in range(num_batches)]
+
+
+def pack_into_batches(
+    objects: Sequence[T], sizes: Sequence[int], max_size: int, max_count: int
+) -> list[list[T]]:
+    """
+    Splits a list of objects, in order, into batches whose sizes add up to at
+    most max_size, with at most max_count objects each. An object larger than
+    max_size gets a batch of its own.
+    ---
+    Parameters
+        objects: Sequence[T]
+                The list of objects to be split into batches.
+        sizes: Sequence[int]
+                The size of each object, e.g. its number of tokens.
+        max_size: int
+                The largest total size of a batch.
+        max_count: int
+                The largest number of objects in a batch.
+    Returns
+        batches: list[list[T]]
+                The list of batches of objects.
+    """
+    batches: list[list[T]] = []
+    batch: list[T] = []
+    batch_size = 0
+    for obj, size in zip(objects, sizes):
+        if batch and (batch_size + size > max_size or len(batch) == max_count):
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append(obj)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
@@ -0,0 +1,18 @@
+import os
+
+
+def store_path(variable: str, default: str) -> str | None:
+    """
+    Returns the path of a local SQLite store from an environment variable,
+    or None to keep the store in memory. Stores are kept in memory in the
+    test environment, and when the variable is set to an empty string.
+    """
+    if os.getenv("ENVIRONMENT") == "TEST":
+        return None
+    return os.getenv(variable, default) or None
+
+
+EMBEDDING_CACHE_PATH = store_path("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+KEYWORD_INDEX_PATH = store_path("KEYWORD_INDEX_PATH", "keyword_index.sqlite3")
+REPLY_GRAPH_PATH = store_path("REPLY_GRAPH_PATH", "reply_graph.sqlite3")
+IMPORT_LEDGER_PATH = store_path("IMPORT_LEDGER_PATH", "import_ledger.sqlite3")
@@ -0,0 +1,61 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, ParamSpec, TypeVar
+
+T = TypeVar("T")
+P = ParamSpec("P")
+
+# One bounded pool per external dependency, so a slow dependency can only
+# exhaust its own threads and never the event loop or the other pools.
+OPENAI_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("OPENAI_MAX_WORKERS", 16)), thread_name_prefix="openai"
+)
+PINECONE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PINECONE_MAX_WORKERS", 8)),
+    thread_name_prefix="pinecone",
+)
+MONGO_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MONGO_MAX_WORKERS", 8)), thread_name_prefix="mongo"
+)
+
+# Tokenizing and the embedding cache are CPU and local disk work, they never
+# wait behind slow requests in the OpenAI pool
+CPU_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CPU_MAX_WORKERS", 4)), thread_name_prefix="cpu"
+)
+
+# History exports are read and parsed off the event loop, a batch at a time
+IMPORT_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("IMPORT_MAX_WORKERS", 2)), thread_name_prefix="import"
+)
+
+# Local indexes are written from a single thread, which keeps their disk
+# writes in order without holding up the event loop
+INDEX_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index")
+
+
+async def run_blocking(
+    executor: ThreadPoolExecutor,
+    func: Callable[P, T],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> T:
+    """
+    Runs a blocking function in the given thread pool and awaits its result
+    without blocking the event loop.
+    ---
+    Parameters
+        executor: ThreadPoolExecutor
+                The pool of the dependency the function talks to.
+        func: Callable[P, T]
+                The blocking function to call.
+        *args, **kwargs:
+                The arguments to call func with.
+    Returns
+        result: T
+                The return value of func.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
@@ -0,0 +1,58 @@
+from collections import Counter, deque
+
+# Number of timings kept per metric to compute percentiles from
+MAX_SAMPLES = 1000
+
+counters: Counter[str] = Counter()
+timings: dict[str, deque[float]] = {}
+
+
+def increment(name: str, amount: int = 1) -> None:
+    """
+    Adds amount to the counter with the given name.
+    """
+    counters[name] += amount
+
+
+def observe(name: str, seconds: float) -> None:
+    """
+    Records a timing, keeping the latest MAX_SAMPLES timings per name.
+    """
+    timings.setdefault(name, deque(maxlen=MAX_SAMPLES)).append(seconds)
+
+
+def percentile(name: str, q: float) -> float | None:
+    """
+    Returns the q-th percentile (0-100) of the recorded timings of a name,
+    or None if nothing was recorded.
+    """
+    samples = sorted(timings.get(name, ()))
+    if not samples:
+        return None
+    index = round(q / 100 * (len(samples) - 1))
+    return samples[index]
+
+
+def snapshot() -> dict[str, float]:
+    """
+    Returns all counters, and the p50 and p95 of all timings.
+    """
+    values: dict[str, float] = dict(counters)
+    for name in timings:
+        for q in (50, 95):
+            value = percentile(name, q)
+            if value is not None:
+                values[f"{name}.p{q}"] = value
+    return values
+
+
+def summary() -> str:
+    """
+    Returns the snapshot as one line of name=value pairs, sorted by name.
+    """
+    return " ".join(f"{name}={value:g}" for name, value in sorted(snapshot().items()))
+
+
+def reset() -> None:
+    counters.clear()
+    timings.clear()
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[K, T]):
+    """
+    Deduplicates concurrent calls: while a call for a key is in flight,
+    later callers with the same key await its result instead of making
+    their own call.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[K, asyncio.Future[T]] = {}
+        self.shared = 0  # number of calls that joined one already in flight
+
+    async def do(self, key: K, func: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """
+        Calls func, unless a call for the same key is already in flight.
+        ---
+        Parameters
+            key: K
+                    The key identifying identical calls.
+            func: Callable[[], Awaitable[T]]
+                    Makes the call.
+        Returns
+            result: tuple[T, bool]
+                    The result of the call, and whether it was shared with
+                    a call made by another caller.
+        """
+        if key in self._calls:
+            self.shared += 1
+            # a cancelled follower must not cancel the call for everyone else
+            return await asyncio.shield(self._calls[key]), True
+
+        call = asyncio.ensure_future(func())
+        self._calls[key] = call
+        call.add_done_callback(lambda _: self._forget(key, call))
+        return await asyncio.shield(call), False
+
+    def _forget(self, key: K, call: asyncio.Future[T]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from typing import Any, Iterable, Sequence
+
+from utils.batch import split_into_batches
+
+# Values bound per query, below SQLite's limit of variables per statement
+MAX_VARIABLES = 500
+
+
+class SQLiteStore:
+    """
+    The SQLite table a local index or cache persists its entries in.
+
+    Indexes keep their entries in memory and write them through to the
+    store, and reload them from it after a restart. They are written from
+    thread pools while they are read elsewhere, so the in-memory structures
+    and the table are guarded together by `lock`. Without a path nothing is
+    persisted: reads return no rows and writes are dropped.
+    """
+
+    def __init__(self, path: str | None, schema: str) -> None:
+        """
+        Opens the database at path, creating its tables with the statements
+        of `schema`.
+        """
+        self.lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.executescript(schema)
+
+    @property
+    def persistent(self) -> bool:
+        return self._connection is not None
+
+    def select(self, sql: str, parameters: Sequence[Any] = ()) -> list[Any]:
+        """
+        Returns the rows of a query.
+        """
+        if self._connection is None:
+            return []
+        return self._connection.execute(sql, parameters).fetchall()
+
+    def select_in(
+        self, sql: str, parameters: Sequence[Any], values: Sequence[Any]
+    ) -> list[Any]:
+        """
+        Returns the rows of a query matching a column against many values,
+        MAX_VARIABLES values at a time.
+        ---
+        Parameters
+            sql: str
+                    The query, with `{}` where the placeholders of the values
+                    go, as in `... WHERE key IN ({})`.
+            parameters: Sequence[Any]
+                    The parameters bound before the values.
+            values: Sequence[Any]
+                    The values to match.
+        Returns
+            rows: list[Any]
+                    The rows of all batches of values.
+        """
+        rows: list[Any] = []
+        for batch in split_into_batches(values, MAX_VARIABLES):
+            placeholders = ", ".join("?" * len(batch))
+            rows += self.select(sql.format(placeholders), (*parameters, *batch))
+        return rows
+
+    def write(self, sql: str, rows: Iterable[Sequence[Any]]) -> None:
+        """
+        Runs a statement once per row and commits.
+        """
+        if self._connection is None:
+            return
+        self._connection.executemany(sql, rows)
+        self._connection.commit()
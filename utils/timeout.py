@@ -1,51 +1,81 @@
-from threading import Thread
-from functools import wraps
-from typing import Any, Callable, TypeVar
+import asyncio
+import builtins
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Mapping
 
-T = TypeVar("T")
-U = TypeVar("U")
+from utils import metrics
 
+# Overall time a /q question may take, and the share each stage may use of it
+QUESTION_SLA = float(os.getenv("QUESTION_SLA_SECONDS", 30))
+STAGE_BUDGETS: dict[str, float] = {
+    "embed": float(os.getenv("EMBED_BUDGET_SECONDS", 5)),
+    "retrieval": float(os.getenv("RETRIEVAL_BUDGET_SECONDS", 5)),
+    "completion": float(os.getenv("COMPLETION_BUDGET_SECONDS", 25)),
+}
+# Blocking clients get slightly more time than their stage, so the stage
+# times out first and their sockets are closed shortly after
+CLIENT_TIMEOUT_GRACE = 0.5
 
-class TimeoutError(Exception):
-    pass
 
+class TimeoutError(builtins.TimeoutError):
+    def __init__(self, message: str, stage: str | None = None) -> None:
+        super().__init__(message)
+        self.stage = stage
 
-def timeout(timeout: int) -> Callable[[Callable[..., T]], Callable[..., T]]:
+
+class Deadline:
     """
-    Parameters
-    ----------
-    timeout: int
-        timeout in seconds
+    An overall time budget, split into per-stage budgets.
+
+    Each stage runs under asyncio.timeout, so the awaited work is cancelled
+    when its budget runs out, and the time it took is recorded as the
+    stages.<name> metric. A stage never gets more time than what is left
+    of the overall budget. Blocking client calls running in a thread can't be
+    cancelled, so the stage hands out a timeout for them to use instead.
     """
 
-    def deco(func: Callable[..., T]) -> Callable[..., T]:
-        @wraps(func)
-        def wrapper(*args: Any, **kwargs: Any) -> T:
-            res: list[Exception | T] = [
-                TimeoutError(
-                    f"function {func.__name__} timeout [{timeout} seconds] exceeded!"
-                )
-            ]
-
-            def newFunc() -> None:
-                try:
-                    res[0] = func(*args, **kwargs)
-                except Exception as e:
-                    res[0] = e
-
-            t = Thread(target=newFunc)
-            t.daemon = True
-            try:
-                t.start()
-                t.join(timeout)
-            except Exception as je:
-                print("error starting thread")
-                raise je
-            ret = res[0]
-            if isinstance(ret, BaseException):
-                raise ret
-            return ret
-
-        return wrapper
-
-    return deco
+    def __init__(
+        self,
+        total: float = QUESTION_SLA,
+        budgets: Mapping[str, float] = STAGE_BUDGETS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.total = total
+        self.budgets = budgets
+        self._clock = clock
+        self._expires_at = clock() + total
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires_at - self._clock())
+
+    def budget(self, stage: str) -> float:
+        return min(self.budgets.get(stage, self.total), self.remaining())
+
+    @asynccontextmanager
+    async def stage(self, name: str) -> AsyncIterator[float]:
+        """
+        Runs the body of the context as the named stage.
+        ---
+        Yields
+            client_timeout: float
+                    The timeout, in seconds, to give blocking client calls
+                    made in the stage.
+        Raises
+            TimeoutError
+                    If the stage did not complete within its budget.
+        """
+        budget = self.budget(name)
+        started = self._clock()
+        try:
+            async with asyncio.timeout(budget):
+                yield budget + CLIENT_TIMEOUT_GRACE
+            metrics.observe(f"stages.{name}", self._clock() - started)
+        except builtins.TimeoutError as e:
+            if isinstance(e, TimeoutError):
+                raise  # an inner stage already timed out
+            metrics.increment(f"timeouts.{name}")
+            raise TimeoutError(
+                f"stage {name} timeout [{budget:.2f} seconds] exceeded!", stage=name
+            ) from None